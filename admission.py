@@ -0,0 +1,176 @@
+"""
+Admission control: keeps a burst of one kind of request from starving the others.
+
+Requests are admitted per class, each with its own concurrency limit and a
+bounded FIFO queue: reads, writes, and heavy routes (payouts, rounds, bulk
+imports, exports) which hold a connection for long or take many row locks.
+A request that finds the queue of its class full, or waits longer than the
+class timeout, is answered 503 with Retry-After at once instead of timing
+out on the connection pool. Low priority classes are also shed while the
+pool has no connection left, so what remains goes to reads and writes.
+"""
+from collections import Counter, deque
+from starlette.responses import JSONResponse
+import asyncio
+import time
+
+from metrics import Histogram
+
+QUEUE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class AdmissionClass:
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        queue_size: int,
+        timeout: float,
+        low_priority: bool = False
+    ):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.low_priority = low_priority
+        self.active = 0
+        self.admitted = 0
+        self.shed = Counter()
+        self.wait_time = Histogram(QUEUE_WAIT_BUCKETS)
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        """Take a slot, queueing for it at most `timeout`. Returns the reason when shed."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.queue_size:
+            return self.reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            return self.reject("timeout")
+        except asyncio.CancelledError:
+            # The client went away: pass on a slot it was handed in the meantime.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            self.wait_time.observe(time.perf_counter() - started)
+        self.admitted += 1
+        return None
+
+    def release(self):
+        # The slot goes straight to the first waiter still queued, `active` is unchanged.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def reject(self, reason: str):
+        self.shed[reason] += 1
+        return reason
+
+
+class AdmissionControl:
+    def __init__(self, classes: list, retry_after: int = 1, pool=None, pool_capacity: int = 0):
+        self.classes = {admission_class.name: admission_class for admission_class in classes}
+        self.retry_after = retry_after
+        self.pool = pool
+        self.pool_capacity = pool_capacity
+        self.exempt_paths = set()
+        # (method, route path) -> class name; the others are "read" or "write" by method.
+        self.routes = {}
+        self._routes = None
+
+    def assign(self, class_name: str, *routes):
+        for method, path in routes:
+            self.routes[(method, path)] = class_name
+
+    def exempt(self, *paths):
+        self.exempt_paths.update(paths)
+
+    def exempt_routes(self, *routes):
+        """Routes left out of admission, matched like the assigned ones: long-lived streams."""
+        self.assign(None, *routes)
+
+    def pool_saturated(self):
+        return self.pool is not None and self.pool.checkedout() >= self.pool_capacity
+
+    def classify(self, scope):
+        """Admission class of a request, None for the exempt paths and routes."""
+        if scope["path"] in self.exempt_paths:
+            return None
+        if self._routes is None:
+            # Only the assigned routes are matched: the others need the method alone.
+            self._routes = [
+                (method, route.path_regex, self.routes[(method, route.path)])
+                for route in scope["app"].routes
+                for method in getattr(route, "methods", None) or ()
+                if (method, route.path) in self.routes
+            ]
+        for method, path_regex, class_name in self._routes:
+            if scope["method"] == method and path_regex.match(scope["path"]):
+                return None if class_name is None else self.classes[class_name]
+        return self.classes["read" if scope["method"] in ("GET", "HEAD") else "write"]
+
+    def export(self, writer):
+        for admission_class in self.classes.values():
+            labels = {"class": admission_class.name}
+            writer.add("admission_limit", "gauge", "Concurrent requests admitted per class.",
+                       admission_class.limit, **labels)
+            writer.add("admission_active", "gauge", "Requests being served.",
+                       admission_class.active, **labels)
+            writer.add("admission_queued", "gauge", "Requests waiting for a slot.",
+                       admission_class.queued, **labels)
+            writer.add("admission_admitted_total", "counter", "Requests admitted.",
+                       admission_class.admitted, **labels)
+            for reason in ("queue_full", "timeout", "pool_saturated"):
+                writer.add("admission_shed_total", "counter", "Requests answered 503.",
+                           admission_class.shed[reason], **labels, reason=reason)
+            writer.add_histogram("admission_queue_wait_seconds", "Time queued for a slot.",
+                                 admission_class.wait_time, **labels)
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        admission_class = self.control.classify(scope)
+        if admission_class is None:
+            return await self.app(scope, receive, send)
+
+        if admission_class.low_priority and self.control.pool_saturated():
+            reason = admission_class.reject("pool_saturated")
+        else:
+            reason = await admission_class.acquire()
+        if reason is not None:
+            response = JSONResponse(
+                {"detail": "Server overloaded, retry later."},
+                status_code=503,
+                headers={"Retry-After": str(self.control.retry_after)}
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_class.release()
@@ -0,0 +1,452 @@
+"""
+CRUD functions of the API, on an AsyncSession. The statements are built by
+statements.py, shared with the scripts (crud.py, benchmarks).
+"""
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from uuid import UUID
+from statements import (
+    USER_SORTS, TOURNAMENT_SORTS, MATCH_SORT_COLUMNS,
+    registered_tournaments_touch_statement, tournament_row_query,
+    new_user, new_tournament, users_search_query, users_matches_query, users_matches,
+    registered_count_query, check_capacity, registration_statement,
+    players_score_append_statement, leaderboard_page_query, leaderboard_page,
+    leaderboard_around_query, leaderboard_around,
+    leaderboard_query, played_pairs_query,
+    round_pairings, insert_matches_statements, score_deltas_statements,
+    players_score_sync_statement, played_round, rewards_statements, tournament_update,
+    payout_marker_statement, payout_lock_statement, payout_statement, already_paid,
+    players_score_increment_statement, match_deltas, match_scored_statement, already_scored,
+    user_stats_query, users_count_query, head_to_head_query,
+    tournament_matches_query, match_partitions_statement
+)
+from cache import entity_cache
+from pagination import keyset_page, next_cursor
+import models
+import rounds
+import schemas
+
+
+async def create_user(db: AsyncSession, user: schemas.User):
+    db_user = new_user(user)
+    db.add(db_user)
+    await db.commit()
+    return await get_user(db, db_user.id)
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(
+        select(models.User).filter(models.User.username == username).limit(1)
+    )
+    return result.scalars().first()
+
+
+async def get_user_by_phone_number(db: AsyncSession, phone_number: str):
+    result = await db.execute(
+        select(models.User).filter(models.User.phone_number == phone_number).limit(1)
+    )
+    return result.scalars().first()
+
+
+async def get_user(db: AsyncSession, user_id: UUID):
+    """The columns of the user, cached: see get_users_matches for its match history."""
+    db_user = entity_cache.get(db, models.User, user_id)
+    if db_user is None:
+        result = await db.execute(select(models.User).filter(models.User.id == user_id))
+        db_user = entity_cache.set(db, models.User, result.scalars().first())
+    return db_user
+
+
+async def get_users(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    filter: str = "",
+    mode: schemas.UserSearchMode = schemas.UserSearchMode.contains,
+    columns: tuple = None
+):
+    """With `columns`, return rows of these columns instead of users."""
+    result = await db.execute(
+        users_search_query(select(*(columns or (models.User,))), filter, mode)
+        .order_by(models.User.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    return result.all() if columns else result.scalars().all()
+
+
+async def get_users_page(
+    db: AsyncSession,
+    limit: int = 100,
+    filter: str = "",
+    mode: schemas.UserSearchMode = schemas.UserSearchMode.contains,
+    sort: schemas.UserSort = schemas.UserSort.id,
+    cursor: str = None,
+    columns: tuple = None
+):
+    """
+    Return (users, next_cursor) with keyset pagination on `sort`.
+    The ranked search mode orders by relevance and only supports `get_users`.
+    With `columns`, users are rows of these columns, which must include the sort ones.
+    """
+    (sort_columns, descending) = USER_SORTS[sort]
+    result = await db.execute(keyset_page(
+        users_search_query(select(*(columns or (models.User,))), filter, mode),
+        sort_columns, sort.value, cursor, limit, descending
+    ))
+    users = result.all() if columns else result.scalars().all()
+    return users, next_cursor(users, sort_columns, sort.value, limit)
+
+
+async def get_users_matches(db: AsyncSession, user_ids: list, limit: int = 20):
+    """Return {user_id: (matches_as_player_one, matches_as_player_two)}."""
+    rows = await db.execute(users_matches_query(user_ids, limit))
+    return users_matches(rows, user_ids)
+
+
+async def get_user_stats(db: AsyncSession, user_id: UUID):
+    row = (await db.execute(user_stats_query(user_id))).first()
+    return None if row is None else schemas.UserStats(**row._mapping)
+
+
+async def get_head_to_head(db: AsyncSession, user_id: UUID, opponent_id: UUID):
+    """None if either player does not exist."""
+    users_count = (await db.execute(users_count_query({user_id, opponent_id}))).scalar()
+    if users_count < len({user_id, opponent_id}):
+        return None
+    row = (await db.execute(head_to_head_query(user_id, opponent_id))).one()
+    return schemas.HeadToHead(user_id=user_id, opponent_id=opponent_id, **row._mapping)
+
+
+async def update_user(db: AsyncSession, db_user: schemas.User, user_data: schemas.UserUpdate):
+    user_data_dict = user_data.dict(exclude_unset=True)
+    for key, value in user_data_dict.items():
+        setattr(db_user, key, value)
+    db.add(db_user)
+    if "username" in user_data_dict:
+        await db.execute(registered_tournaments_touch_statement(db_user.id))
+    await db.commit()
+    entity_cache.invalidate(models.User, db_user.id)
+    return await get_user(db, db_user.id)
+
+
+async def delete_user(db: AsyncSession, db_user: schemas.User):
+    user = await get_user(db, db_user.id)
+    if user is not None:
+        user_data = schemas.UserUpdate(
+            username="Anonymous",
+            phone_number="0000000000",
+            points=0
+        )
+        await update_user(db, db_user, user_data)
+
+
+async def create_match(db: AsyncSession, match: schemas.Match, tournament_id: UUID = None):
+    db_match = models.Match(
+        player_one_id=match.player_one_id,
+        player_two_id=match.player_two_id,
+        tournament_id=tournament_id,
+    )
+    db.add(db_match)
+    await db.commit()
+    entity_cache.invalidate(models.User, db_match.player_one_id, db_match.player_two_id)
+    await db.refresh(db_match)
+    return db_match
+
+
+async def get_match(db: AsyncSession, match_id: UUID):
+    result = await db.execute(select(models.Match).filter(models.Match.id == match_id))
+    return result.scalars().first()
+
+
+async def get_tournament_matches_page(
+    db: AsyncSession,
+    db_tournament: schemas.Tournament,
+    limit: int = 100,
+    cursor: str = None,
+    player_id: UUID = None,
+    columns: tuple = None
+):
+    """
+    Return (matches, next_cursor), oldest first, with keyset pagination. With
+    `columns`, matches are rows of these columns, which must include created_at and id.
+    """
+    query = keyset_page(
+        tournament_matches_query(select(*(columns or (models.Match,))), db_tournament, player_id),
+        MATCH_SORT_COLUMNS, "created_at", cursor, limit
+    )
+    result = await db.execute(query)
+    matches = result.all() if columns else result.scalars().all()
+    return matches, next_cursor(matches, MATCH_SORT_COLUMNS, "created_at", limit)
+
+
+async def create_match_partitions(db: AsyncSession):
+    """Create the monthly partitions of matches due in the next months, see migrations/0003."""
+    await db.execute(match_partitions_statement())
+    await db.commit()
+
+
+async def update_match(
+    db: AsyncSession,
+    db_match: schemas.Match,
+    match_data: schemas.MatchUpdate
+):
+    match_data_dict = match_data.dict(exclude_unset=True)
+    for key, value in match_data_dict.items():
+        setattr(db_match, key, value)
+    db.add(db_match)
+    await db.commit()
+    entity_cache.invalidate(models.User, db_match.player_one_id, db_match.player_two_id)
+    await db.refresh(db_match)
+    return db_match
+
+
+async def delete_match(db: AsyncSession, db_match: schemas.Match):
+    await db.delete(db_match)
+    await db.commit()
+    entity_cache.invalidate(models.User, db_match.player_one_id, db_match.player_two_id)
+
+
+async def create_tournament(db: AsyncSession, tournament: schemas.TournamentCreateUpdate):
+    db_tournament = new_tournament(tournament)
+    db.add(db_tournament)
+    await db.flush()
+    for statement in rewards_statements(db_tournament.id, db_tournament.rewards_range):
+        await db.execute(statement)
+    await db.commit()
+    await db.refresh(db_tournament)
+    return db_tournament
+
+
+async def get_tournament(db: AsyncSession, tournament_id: UUID, for_update: bool = False):
+    """Cached, unless `for_update`: a locked read always returns the current row."""
+    query = select(models.Tournament).filter(models.Tournament.id == tournament_id)
+    if for_update:
+        query = query.with_for_update().execution_options(populate_existing=True)
+        return (await db.execute(query)).scalars().first()
+    db_tournament = entity_cache.get(db, models.Tournament, tournament_id)
+    if db_tournament is None:
+        result = await db.execute(query)
+        db_tournament = entity_cache.set(db, models.Tournament, result.scalars().first())
+    return db_tournament
+
+
+async def get_tournament_row(db: AsyncSession, tournament_id: UUID, columns: tuple):
+    """Row of `columns` of a tournament, read without the ORM nor the cache."""
+    return (await db.execute(tournament_row_query(tournament_id, columns))).first()
+
+
+async def get_tournaments(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    columns: tuple = None
+):
+    """With `columns`, return rows of these columns instead of tournaments."""
+    result = await db.execute(
+        select(*(columns or (models.Tournament,)))
+        .order_by(models.Tournament.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    return result.all() if columns else result.scalars().all()
+
+
+async def get_tournaments_page(
+    db: AsyncSession,
+    limit: int = 100,
+    sort: schemas.TournamentSort = schemas.TournamentSort.id,
+    cursor: str = None,
+    columns: tuple = None
+):
+    (sort_columns, descending) = TOURNAMENT_SORTS[sort]
+    result = await db.execute(keyset_page(
+        select(*(columns or (models.Tournament,))),
+        sort_columns, sort.value, cursor, limit, descending
+    ))
+    tournaments = result.all() if columns else result.scalars().all()
+    return tournaments, next_cursor(tournaments, sort_columns, sort.value, limit)
+
+
+async def update_tournament(
+    db: AsyncSession,
+    db_tournament: schemas.Tournament,
+    tournament_data: schemas.TournamentCreateUpdate
+):
+    statements = tournament_update(db_tournament, tournament_data.dict(exclude_unset=True))
+    db.add(db_tournament)
+    for statement in statements:
+        await db.execute(statement)
+    await db.commit()
+    entity_cache.invalidate(models.Tournament, db_tournament.id)
+    await db.refresh(db_tournament)
+    return db_tournament
+
+
+async def delete_tournament(db: AsyncSession, db_tournament: schemas.Tournament):
+    await db.delete(db_tournament)
+    await db.commit()
+    entity_cache.invalidate(models.Tournament, db_tournament.id)
+
+
+async def register_player(
+    db: AsyncSession,
+    db_tournament: schemas.Tournament,
+    user: schemas.UserCreate
+):
+    """
+    Register a player (created on the fly if unknown) in a single transaction.
+    `db_tournament` must have been loaded with `for_update=True`: its row lock
+    serializes concurrent registrations so `max_player` cannot be exceeded.
+    """
+    users_registered = (await db.execute(registered_count_query(db_tournament.id))).scalar()
+    check_capacity(db_tournament, users_registered)
+
+    db_user = await get_user_by_username(db, username=user.username)
+    if db_user is None:
+        if await get_user_by_phone_number(db, phone_number=user.phone_number):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="An user with this phone number already exists."
+            )
+        db_user = new_user(user)
+        db.add(db_user)
+        await db.flush()
+
+    registration = await db.execute(registration_statement(db_tournament.id, db_user.id))
+    if registration.rowcount == 0:
+        raise HTTPException(
+            status_code=406,
+            detail="Already registered in this tournament."
+        )
+
+    await db.execute(players_score_append_statement(db_tournament.id, db_user.id))
+    await db.commit()
+    entity_cache.invalidate(models.Tournament, db_tournament.id)
+    await db.refresh(db_tournament)
+    return db_tournament
+
+
+async def get_leaderboard(db: AsyncSession, tournament_id: UUID, skip: int = 0, limit: int = None):
+    """
+    Return the standings of a tournament as [user_id, score] pairs, best first.
+    The rank of each row is its position plus `skip`.
+    """
+    query = leaderboard_query(tournament_id, skip, limit)
+    return [[str(user_id), score] for user_id, score in await db.execute(query)]
+
+
+async def get_leaderboard_entries(
+    db: AsyncSession,
+    tournament_id: UUID,
+    limit: int = None,
+    skip: int = 0,
+    cursor: str = None
+):
+    """
+    Return (entries, next_cursor): a page of the standings with usernames joined
+    in the same query. `cursor` continues right after the last row of a previous page.
+    """
+    query, first_rank = leaderboard_page_query(tournament_id, limit, skip, cursor)
+    return leaderboard_page(await db.execute(query), first_rank, limit)
+
+
+async def get_leaderboard_around(
+    db: AsyncSession,
+    tournament_id: UUID,
+    user_id: UUID,
+    neighbours: int = 5
+):
+    """
+    Return the entries of a player and of up to `neighbours` players on each side,
+    ranks included, in a single round trip.
+    """
+    query = leaderboard_around_query(tournament_id, user_id, neighbours)
+    return leaderboard_around((await db.execute(query)).all(), user_id)
+
+
+async def record_match_result(db: AsyncSession, tournament_id: UUID, db_match: schemas.Match):
+    """
+    Credit the points of a played match to both players with in-database
+    increments of their ranked score and players_score entry: concurrent
+    results do not overwrite each other and the cost does not grow with the
+    number of players. The match is marked scored in the same transaction: a
+    replayed result is refused (409) and rolled back instead of being credited twice.
+    Locks are taken in the order of rounds: the tournament row first, then the
+    user_stats rows (by the trigger on matches), then the score rows.
+    """
+    deltas = match_deltas(db_match)
+    await db.execute(players_score_increment_statement(tournament_id, deltas))
+    if (await db.execute(match_scored_statement(db_match))).scalar() is None:
+        await db.rollback()
+        raise already_scored()
+    for statement in score_deltas_statements(tournament_id, deltas):
+        await db.execute(statement)
+    await db.commit()
+    entity_cache.invalidate(models.Tournament, tournament_id)
+    return deltas
+
+
+def _invalidate_round(db_tournament: schemas.Tournament, deltas: dict):
+    entity_cache.invalidate(models.Tournament, db_tournament.id)
+    entity_cache.invalidate(models.User, *deltas)
+
+
+async def play_round(
+    db: AsyncSession,
+    db_tournament: schemas.Tournament,
+    pairing: schemas.PairingSystem = schemas.PairingSystem.swiss,
+    round: int = 1
+):
+    """
+    Pair every registered player, create and simulate all matches of the round
+    and apply the score deltas in a single transaction. `db_tournament` should be
+    locked with `for_update=True` so two rounds cannot be played concurrently.
+    """
+    standings = await get_leaderboard(db, db_tournament.id)
+    played_rows = []
+    if pairing == schemas.PairingSystem.swiss:
+        played_rows = (await db.execute(played_pairs_query(db_tournament))).all()
+    pairs, byes = round_pairings(standings, played_rows, pairing, round)
+
+    matches = [
+        {**match, "tournament_id": db_tournament.id} for match in rounds.play_matches(pairs)
+    ]
+    for statement in insert_matches_statements(matches):
+        await db.execute(statement)
+    deltas = rounds.score_deltas(matches, byes)
+    if deltas:
+        for statement in score_deltas_statements(db_tournament.id, deltas):
+            await db.execute(statement)
+        await db.execute(players_score_sync_statement(db_tournament.id))
+    await db.commit()
+    _invalidate_round(db_tournament, deltas)
+    return played_round(db_tournament, pairing, round, matches, byes)
+
+
+def _paid_out(db_tournament: schemas.Tournament, paid_out_at, paid_ids: list):
+    entity_cache.invalidate(models.Tournament, db_tournament.id)
+    entity_cache.invalidate(models.User, *paid_ids)
+    return schemas.Payout(
+        tournament_id=db_tournament.id, paid_out_at=paid_out_at, players_paid=len(paid_ids)
+    )
+
+
+async def pay_out_rewards(db: AsyncSession, db_tournament: schemas.Tournament):
+    """
+    Pay the rewards of a tournament to its final standings, exactly once: the
+    paid_out_at marker is set in the same transaction as the points credit,
+    so a rerun (or a concurrent call) is a no-op. Refused (406) before its end,
+    which the final standings would otherwise never be paid at.
+    """
+    paid_out_at = (await db.execute(payout_marker_statement(db_tournament.id))).scalar()
+    if paid_out_at is None:
+        await db.rollback()
+        await db.refresh(db_tournament)
+        return already_paid(db_tournament)
+
+    await db.execute(payout_lock_statement(db_tournament.id))
+    paid_ids = (await db.execute(payout_statement(db_tournament.id))).scalars().all()
+    await db.commit()
+    return _paid_out(db_tournament, paid_out_at, paid_ids)
@@ -0,0 +1,110 @@
+"""
+Cold start of a worker: time to import the app, to answer /health/live and to
+be ready (/health/ready, pool warmed up), over several fresh processes.
+
+Compared with the "cold-start" entry of benchmarks/baseline.json like the
+suite: a regression beyond --tolerance exits with status 1.
+
+    python -m benchmarks.cold_start --runs 5
+"""
+from pathlib import Path
+import argparse
+import httpx
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+BASELINE_KEY = "cold-start"
+ENV = {**os.environ, "SCHEDULER_ENABLED": "False"}
+
+
+def _time_import():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main"], env=ENV, check=True)
+    return time.perf_counter() - started
+
+
+def _wait_for(url: str, server, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited during startup.")
+        try:
+            if httpx.get(url).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{url} did not answer within {timeout}s.")
+
+
+def _time_boot(port: int):
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning"],
+        env=ENV
+    )
+    try:
+        _wait_for(f"http://127.0.0.1:{port}/health/live", server)
+        live = time.perf_counter() - started
+        _wait_for(f"http://127.0.0.1:{port}/health/ready", server)
+        return live, time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run(runs: int, port: int):
+    imports, lives, readies = [], [], []
+    for _ in range(runs):
+        imports.append(_time_import())
+        (live, ready) = _time_boot(port)
+        lives.append(live)
+        readies.append(ready)
+    return {
+        "import": statistics.median(imports) * 1000,
+        "live": statistics.median(lives) * 1000,
+        "ready": statistics.median(readies) * 1000,
+    }
+
+
+def main(args):
+    results = run(args.runs, args.port)
+    print(f"cold start, median of {args.runs} runs:")
+    for phase, value in results.items():
+        print(f"{phase:<8}{value:>9.1f} ms")
+
+    baselines = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    if args.save_baseline:
+        baselines[BASELINE_KEY] = {phase: round(value, 2) for phase, value in results.items()}
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline {BASELINE_KEY} saved to {BASELINE_PATH}")
+        return True
+    if BASELINE_KEY not in baselines:
+        print(f"No baseline for {BASELINE_KEY}, run with --save-baseline to record one.")
+        return True
+    regressions = [
+        f"{phase}: {value:.1f} ms vs {baselines[BASELINE_KEY][phase]:.1f} ms in the baseline"
+        for phase, value in results.items()
+        if value > baselines[BASELINE_KEY].get(phase, float("inf")) * (1 + args.tolerance)
+    ]
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if not regressions:
+        print(f"OK (within {args.tolerance:.0%} of the {BASELINE_KEY} baseline)")
+    return not regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed ratio over the baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    sys.exit(0 if main(parser.parse_args()) else 1)
@@ -0,0 +1,102 @@
+"""
+Concurrency benchmark for tournament registration.
+
+Fires parallel signups (plus a share of duplicate ones) at a single tournament
+and checks that capacity and uniqueness hold, then reports the throughput.
+
+    python -m benchmarks.registration --players 500 --max-player 400 --workers 32
+"""
+from fastapi import HTTPException
+from sqlalchemy import func
+import argparse
+import asyncio
+import collections
+import datetime as D
+import sys
+import time
+import uuid
+
+from db import SessionLocal, AsyncSessionLocal
+import main
+import migrate
+import models
+import schemas
+
+
+async def register(tournament_id, username, phone_number):
+    async with AsyncSessionLocal() as db:
+        try:
+            await main.register_to_tournament(
+                tournament_id,
+                schemas.UserCreate(username=username, phone_number=phone_number),
+                db
+            )
+            return 200
+        except HTTPException as e:
+            return e.status_code
+
+
+async def register_all(tournament_id, signups, workers: int):
+    semaphore = asyncio.Semaphore(workers)
+
+    async def limited(signup):
+        async with semaphore:
+            return await register(tournament_id, *signup)
+
+    return await asyncio.gather(*(limited(signup) for signup in signups))
+
+
+def run(players: int, max_player: int, workers: int, duplicates: float):
+    migrate.apply()
+    db = SessionLocal()
+    db_tournament = models.Tournament(
+        max_player=max_player,
+        begin=D.datetime.now(D.timezone.utc) + D.timedelta(hours=1),
+        end=D.datetime.now(D.timezone.utc) + D.timedelta(hours=2),
+        rewards_range={}
+    )
+    db.add(db_tournament)
+    db.commit()
+    tournament_id = db_tournament.id
+
+    run_id = uuid.uuid4().hex[:8]
+    signups = [
+        (f"bench-{run_id}-{i}", f"{int(run_id, 16) % 10 ** 4:04d}{i:06d}")
+        for i in range(players)
+    ]
+    signups += signups[:int(players * duplicates)]
+
+    started = time.perf_counter()
+    statuses = asyncio.run(register_all(tournament_id, signups, workers))
+    elapsed = time.perf_counter() - started
+
+    registered = (
+        db.
+        query(func.count(), func.count(func.distinct(models.tournament_user.c.user_id)))
+        .filter(models.tournament_user.c.tournament_id == tournament_id)
+        .one()
+    )
+    db.refresh(db_tournament)
+    scored = len(db_tournament.players_score)
+    db.close()
+
+    expected = min(players, max_player)
+    print(f"signups:     {len(signups)} ({workers} concurrent)")
+    print(f"statuses:    {dict(collections.Counter(statuses))}")
+    print(f"registered:  {registered[0]} rows, {registered[1]} distinct, {scored} scores")
+    print(f"elapsed:     {elapsed:.2f}s ({len(signups) / elapsed:.0f} signups/s)")
+
+    ok = registered[0] == registered[1] == scored == expected
+    print("OK" if ok else f"FAILED: expected exactly {expected} registered players")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--max-player", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--duplicates", type=float, default=0.2,
+                        help="share of signups sent twice")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.players, args.max_player, args.workers, args.duplicates) else 1)
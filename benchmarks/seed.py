@@ -0,0 +1,197 @@
+"""
+Seeds a local Postgres with a benchmark dataset, set-based and idempotent.
+
+Users, tournaments and matches are generated inside Postgres with
+generate_series. Their ids are derived from their number (md5), so a run
+knows every seeded id without reading them back and a second seed of the
+same scale is a no-op.
+
+    python -m benchmarks.seed --scale medium
+"""
+from collections import namedtuple
+from sqlalchemy import text
+import argparse
+import datetime as D
+import hashlib
+import time
+import uuid
+
+from db import engine
+import migrate
+import models
+import statements
+
+Scale = namedtuple("Scale", "users tournaments matches")
+
+SCALES = {
+    # tournaments: players registered to each running tournament.
+    "small": Scale(users=10_000, tournaments=(100, 1_000), matches=100_000),
+    "medium": Scale(users=100_000, tournaments=(100, 1_000, 10_000), matches=1_000_000),
+    "large": Scale(users=1_000_000, tournaments=(100, 1_000, 10_000), matches=5_000_000),
+}
+# Matches per INSERT: the user_stats trigger reads each statement's rows at once.
+MATCH_BATCH = 100_000
+# Matches played in each seeded tournament, per registered player.
+TOURNAMENT_MATCHES = 5
+
+USERS_SQL = text("""
+    INSERT INTO users (id, username, phone_number, points)
+    SELECT md5(:prefix || '-user-' || n)::uuid, :prefix || '-user-' || n,
+           :phone_prefix || lpad(n::text, 8, '0'), (random() * 1000)::int
+    FROM generate_series(1, :users) AS n
+    ON CONFLICT DO NOTHING
+""")
+MATCHES_SQL = text("""
+    INSERT INTO matches
+        (id, player_one_id, player_two_id, result, score_one, score_two, created_at)
+    SELECT gen_random_uuid(), md5(:prefix || '-user-' || one)::uuid,
+           md5(:prefix || '-user-' || two)::uuid,
+           (CASE WHEN score_one > score_two THEN 'PLAYER1'
+                 WHEN score_one < score_two THEN 'PLAYER2' ELSE 'DRAW' END)::result,
+           score_one, score_two, now() - random() * interval '90 days'
+    FROM (
+        SELECT 1 + (random() * (:users - 1))::int AS one,
+               1 + (random() * (:users - 1))::int AS two,
+               5 + (random() * 95)::int AS score_one,
+               5 + (random() * 95)::int AS score_two
+        FROM generate_series(1, :count)
+    ) AS drawn
+    WHERE one <> two
+""")
+TOURNAMENT_SQL = text("""
+    INSERT INTO tournaments
+        (id, max_player, players_score, begin, "end", rewards_sum, rewards_range)
+    VALUES (:id, :players, '{}', now() - interval '1 day', now() + interval '30 days', 0, '{}')
+    ON CONFLICT DO NOTHING
+""")
+TOURNAMENT_MATCHES_SQL = text("""
+    INSERT INTO matches
+        (id, player_one_id, player_two_id, result, score_one, score_two, created_at,
+         tournament_id)
+    SELECT gen_random_uuid(), md5(:prefix || '-user-' || one)::uuid,
+           md5(:prefix || '-user-' || two)::uuid,
+           (CASE WHEN score_one > score_two THEN 'PLAYER1'
+                 WHEN score_one < score_two THEN 'PLAYER2' ELSE 'DRAW' END)::result,
+           score_one, score_two, now() - random() * interval '1 day', :id
+    FROM (
+        SELECT 1 + (random() * (:players - 1))::int AS one,
+               1 + (random() * (:players - 1))::int AS two,
+               5 + (random() * 95)::int AS score_one,
+               5 + (random() * 95)::int AS score_two
+        FROM generate_series(1, :players * :per_player)
+    ) AS drawn
+    WHERE one <> two
+""")
+PLAYERS_SQL = text("""
+    INSERT INTO tournament_user (tournament_id, user_id, score)
+    SELECT :id, md5(:prefix || '-user-' || n)::uuid, (random() * 300)::int
+    FROM generate_series(1, :players) AS n
+""")
+
+
+def prefix(scale: str):
+    return f"bench-{scale}"
+
+
+def _md5_id(value: str):
+    """Same as md5(value)::uuid in Postgres."""
+    return uuid.UUID(hashlib.md5(value.encode()).hexdigest())
+
+
+def user_id(scale: str, n: int):
+    """Id of the n-th seeded user (1-based)."""
+    return _md5_id(f"{prefix(scale)}-user-{n}")
+
+
+def tournament_id(scale: str, players: int):
+    """Id of the running tournament seeded with `players` players."""
+    return _md5_id(f"{prefix(scale)}-tournament-{players}")
+
+
+def is_seeded(scale: str):
+    # Tournaments are seeded last: their presence marks a complete dataset.
+    last = tournament_id(scale, SCALES[scale].tournaments[-1])
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT 1 FROM tournaments WHERE id = :id"), {"id": last}
+        ).first() is not None
+
+
+def seed(scale: str, log=print):
+    if is_seeded(scale):
+        log(f"{scale}: already seeded")
+        return
+    size = SCALES[scale]
+    params = {
+        "prefix": prefix(scale),
+        "phone_prefix": f"1{list(SCALES).index(scale)}",
+        "users": size.users,
+    }
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        connection.execute(USERS_SQL, params)
+    log(f"{scale}: {size.users} users ({time.perf_counter() - started:.1f}s)")
+
+    for offset in range(0, size.matches, MATCH_BATCH):
+        with engine.begin() as connection:
+            connection.execute(
+                MATCHES_SQL, {**params, "count": min(MATCH_BATCH, size.matches - offset)}
+            )
+    log(f"{scale}: {size.matches} matches ({time.perf_counter() - started:.1f}s)")
+
+    for players in size.tournaments:
+        with engine.begin() as connection:
+            id = tournament_id(scale, players)
+            connection.execute(TOURNAMENT_SQL, {"id": id, "players": players})
+            connection.execute(PLAYERS_SQL, {**params, "id": id, "players": players})
+            connection.execute(TOURNAMENT_MATCHES_SQL, {
+                **params, "id": id, "players": players, "per_player": TOURNAMENT_MATCHES
+            })
+            connection.execute(statements.players_score_sync_statement(id))
+    log(f"{scale}: tournaments of {size.tournaments} players "
+        f"({time.perf_counter() - started:.1f}s)")
+    with engine.connect() as connection:
+        connection.execute(text("ANALYZE"))
+
+
+def create_tournaments(
+    scale: str,
+    count: int,
+    players: int,
+    begin: D.datetime,
+    end: D.datetime,
+    max_player: int = None,
+    rewards: dict = None
+):
+    """Fresh tournaments for the scenarios consuming them (registration, payouts)."""
+    ids = [uuid.uuid4() for _ in range(count)]
+    rewards = rewards or {}
+    with engine.begin() as connection:
+        connection.execute(
+            models.Tournament.__table__.insert(),
+            [
+                {
+                    "id": id, "max_player": max_player or players, "players_score": {},
+                    "begin": begin, "end": end, "rewards_range": rewards,
+                    "rewards_sum": sum(statements.rewards_table(rewards).values()),
+                }
+                for id in ids
+            ]
+        )
+        for id in ids:
+            for statement in statements.rewards_statements(id, rewards):
+                connection.execute(statement)
+            if players:
+                connection.execute(
+                    PLAYERS_SQL, {"prefix": prefix(scale), "id": id, "players": players}
+                )
+                connection.execute(statements.players_score_sync_statement(id))
+    return ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    args = parser.parse_args()
+    migrate.apply()
+    seed(args.scale)
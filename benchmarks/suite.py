@@ -0,0 +1,330 @@
+"""
+Latency benchmarks of the hot endpoints against a seeded dataset.
+
+Drives the app in-process through its ASGI interface (or, with --http-workers,
+a uvicorn server with that many worker processes) and reports, per scenario,
+the p50/p95/p99 latencies, the throughput and the queries per request. The
+results are compared with the stored baseline of the same scale and mode:
+a regression beyond --tolerance exits with status 1.
+
+    python -m benchmarks.suite --scale small
+    python -m benchmarks.suite --scale small --save-baseline
+    python -m benchmarks.suite --scale medium --http-workers 4 --requests 2000
+"""
+from pathlib import Path
+from sqlalchemy import event
+import argparse
+import asyncio
+import datetime as D
+import httpx
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from benchmarks import seed
+from db import async_engine
+import main as app
+import migrate
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+# Compared with the baseline: (field, True when higher is worse).
+COMPARED = (("p95", True), ("p99", True), ("throughput", False), ("queries", True))
+
+SCENARIOS = {}
+
+
+def scenario(function):
+    """
+    Register a scenario: `function(client, context, count)` prepares its data
+    (not measured) and returns `request(i)`, the i-th request as
+    (method, url, keyword arguments of httpx).
+    """
+    SCENARIOS[function.__name__] = function
+    return function
+
+
+@scenario
+async def users_search(client, context, count):
+    users = seed.SCALES[context["scale"]].users
+    prefix = seed.prefix(context["scale"])
+
+    def request(i):
+        # Prefixes matching from one user to a few thousands.
+        n = random.randint(1, users)
+        term = f"{prefix}-user-{str(n)[:random.randint(1, len(str(n)))]}"
+        return "GET", "/users/", {"params": {"filter": term, "mode": "prefix", "limit": 50}}
+    return request
+
+
+@scenario
+async def users_page(client, context, count):
+    # Cursors of the first pages, so the measured requests also read deep pages.
+    cursors, cursor = [None], None
+    while len(cursors) < min(count, 200):
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        cursor = (await client.get("/users/", params=params)).headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        cursors.append(cursor)
+
+    def request(i):
+        cursor = cursors[i % len(cursors)]
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        return "GET", "/users/", {"params": params}
+    return request
+
+
+@scenario
+async def registration(client, context, count):
+    now = D.datetime.now(D.timezone.utc)
+    (tournament_id,) = seed.create_tournaments(
+        context["scale"], 1, 0, now + D.timedelta(hours=1), now + D.timedelta(hours=2),
+        max_player=count
+    )
+    phone_prefix = random.randrange(10 ** 3)
+
+    def request(i):
+        return "POST", f"/tournaments/{tournament_id}/register", {"json": {
+            "username": f"bench-reg-{context['run']}-{i}",
+            "phone_number": f"9{phone_prefix:03d}{i:06d}",
+        }}
+    return request
+
+
+@scenario
+async def match_flow(client, context, count):
+    players = seed.SCALES[context["scale"]].tournaments[-1]
+    tournament_id = seed.tournament_id(context["scale"], players)
+
+    def request(i):
+        (one, two) = random.sample(range(1, players + 1), 2)
+        return "POST", f"/tournaments/{tournament_id}/match", {"params": {
+            "player_1_id": str(seed.user_id(context["scale"], one)),
+            "player_2_id": str(seed.user_id(context["scale"], two)),
+        }}
+    return request
+
+
+@scenario
+async def leaderboard(client, context, count):
+    players = seed.SCALES[context["scale"]].tournaments[-1]
+    tournament_id = seed.tournament_id(context["scale"], players)
+
+    def request(i):
+        params = {"limit": 100, "skip": random.randrange(0, players, 100)}
+        return "GET", f"/tournaments/{tournament_id}/leaderboard", {"params": params}
+    return request
+
+
+@scenario
+async def match_listing(client, context, count):
+    players = seed.SCALES[context["scale"]].tournaments[-1]
+    tournament_id = seed.tournament_id(context["scale"], players)
+    url = f"/tournaments/{tournament_id}/matches"
+    cursors, cursor = [None], None
+    while len(cursors) < min(count, 50):
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        cursor = (await client.get(url, params=params)).headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        cursors.append(cursor)
+
+    def request(i):
+        # Every other request: the matches of one player in the tournament.
+        if i % 2:
+            player = seed.user_id(context["scale"], random.randint(1, players))
+            return "GET", url, {"params": {"player_id": str(player)}}
+        cursor = cursors[i % len(cursors)]
+        return "GET", url, {"params": {"limit": 100, **({"cursor": cursor} if cursor else {})}}
+    return request
+
+
+@scenario
+async def end_tournament(client, context, count):
+    # One ended, unpaid tournament of 100 players per request.
+    now = D.datetime.now(D.timezone.utc)
+    tournament_ids = seed.create_tournaments(
+        context["scale"], count, 100, now - D.timedelta(hours=2), now - D.timedelta(hours=1),
+        rewards={"1-1": 100, "2-3": 50, "4-10": 10}
+    )
+
+    def request(i):
+        return "POST", f"/tournaments/{tournament_ids[i]}/end", {}
+    return request
+
+
+class QueryCounter:
+    """Statements run by the API engine, only seen in-process."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *_args):
+        self.count += 1
+
+
+def _percentile(latencies: list, percent: int):
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+async def run_scenario(client, name, context, requests, warmup, concurrency, counter):
+    request = await SCENARIOS[name](client, context, warmup + requests)
+    latencies, errors, semaphore = [], {}, asyncio.Semaphore(concurrency)
+
+    async def send(i, measured):
+        (method, url, kwargs) = request(i)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            errors[response.status_code] = errors.get(response.status_code, 0) + 1
+        elif measured:
+            latencies.append(elapsed)
+
+    await asyncio.gather(*(send(i, False) for i in range(warmup)))
+    queries = counter.count if counter else None
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i, True) for i in range(warmup, warmup + requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50": _percentile(latencies, 50) * 1000,
+        "p95": _percentile(latencies, 95) * 1000,
+        "p99": _percentile(latencies, 99) * 1000,
+        "throughput": requests / elapsed,
+        "queries": (counter.count - queries) / requests if counter else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Regressions of `results` beyond `tolerance` (a ratio) of the baseline."""
+    regressions = []
+    for name, result in results.items():
+        for field, higher_is_worse in COMPARED:
+            (value, reference) = (result.get(field), baseline.get(name, {}).get(field))
+            if value is None or not reference:
+                continue
+            ratio = value / reference if higher_is_worse else reference / value
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    f"{name} {field}: {value:.2f} vs {reference:.2f} in the baseline"
+                )
+    return regressions
+
+
+def report(results: dict):
+    print(f"{'scenario':<16}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}"
+          f"{'queries':>9}  errors")
+    for name, result in results.items():
+        queries = "-" if result["queries"] is None else f"{result['queries']:.1f}"
+        print(f"{name:<16}{result['p50']:>9.1f}{result['p95']:>9.1f}{result['p99']:>9.1f}"
+              f"{result['throughput']:>9.0f}{queries:>9}  {result['errors'] or ''}")
+
+
+def _start_server(workers: int, port: int):
+    # The scheduler would pay out the tournaments the end_tournament scenario measures.
+    # In-process, it never starts: the ASGI client sends no lifespan events.
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(workers),
+         "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "SCHEDULER_ENABLED": "False"}
+    )
+    for _ in range(300):
+        if server.poll() is not None:
+            break
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/metrics/pool")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The benchmark server did not start.")
+
+
+async def run(args):
+    context = {"scale": args.scale, "run": uuid.uuid4().hex[:8]}
+    if args.http_workers:
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60)
+        counter = None
+    else:
+        client = httpx.AsyncClient(app=app.app, base_url="http://bench", timeout=60)
+        counter = QueryCounter(async_engine.sync_engine)
+    results = {}
+    async with client:
+        for name in args.scenarios:
+            results[name] = await run_scenario(
+                client, name, context, args.requests, args.warmup, args.concurrency, counter
+            )
+    await async_engine.dispose()
+    return results
+
+
+def main(args):
+    migrate.apply()
+    seed.seed(args.scale)
+    mode = f"http-{args.http_workers}" if args.http_workers else "in-process"
+    server = _start_server(args.http_workers, args.port) if args.http_workers else None
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f"scale: {args.scale}, mode: {mode}, {args.requests} requests per scenario, "
+          f"concurrency {args.concurrency}")
+    report(results)
+
+    baselines = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    key = f"{args.scale}/{mode}"
+    if args.save_baseline:
+        baselines[key] = {
+            **baselines.get(key, {}),
+            **{
+                name: {field: round(result[field], 2) for field, _ in COMPARED
+                       if result[field] is not None}
+                for name, result in results.items()
+            },
+        }
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline {key} saved to {BASELINE_PATH}")
+        return True
+
+    failed = [name for name, result in results.items() if result["errors"]]
+    for name in failed:
+        print(f"FAILED: {name} answered errors {results[name]['errors']}")
+    if key not in baselines:
+        print(f"No baseline for {key}, run with --save-baseline to record one.")
+        return not failed
+    regressions = compare(results, baselines[key], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if not failed and not regressions:
+        print(f"OK (within {args.tolerance:.0%} of the {key} baseline)")
+    return not failed and not regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=list(seed.SCALES), default="small")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="measured, per scenario")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--http-workers", type=int, default=0,
+                        help="serve the app with uvicorn and this many workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed ratio over the baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    sys.exit(0 if main(parser.parse_args()) else 1)
@@ -0,0 +1,200 @@
+"""
+Streaming bulk import of users from CSV (`username,phone_number` header) or NDJSON.
+
+Rows are read line by line and handled in batches of BATCH_SIZE, each in its own
+transaction: validated with the User rules, copied into a temporary table with
+COPY, checked against the existing usernames and phone numbers in one query,
+then inserted with a single INSERT ... SELECT. Memory does not depend on the
+file size.
+
+    python -m bulk_import players.csv
+"""
+from sqlalchemy import (
+    Table, MetaData, Column, BigInteger, String, select, exists, case, func, literal, text
+)
+from sqlalchemy.dialects.postgresql import UUID, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+import argparse
+import asyncio
+import csv
+import json
+import uuid
+
+from db import AsyncSessionLocal
+import models
+import schemas
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+READ_SIZE = 1 << 16
+
+# Temporary table, one per connection. Emptied by each batch's commit.
+staging = Table(
+    "user_import",
+    MetaData(),
+    Column("row_no", BigInteger),
+    Column("id", UUID(as_uuid=True)),
+    Column("username", String),
+    Column("phone_number", String),
+)
+STAGING_DDL = text(
+    "CREATE TEMPORARY TABLE IF NOT EXISTS user_import "
+    "(row_no bigint, id uuid, username text, phone_number text) ON COMMIT DELETE ROWS"
+)
+
+
+async def _lines(chunks):
+    """Split an async iterator of bytes into (line number, line)."""
+    buffer, line_no = b"", 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.decode("utf-8-sig" if line_no == 1 else "utf-8").rstrip("\r")
+    if buffer:
+        yield line_no + 1, buffer.decode("utf-8-sig" if line_no == 0 else "utf-8").rstrip("\r")
+
+
+async def _rows(chunks, format: schemas.DataFormat):
+    """Yield (line number, row dict or error detail) for every non-empty line."""
+    header = None
+    async for line_no, line in _lines(chunks):
+        if not line.strip():
+            continue
+        if format == schemas.DataFormat.ndjson:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = "Invalid JSON."
+            yield line_no, row if isinstance(row, (dict, str)) else "Expected a JSON object."
+        elif header is None:
+            header = [name.strip() for name in next(csv.reader([line]))]
+        else:
+            yield line_no, dict(zip(header, next(csv.reader([line]))))
+
+
+def _validate(batch: list):
+    """Split a batch of (line number, row) into staging records and row errors."""
+    records, errors = [], []
+    for row_no, row in batch:
+        if isinstance(row, str):
+            errors.append(schemas.ImportRowError(row=row_no, detail=row))
+            continue
+        username, phone_number = row.get("username"), row.get("phone_number")
+        if not isinstance(username, str) or not isinstance(phone_number, str):
+            errors.append(schemas.ImportRowError(
+                row=row_no, detail="username and phone_number are required."
+            ))
+            continue
+        try:
+            records.append((
+                row_no,
+                uuid.uuid4(),
+                models.clean_username(username),
+                models.clean_phone_number(phone_number),
+            ))
+        except AssertionError as e:
+            errors.append(schemas.ImportRowError(row=row_no, username=username, detail=str(e)))
+    return records, errors
+
+
+def _rejected_query():
+    """Staged rows clashing with an existing user or an earlier row of the batch."""
+    ranked = select(
+        staging,
+        func.row_number().over(partition_by=staging.c.username, order_by=staging.c.row_no)
+        .label("username_rank"),
+        func.row_number().over(partition_by=staging.c.phone_number, order_by=staging.c.row_no)
+        .label("phone_number_rank"),
+    ).subquery()
+    users = models.User
+    detail = case(
+        (exists().where(users.username == ranked.c.username), "User already created."),
+        (ranked.c.username_rank > 1, "Duplicate username in the file."),
+        (
+            exists().where(users.phone_number == ranked.c.phone_number),
+            "An user with this phone number already exists."
+        ),
+        (ranked.c.phone_number_rank > 1, "Duplicate phone number in the file."),
+        else_=None
+    )
+    return (
+        select(ranked.c.row_no.label("row"), ranked.c.username, detail.label("detail"))
+        .where(detail.isnot(None))
+    )
+
+
+def _insert_statement(rejected_rows: list):
+    return insert(models.User).from_select(
+        ["id", "username", "phone_number", "points"],
+        select(staging.c.id, staging.c.username, staging.c.phone_number, literal(0))
+        .where(staging.c.row_no.not_in(rejected_rows))
+    )
+
+
+async def _copy(db: AsyncSession, records: list):
+    connection = await (await db.connection()).get_raw_connection()
+    await connection.driver_connection.copy_records_to_table(
+        staging.name, records=records, columns=[column.name for column in staging.columns]
+    )
+
+
+def _report_errors(report: schemas.ImportReport, errors: list):
+    report.rejected += len(errors)
+    room = MAX_REPORTED_ERRORS - len(report.errors)
+    report.errors += errors[:room]
+    report.errors_truncated = report.errors_truncated or len(errors) > room
+
+
+async def _import_batch(db: AsyncSession, batch: list, report: schemas.ImportReport):
+    records, errors = _validate(batch)
+    if records:
+        await db.execute(STAGING_DDL)
+        await _copy(db, records)
+        rejected = (await db.execute(_rejected_query())).all()
+        await db.execute(_insert_statement([row.row for row in rejected]))
+        await db.commit()
+        report.imported += len(records) - len(rejected)
+        errors += [schemas.ImportRowError(**row._mapping) for row in rejected]
+    _report_errors(report, sorted(errors, key=lambda error: error.row))
+
+
+async def import_users(db: AsyncSession, chunks, format: schemas.DataFormat):
+    """Import the users read from `chunks`, an async iterator of bytes."""
+    report = schemas.ImportReport()
+    batch = []
+    async for row in _rows(chunks, format):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            await _import_batch(db, batch, report)
+            batch = []
+    if batch:
+        await _import_batch(db, batch, report)
+    return report
+
+
+async def _read(path: str):
+    with open(path, "rb") as file:
+        while chunk := file.read(READ_SIZE):
+            yield chunk
+
+
+async def main(path: str, format: schemas.DataFormat):
+    async with AsyncSessionLocal() as db:
+        report = await import_users(db, _read(path), format)
+    print(report.json(indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument(
+        "--format", type=schemas.DataFormat, choices=list(schemas.DataFormat),
+        help="defaults to the file extension (.csv or .ndjson)"
+    )
+    args = parser.parse_args()
+    format = args.format or schemas.DataFormat(
+        "ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv"
+    )
+    asyncio.run(main(args.path, format))
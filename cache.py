@@ -0,0 +1,220 @@
+"""
+Read-through cache for single tournaments and users.
+
+Two tiers:
+- the session's identity map, which already lives for one request;
+- an in-process LRU with a TTL, shared by the requests of a worker.
+
+The LRU stores plain column snapshots rather than ORM instances, so an entry
+has a fixed size: relationships (a user's match history grows without bound)
+are left for the caller to load. A hit is rebuilt and merged into the
+caller's session without a SELECT. Writes go
+through crud, which invalidates the touched entities after commit. The
+invalidations are published on a bus so a shared backend (Postgres
+LISTEN/NOTIFY, Redis pub/sub...) can forward them to the other workers. The
+TTL bounds how stale an entry can get when such a message is missed.
+"""
+from collections import OrderedDict
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
+import copy
+import threading
+import time
+
+from config import settings
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, ttl: float, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Bumped by every invalidation, see EntityCache.set.
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self.version += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def snapshot(self):
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class LocalInvalidationBus:
+    """
+    Delivers invalidations to the subscribers of this process only. A backend
+    shared by several workers implements the same publish / subscribe pair.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, table: str, key):
+        for callback in self._subscribers:
+            callback(table, key)
+
+
+def _sync_session(db):
+    return getattr(db, "sync_session", db)
+
+
+def _pin(session, instance):
+    """
+    The identity map only holds weak references: keep the cached instances
+    alive until the session (the request) ends so later lookups hit it.
+    """
+    session.info.setdefault("entity_cache", []).append(instance)
+    return instance
+
+
+def _snapshot(instance):
+    mapper = inspect(instance).mapper
+    values = {attr.key: copy.deepcopy(getattr(instance, attr.key)) for attr in mapper.column_attrs}
+    return mapper.class_, values
+
+
+def _restore(snapshot):
+    """Rebuild a detached, unmodified instance, ready to be merged without a SELECT."""
+    (model, values) = snapshot
+    instance = inspect(model).class_manager.new_instance()
+    for key, value in copy.deepcopy(values).items():
+        set_committed_value(instance, key, value)
+    make_transient_to_detached(instance)
+    return instance
+
+
+class EntityCache:
+    def __init__(self, max_entries: int, ttl: float, bus=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.identity_map_hits = 0
+        self._tiers = {}
+        self.bus = bus or LocalInvalidationBus()
+        self.bus.subscribe(self._on_invalidation)
+
+    def _tier(self, model):
+        table = model.__tablename__
+        if table not in self._tiers:
+            self._tiers[table] = LRUCache(self.max_entries, self.ttl)
+        return self._tiers[table]
+
+    def get(self, db, model, primary_key):
+        """
+        Return the instance from the session, then from the LRU (merged into the
+        session), or None on a miss. Only its columns are sure to be loaded.
+        """
+        session = _sync_session(db)
+        instance = session.identity_map.get(identity_key(model, primary_key))
+        if instance is not None:
+            state = inspect(instance)
+            needed = {attr.key for attr in state.mapper.column_attrs}
+            # Expired (after a rollback) or partially loaded instances would lazy load.
+            if needed.isdisjoint(state.unloaded):
+                self.identity_map_hits += 1
+                return instance
+
+        tier = self._tier(model)
+        snapshot = tier.get(primary_key)
+        if snapshot is None:
+            session.info.setdefault("entity_cache_misses", {})[(model, primary_key)] = tier.version
+            return None
+        return _pin(session, session.merge(_restore(snapshot), load=False))
+
+    def set(self, db, model, instance):
+        """
+        Store the instance loaded after a miss. It is not stored if any entry was
+        invalidated since the miss: the row may have been read before that commit.
+        Nor if it was read on a replica, which may not have replayed that commit yet.
+        """
+        if instance is None:
+            return None
+        session = _sync_session(db)
+        primary_key = inspect(instance).identity[0]
+        tier = self._tier(model)
+        missed_at = session.info.get("entity_cache_misses", {}).pop((model, primary_key), None)
+        if missed_at == tier.version and not session.info.get("replica"):
+            tier.set(primary_key, _snapshot(instance))
+        return _pin(session, instance)
+
+    def invalidate(self, model, *primary_keys):
+        for primary_key in primary_keys:
+            self.bus.publish(model.__tablename__, primary_key)
+
+    def _on_invalidation(self, table: str, primary_key):
+        if table in self._tiers:
+            self._tiers[table].invalidate(primary_key)
+
+    def export(self, writer):
+        writer.add(
+            "entity_cache_identity_map_hits_total", "counter",
+            "Lookups answered by the session's identity map.", self.identity_map_hits
+        )
+        for table, tier in list(self._tiers.items()):
+            writer.add("entity_cache_entries", "gauge", "Entries in the LRU.", len(tier),
+                       table=table)
+            for name, value in (
+                ("hits", tier.hits),
+                ("misses", tier.misses),
+                ("evictions", tier.evictions),
+                ("invalidations", tier.invalidations),
+            ):
+                writer.add(f"entity_cache_{name}_total", "counter", f"LRU {name}.", value,
+                           table=table)
+
+    def snapshot(self):
+        return {
+            "identity_map_hits": self.identity_map_hits,
+            **{table: tier.snapshot() for table, tier in self._tiers.items()},
+        }
+
+
+entity_cache = EntityCache(settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL)
@@ -0,0 +1,167 @@
+"""
+Response compression negotiated on Accept-Encoding: brotli, else gzip.
+
+Bodies under `minimum_size` are sent as they are. Every response which could
+be compressed carries `Vary: Accept-Encoding`, sent compressed or not, so a
+cache does not serve an identity copy to a client asking for br or gzip. Streamed bodies (the
+exports) are compressed chunk by chunk and flushed after each one, so they
+still reach the client progressively. Server-Sent Events are left as they
+are. A strong ETag gets the coding as a suffix, `"tag"` becoming
+`"tag-br"`: each representation keeps its own validator, and conditional.py
+strips the suffix back when comparing.
+"""
+import brotli
+import zlib
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Frames of the live leaderboards are encoded once for all their subscribers.
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class _Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+# In order of preference between codings of equal quality values.
+ENCODINGS = {"br": _Brotli, "gzip": _Gzip}
+
+
+def negotiate(accept_encoding: str):
+    """The preferred supported coding of an Accept-Encoding header, or None."""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        (coding, *params) = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+        start, compressor = None, None
+
+        async def send_negotiated(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                if not _negotiable(message):
+                    await send(message)
+                elif encoding is None:
+                    # Sent as it is, but another request may get it compressed.
+                    await send(_varied_start(message))
+                else:
+                    # Held until the first body chunk tells whether it is worth compressing.
+                    start = message
+                return
+            if start is not None:
+                (start_message, start) = (start, None)
+                if not self._should_compress(start_message, message):
+                    await send(_varied_start(start_message))
+                    await send(message)
+                    return
+                compressor = ENCODINGS[encoding]()
+                if not message.get("more_body", False):
+                    body = compressor.finish(message.get("body", b""))
+                    await send(_compressed_start(start_message, encoding, len(body)))
+                    await send({**message, "body": body})
+                    return
+                await send(_compressed_start(start_message, encoding))
+            if compressor is None:
+                await send(message)
+            elif message.get("more_body", False):
+                await send({**message, "body": compressor.compress(message.get("body", b""))})
+            else:
+                await send({**message, "body": compressor.finish(message.get("body", b""))})
+
+        await self.app(scope, receive, send_negotiated)
+
+    def _should_compress(self, start: dict, message: dict) -> bool:
+        return (
+            start["status"] not in (204, 304)
+            and (message.get("more_body", False)
+                 or len(message.get("body", b"")) >= self.minimum_size)
+        )
+
+
+def _negotiable(start: dict) -> bool:
+    """Whether the response has representations per coding, compressed or not."""
+    headers = dict(start["headers"])
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    return (
+        b"content-encoding" not in headers
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+        and not content_type.startswith(UNCOMPRESSED_TYPES)
+    )
+
+
+def _vary(headers: list) -> tuple:
+    """The headers without Vary, and Vary with Accept-Encoding added to it."""
+    others, vary = [], []
+    for name, value in headers:
+        if name == b"vary":
+            vary.append(value)
+        else:
+            others.append((name, value))
+    if not any(b"accept-encoding" in value.lower() for value in vary):
+        vary.append(b"Accept-Encoding")
+    return others, (b"vary", b", ".join(vary))
+
+
+def _varied_start(start: dict) -> dict:
+    """Headers of the identity representation, which caches must not serve for br or gzip."""
+    (headers, vary) = _vary(start["headers"])
+    return {**start, "headers": headers + [vary]}
+
+
+def _compressed_start(start: dict, encoding: str, content_length: int = None) -> dict:
+    """Headers of the compressed representation; chunked when `content_length` is unknown."""
+    (others, vary) = _vary(start["headers"])
+    headers = []
+    for name, value in others:
+        if name == b"etag" and not value.startswith(b"W/"):
+            headers.append((name, value[:-1] + f'-{encoding}"'.encode()))
+        elif name != b"content-length":
+            headers.append((name, value))
+    headers += [(b"content-encoding", encoding.encode()), vary]
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    return {**start, "headers": headers}
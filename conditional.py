@@ -0,0 +1,43 @@
+"""
+Conditional GETs on the tournament reads.
+
+ETags are strong validators derived from the `version` of the tournaments a
+response is built from (bumped by a trigger on every update of their row).
+Routes read the versions first, with a light query, and answer 304 Not
+Modified to a matching If-None-Match without building the body.
+"""
+from fastapi import Request, Response
+import hashlib
+
+from compression import ENCODINGS
+
+
+def make_etag(*parts) -> str:
+    # str(): ids may be uuid.UUID or asyncpg's UUID, which have different reprs.
+    digest = hashlib.blake2b("\x1f".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def _opaque_tag(tag: str) -> str:
+    # Weak comparison (RFC 9110 13.1.2), ignoring the suffix of a compressed representation.
+    tag = tag.strip().removeprefix("W/")
+    for encoding in ENCODINGS:
+        if tag.endswith(f'-{encoding}"'):
+            return tag[:-len(encoding) - 2] + '"'
+    return tag
+
+
+def _client_tags(request: Request):
+    return [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+
+
+def is_fresh(request: Request, etag: str) -> bool:
+    """The client's copy, named by If-None-Match, is still the current representation."""
+    tags = _client_tags(request)
+    return tags == ["*"] or _opaque_tag(etag) in {_opaque_tag(tag) for tag in tags if tag}
+
+
+def not_modified(request: Request, etag: str) -> Response:
+    # With the client's own tag: a compressed copy keeps the validator of its coding.
+    matching = [tag for tag in _client_tags(request) if _opaque_tag(tag) == _opaque_tag(etag)]
+    return Response(status_code=304, headers={"ETag": matching[0] if matching else etag})
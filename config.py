@@ -1,18 +1,68 @@
 from pydantic import BaseSettings
-import os
-from dotenv import load_dotenv
-
-from pathlib import Path
-env_path = Path('.') / '.env'
-load_dotenv(dotenv_path=env_path)
 
 
 class Settings(BaseSettings):
-    DATABASE_PORT: int = os.getenv("DATABASE_PORT", 5432)
-    POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD")
-    POSTGRES_USER: str = os.getenv("POSTGRES_USER")
-    POSTGRES_DB: str = os.getenv("POSTGRES_DB", "bdd")
-    POSTGRES_HOSTNAME: str = os.getenv("POSTGRES_HOSTNAME", "localhost")
+    """Read once from the environment, then from .env (by pydantic, without exporting it)."""
+
+    DATABASE_PORT: int = 5432
+    POSTGRES_PASSWORD: str = None
+    POSTGRES_USER: str = None
+    POSTGRES_DB: str = "bdd"
+    POSTGRES_HOSTNAME: str = "localhost"
+
+    # Connection pool, per engine and per worker process.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Milliseconds, 0 disables the timeout.
+    DB_STATEMENT_TIMEOUT: int = 30000
+
+    # Per entity type. Seconds an entry may be served without a write-through invalidation.
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_TTL: float = 30
+
+    # Ends tournaments at their `end` time. Seconds between two reloads of the upcoming ends.
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_RESYNC_INTERVAL: float = 300
+
+    # Bytes from which responses are compressed, when the client accepts gzip or brotli.
+    COMPRESSION_MIN_SIZE: int = 1024
+
+    # Concurrent requests per admission class and worker, then queued up to
+    # ADMISSION_QUEUE_SIZE for ADMISSION_QUEUE_TIMEOUT seconds before a 503.
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_READ_LIMIT: int = 20
+    ADMISSION_WRITE_LIMIT: int = 10
+    ADMISSION_HEAVY_LIMIT: int = 2
+    ADMISSION_EXPORT_LIMIT: int = 2
+    ADMISSION_QUEUE_SIZE: int = 100
+    ADMISSION_QUEUE_TIMEOUT: float = 2
+    ADMISSION_RETRY_AFTER: int = 1
+
+    # Streaming replicas (postgresql:// URLs, a JSON list in the environment) serving the
+    # GET routes. A replica lagging more than REPLICA_MAX_LAG seconds behind the primary,
+    # measured every REPLICA_LAG_CHECK_INTERVAL seconds, is left out until it catches up.
+    REPLICA_URLS: list[str] = []
+    REPLICA_MAX_LAG: float = 1
+    REPLICA_LAG_CHECK_INTERVAL: float = 1
+
+    # Live leaderboards (GET /tournaments/{id}/leaderboard/stream): streams per worker,
+    # frames queued per stream before a slow client is sent the standings again, and
+    # seconds between two keep-alives (also the check of the listening connection).
+    LEADERBOARD_STREAM_MAX_SUBSCRIBERS: int = 10000
+    LEADERBOARD_STREAM_QUEUE_SIZE: int = 16
+    LEADERBOARD_STREAM_KEEPALIVE: float = 15
+
+    # Requests slower than this are logged with their SQL statements, 0 disables the log.
+    SLOW_REQUEST_MS: float = 0
+    # Sampling profiler, also switched at runtime with PUT /metrics/profile.
+    PROFILER_ENABLED: bool = False
+    PROFILER_INTERVAL: float = 0.01
+
+    class Config:
+        env_file = ".env"
 
 
 settings = Settings()
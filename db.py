@@ -1,11 +1,70 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from config import settings
+from metrics import PoolMetrics, RequestMetrics, instrumented_pool
 
 DATABASE_URL = (
     f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}"
     f"@{settings.POSTGRES_HOSTNAME}:{settings.DATABASE_PORT}/{settings.POSTGRES_DB}"
 )
 
-engine = create_engine(DATABASE_URL)
+
+def _async_url(url: str) -> str:
+    return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+POOL_OPTIONS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+# Statements and database time of the API requests, see metrics.MetricsMiddleware.
+request_metrics = RequestMetrics(settings.SLOW_REQUEST_MS / 1000)
+
+# Blocking engine, kept for scripts and schema management.
+pool_metrics = PoolMetrics()
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=instrumented_pool(QueuePool, pool_metrics),
+    connect_args={"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT}"},
+    **POOL_OPTIONS
+)
+pool_metrics.listen(engine)
+request_metrics.listen(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _create_async_engine(url: str, metrics: PoolMetrics):
+    async_engine = create_async_engine(
+        url,
+        poolclass=instrumented_pool(AsyncAdaptedQueuePool, metrics),
+        connect_args={
+            "server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT)}
+        },
+        **POOL_OPTIONS
+    )
+    metrics.listen(async_engine.sync_engine)
+    request_metrics.listen(async_engine.sync_engine)
+    return async_engine
+
+
+# Engine used by the API: requests wait on Postgres without holding a thread.
+async_pool_metrics = PoolMetrics()
+async_engine = _create_async_engine(ASYNC_DATABASE_URL, async_pool_metrics)
+AsyncSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+# Streaming replicas, read by the GET routes through replicas.ReplicaRouter.
+replica_pool_metrics = [PoolMetrics() for _ in settings.REPLICA_URLS]
+replica_engines = [
+    _create_async_engine(_async_url(url), metrics)
+    for url, metrics in zip(settings.REPLICA_URLS, replica_pool_metrics)
+]
@@ -0,0 +1,121 @@
+"""
+Streaming exports of the match history and of tournament standings, as NDJSON or CSV.
+
+Rows are plain Core rows read from a server-side cursor, PARTITION_SIZE at a
+time, and encoded as they arrive: memory stays flat and the first bytes go
+out as soon as the first partition is read.
+"""
+from sqlalchemy import select, func, or_
+from uuid import UUID
+import csv
+import datetime as D
+import io
+import json
+
+from statements import tournament_matches_filter
+from db import async_engine
+import models
+import schemas
+
+PARTITION_SIZE = 2000
+MEDIA_TYPES = {
+    schemas.DataFormat.ndjson: "application/x-ndjson",
+    schemas.DataFormat.csv: "text/csv",
+}
+
+
+def matches_query(
+    player_id: UUID = None,
+    tournament_id: UUID = None,
+    since: D.datetime = None,
+    until: D.datetime = None
+):
+    match = models.Match.__table__
+    query = select(match).order_by(match.c.created_at, match.c.id)
+    if player_id is not None:
+        query = query.where(or_(match.c.player_one_id == player_id,
+                                match.c.player_two_id == player_id))
+    if tournament_id is not None:
+        # The period of the tournament, read by subqueries, prunes the partitions at execution.
+        tournament = models.Tournament.__table__
+        (begin, end) = (
+            select(bound).where(tournament.c.id == tournament_id).scalar_subquery()
+            for bound in (tournament.c.begin, tournament.c.end)
+        )
+        query = query.where(*tournament_matches_filter(tournament_id, begin, end))
+    if since is not None:
+        query = query.where(match.c.created_at >= since)
+    if until is not None:
+        query = query.where(match.c.created_at < until)
+    return query
+
+
+def standings_query(
+    tournament_id: UUID = None,
+    since: D.datetime = None,
+    until: D.datetime = None
+):
+    """Standings of one tournament, or of every tournament ending in [since, until)."""
+    registered = models.tournament_user.c
+    tournament = models.Tournament.__table__
+    query = (
+        select(
+            registered.tournament_id,
+            func.row_number().over(
+                partition_by=registered.tournament_id,
+                order_by=(registered.score.desc(), registered.user_id)
+            ).label("rank"),
+            registered.user_id,
+            models.User.username,
+            registered.score,
+        )
+        .join(models.User, models.User.id == registered.user_id)
+        .join(tournament, tournament.c.id == registered.tournament_id)
+        .order_by(registered.tournament_id, registered.score.desc(), registered.user_id)
+    )
+    if tournament_id is not None:
+        query = query.where(registered.tournament_id == tournament_id)
+    if since is not None:
+        query = query.where(tournament.c.end >= since)
+    if until is not None:
+        query = query.where(tournament.c.end < until)
+    return query
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, D.datetime) else str(value)
+
+
+def _encode_ndjson(rows, _columns):
+    return "".join(json.dumps(dict(row._mapping), default=_json_default) + "\n" for row in rows)
+
+
+def _encode_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if columns is not None:
+        writer.writerow(columns)
+    writer.writerows(
+        [value.isoformat() if isinstance(value, D.datetime) else value for value in row]
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+ENCODERS = {schemas.DataFormat.ndjson: _encode_ndjson, schemas.DataFormat.csv: _encode_csv}
+
+
+async def stream_rows(query, format: schemas.DataFormat, engine=async_engine):
+    """Yield the encoded rows of `query`, one chunk per partition of the server-side cursor."""
+    encode = ENCODERS[format]
+    async with engine.connect() as connection:
+        result = await connection.stream(
+            query.execution_options(stream_results=True, max_row_buffer=PARTITION_SIZE)
+        )
+        columns = list(result.keys())
+        async for rows in result.partitions(PARTITION_SIZE):
+            yield encode(rows, columns)
+            columns = None
+        if columns is not None:
+            # No rows: still send the CSV header.
+            yield encode([], columns)
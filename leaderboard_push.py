@@ -0,0 +1,289 @@
+"""
+Live leaderboards, pushed to their spectators with Server-Sent Events.
+
+GET /tournaments/{id}/leaderboard/stream first sends the standings, like
+GET /tournaments/{id}/leaderboard, then a delta after every change: the
+positions whose entry changed and the new size. Each worker LISTENs on a
+single connection of its own to the notifications of the trigger on
+tournaments (migrations/0004), fired by registrations, match results,
+rounds and renamed players whichever worker committed them. A change is
+read and encoded once per worker and tournament, then the same frame is
+queued to every subscriber; notifications arriving during a read are
+folded into the next one.
+
+Each subscriber has a bounded queue of frames. A subscriber too slow to
+keep up has its queued frames replaced with the current standings, so a
+slow consumer costs one frame of memory rather than a growing backlog.
+Notifications missed while the listening connection was down are handled
+the same way: every channel is read again after reconnecting.
+"""
+from uuid import UUID
+import asyncio
+import asyncpg
+import logging
+import orjson
+
+import async_crud as crud
+import models
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "leaderboard"
+KEEPALIVE_FRAME = b": keepalive\n\n"
+# Queued to end a stream: the tournament was deleted or the worker stops.
+END = None
+
+
+def _frame(event: str, version: int, data: dict) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (version, event.encode(), orjson.dumps(data))
+
+
+class Subscriber:
+    def __init__(self, channel, queue_size: int):
+        self.channel = channel
+        self.queue = asyncio.Queue(queue_size)
+
+    def push(self, frame: bytes) -> bool:
+        """Queue a frame, False when the subscriber lagged and was resynced instead."""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self._drain()
+            self.queue.put_nowait(self.channel.snapshot())
+            return False
+
+    def end(self):
+        self._drain()
+        self.queue.put_nowait(END)
+
+    def _drain(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+class LeaderboardChannel:
+    def __init__(self, tournament_id: UUID):
+        self.tournament_id = tournament_id
+        self.subscribers = set()
+        self.version = None
+        # [(username, score)] in rank order, None until the first read.
+        self.entries = None
+        self.stale = False
+        self.task = None
+        self._snapshot = None
+
+    def snapshot(self) -> bytes:
+        if self._snapshot is None:
+            self._snapshot = _frame(
+                "leaderboard", self.version,
+                {"version": self.version, "leaderboard": self.entries}
+            )
+        return self._snapshot
+
+    def update(self, version: int, entries: list):
+        """Store the standings read, return the frame to push (None when unchanged)."""
+        (previous, self.version, self.entries) = (self.entries, version, entries)
+        self._snapshot = None
+        if previous is None:
+            return self.snapshot()
+        changes = [
+            [rank, *entry]
+            for rank, entry in enumerate(entries, 1)
+            if rank > len(previous) or previous[rank - 1] != entry
+        ]
+        if not changes and len(entries) == len(previous):
+            return None
+        return _frame(
+            "delta", version, {"version": version, "size": len(entries), "changes": changes}
+        )
+
+
+class LeaderboardHub:
+    def __init__(
+        self,
+        session_factory,
+        dsn: str,
+        queue_size: int = 16,
+        max_subscribers: int = 10000,
+        keepalive: float = 15,
+        retry_delay: float = 1
+    ):
+        self.session_factory = session_factory
+        self.dsn = dsn
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.keepalive = keepalive
+        self.retry_delay = retry_delay
+        self.channels = {}
+        self.subscribers = 0
+        self.listening = False
+        self.notifications = 0
+        self.reads = 0
+        self.frames = 0
+        self.resyncs = 0
+        self.rejected = 0
+        self.reconnects = 0
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for channel in list(self.channels.values()):
+            self._close(channel)
+
+    def full(self) -> bool:
+        """At the subscriber limit of the worker, counting the refused stream."""
+        if self.subscribers >= self.max_subscribers:
+            self.rejected += 1
+            return True
+        return False
+
+    async def _listen(self):
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+            except Exception as e:
+                logger.warning("Could not listen to the leaderboard notifications: %s", e)
+                await asyncio.sleep(self.retry_delay)
+                continue
+            try:
+                await self._serve(connection)
+            except Exception as e:
+                logger.warning("Leaderboard notifications connection lost: %s", e)
+            finally:
+                self.listening = False
+                connection.terminate()
+            self.reconnects += 1
+            await asyncio.sleep(self.retry_delay)
+
+    async def _serve(self, connection):
+        lost = asyncio.Event()
+        connection.add_termination_listener(lambda _connection: lost.set())
+        await connection.add_listener(NOTIFY_CHANNEL, self._on_notification)
+        self.listening = True
+        # Changes may have been committed while no connection was listening.
+        for channel in self.channels.values():
+            self._changed(channel)
+        while not lost.is_set():
+            try:
+                await asyncio.wait_for(lost.wait(), self.keepalive)
+            except asyncio.TimeoutError:
+                # An idle connection only notices a broken network when it sends.
+                await asyncio.wait_for(connection.execute("SELECT 1"), self.keepalive)
+
+    def _on_notification(self, _connection, _pid, _channel, payload: str):
+        self.notifications += 1
+        channel = self.channels.get(UUID(payload))
+        if channel is not None:
+            self._changed(channel)
+
+    def _changed(self, channel: LeaderboardChannel):
+        channel.stale = True
+        if channel.task is None:
+            channel.task = asyncio.create_task(self._refresh(channel))
+
+    async def _refresh(self, channel: LeaderboardChannel):
+        try:
+            while channel.stale and channel.subscribers:
+                channel.stale = False
+                try:
+                    await self._read(channel)
+                except Exception:
+                    logger.exception("Could not read the leaderboard of %s", channel.tournament_id)
+                    channel.stale = True
+                    await asyncio.sleep(self.retry_delay)
+        finally:
+            channel.task = None
+
+    async def _read(self, channel: LeaderboardChannel):
+        # On the primary: a replica may not have replayed the notified commit yet.
+        async with self.session_factory() as db:
+            row = await crud.get_tournament_row(
+                db, channel.tournament_id, (models.Tournament.version,)
+            )
+            if row is None:
+                return self._close(channel)
+            if row.version == channel.version:
+                return None
+            entries, _ = await crud.get_leaderboard_entries(db, channel.tournament_id)
+        self.reads += 1
+        frame = channel.update(row.version, [(entry.username, entry.score) for entry in entries])
+        if frame is not None:
+            self._publish(channel, frame)
+
+    def _publish(self, channel: LeaderboardChannel, frame: bytes):
+        for subscriber in channel.subscribers:
+            self.frames += 1
+            if not subscriber.push(frame):
+                self.resyncs += 1
+
+    def _close(self, channel: LeaderboardChannel):
+        for subscriber in channel.subscribers:
+            subscriber.end()
+        if self.channels.get(channel.tournament_id) is channel:
+            del self.channels[channel.tournament_id]
+
+    def subscribe(self, tournament_id: UUID) -> Subscriber:
+        channel = self.channels.get(tournament_id)
+        if channel is None:
+            channel = self.channels[tournament_id] = LeaderboardChannel(tournament_id)
+        subscriber = Subscriber(channel, self.queue_size)
+        channel.subscribers.add(subscriber)
+        self.subscribers += 1
+        if channel.entries is not None:
+            subscriber.push(channel.snapshot())
+        else:
+            # The first read sends the standings to every subscriber waiting for them.
+            self._changed(channel)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        channel = subscriber.channel
+        channel.subscribers.discard(subscriber)
+        self.subscribers -= 1
+        if not channel.subscribers and self.channels.get(channel.tournament_id) is channel:
+            del self.channels[channel.tournament_id]
+
+    async def stream(self, tournament_id: UUID):
+        """Body of the SSE response, subscribed once iterated: a stream never sent leaks nothing."""
+        subscriber = self.subscribe(tournament_id)
+        try:
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE_FRAME
+                    continue
+                if frame is END:
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+    def export(self, writer):
+        writer.add("leaderboard_stream_subscribers", "gauge",
+                   "Live leaderboard streams open on this worker.", self.subscribers)
+        writer.add("leaderboard_stream_channels", "gauge",
+                   "Tournaments with at least one live leaderboard stream.", len(self.channels))
+        writer.add("leaderboard_stream_listening", "gauge",
+                   "1 while the worker listens to the leaderboard notifications.",
+                   int(self.listening))
+        for name, description, value in (
+            ("notifications", "Leaderboard notifications received.", self.notifications),
+            ("reads", "Leaderboards read after a change, once for all subscribers.", self.reads),
+            ("frames", "Frames queued to the subscribers.", self.frames),
+            ("resyncs", "Frames dropped for slow subscribers, sent the standings again.",
+             self.resyncs),
+            ("rejected", "Streams refused at the subscriber limit.", self.rejected),
+            ("reconnects", "Reconnections of the listening connection.", self.reconnects),
+        ):
+            writer.add(f"leaderboard_stream_{name}_total", "counter", description, value)
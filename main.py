@@ -1,158 +1,554 @@
 from uuid import UUID
-from fastapi import FastAPI, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from db import engine, SessionLocal
+from fastapi import (
+    APIRouter, FastAPI, Depends, HTTPException, Query, Request, Response, status
+)
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
+from db import (
+    DATABASE_URL, AsyncSessionLocal, async_engine, pool_metrics, async_pool_metrics,
+    request_metrics, replica_engines, replica_pool_metrics
+)
+from config import settings
+from admission import AdmissionClass, AdmissionControl, AdmissionMiddleware
+from cache import entity_cache
+from compression import CompressionMiddleware
+from statements import (
+    USER_SUMMARY_COLUMNS, TOURNAMENT_COLUMNS, VERSIONED_TOURNAMENT_COLUMNS,
+    TOURNAMENT_VERSION_COLUMNS, MATCH_COLUMNS, PAGED_MATCH_COLUMNS, MAX_EXPANDED_MATCHES
+)
+from leaderboard_push import LeaderboardHub
+from metrics import MetricsMiddleware, PrometheusWriter
+from pagination import MAX_PAGE_SIZE
+from profiler import SamplingProfiler
+from readiness import Readiness
+from replicas import Replica, ReplicaRouter, ReadAfterMiddleware, read_after
+from scheduler import LifecycleScheduler
+import bulk_import
+import conditional
+import export
 import datetime as D
+import orjson
 import random
 import pytz
 import models
 import schemas
-import crud
+import async_crud as crud
+
+
+router = APIRouter()
+scheduler = LifecycleScheduler(AsyncSessionLocal, settings.SCHEDULER_RESYNC_INTERVAL)
+profiler = SamplingProfiler(settings.PROFILER_INTERVAL)
+readiness = Readiness(AsyncSessionLocal, settings.DB_POOL_SIZE)
+replicas = ReplicaRouter(
+    async_engine,
+    AsyncSessionLocal,
+    [Replica(engine, metrics) for engine, metrics in zip(replica_engines, replica_pool_metrics)],
+    max_lag=settings.REPLICA_MAX_LAG,
+    check_interval=settings.REPLICA_LAG_CHECK_INTERVAL
+)
+leaderboard_hub = LeaderboardHub(
+    AsyncSessionLocal,
+    DATABASE_URL,
+    queue_size=settings.LEADERBOARD_STREAM_QUEUE_SIZE,
+    max_subscribers=settings.LEADERBOARD_STREAM_MAX_SUBSCRIBERS,
+    keepalive=settings.LEADERBOARD_STREAM_KEEPALIVE
+)
+admission = AdmissionControl(
+    [
+        AdmissionClass("read", settings.ADMISSION_READ_LIMIT, settings.ADMISSION_QUEUE_SIZE,
+                       settings.ADMISSION_QUEUE_TIMEOUT),
+        AdmissionClass("write", settings.ADMISSION_WRITE_LIMIT, settings.ADMISSION_QUEUE_SIZE,
+                       settings.ADMISSION_QUEUE_TIMEOUT),
+        AdmissionClass("heavy", settings.ADMISSION_HEAVY_LIMIT, settings.ADMISSION_QUEUE_SIZE,
+                       settings.ADMISSION_QUEUE_TIMEOUT, low_priority=True),
+        AdmissionClass("export", settings.ADMISSION_EXPORT_LIMIT, settings.ADMISSION_QUEUE_SIZE,
+                       settings.ADMISSION_QUEUE_TIMEOUT, low_priority=True),
+    ],
+    retry_after=settings.ADMISSION_RETRY_AFTER,
+    pool=async_engine.pool,
+    pool_capacity=settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+)
+# Long transactions taking many row locks, and streams holding a connection throughout.
+admission.assign(
+    "heavy",
+    ("POST", "/users/import"),
+    ("POST", "/tournaments/{tournament_id}/rounds"),
+    ("POST", "/tournaments/{tournament_id}/end"),
+)
+admission.assign("export", ("GET", "/matches/export"), ("GET", "/standings/export"))
+# Held open for as long as the client watches: bounded by the hub's subscriber limit instead.
+admission.exempt_routes(("GET", "/tournaments/{tournament_id}/leaderboard/stream"))
+admission.exempt(
+    "/health/live", "/health/ready", "/metrics", "/metrics/pool", "/metrics/cache",
+    "/metrics/profile"
+)
+
+
+async def start_scheduler():
+    if settings.SCHEDULER_ENABLED:
+        await scheduler.start()
+
+
+async def start_profiler():
+    if settings.PROFILER_ENABLED:
+        profiler.start()
+
+
+async def stop_background_tasks():
+    await readiness.stop()
+    await replicas.stop()
+    await leaderboard_hub.stop()
+    await scheduler.stop()
+    profiler.stop()
+
+
+def create_app() -> FastAPI:
+    """
+    Build the app without touching the database: the schema is managed by the
+    migrations (python -m migrate) and the pool is warmed up after startup.
+    Served with `uvicorn main:app`, or `uvicorn --factory main:create_app`.
+    """
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+    if replicas.replicas:
+        app.add_middleware(ReadAfterMiddleware)
+    if settings.ADMISSION_ENABLED:
+        app.add_middleware(AdmissionMiddleware, control=admission)
+    app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+    app.include_router(router)
+    app.add_event_handler("startup", readiness.start)
+    app.add_event_handler("startup", replicas.start)
+    app.add_event_handler("startup", leaderboard_hub.start)
+    app.add_event_handler("startup", start_scheduler)
+    app.add_event_handler("startup", start_profiler)
+    app.add_event_handler("shutdown", stop_background_tasks)
+    return app
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
 
-models.Base.metadata.create_all(bind=engine)
+async def get_read_db(request: Request):
+    """A replica's session for the routes which only read, see replicas.py."""
+    async with replicas.session(read_after(request.headers)) as db:
+        yield db
 
-app = FastAPI()
 
+@router.get("/health/live")
+async def liveness():
+    """The worker serves requests. Does not depend on the database."""
+    return {"status": "alive"}
+
+
+@router.get("/health/ready")
+async def readiness_probe():
+    """Warmed up and the database answers: the worker can take traffic."""
+    (ready, detail) = await readiness.check()
+    return JSONResponse(
+        {"status": detail},
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """
+    Prometheus text format: requests, admission, connection pools, replicas, cache and
+    live leaderboards.
+    """
+    writer = PrometheusWriter()
+    request_metrics.export(writer)
+    async_pool_metrics.export(writer, engine="async")
+    pool_metrics.export(writer, engine="sync")
+    for replica in replicas.replicas:
+        replica.pool_metrics.export(writer, engine=f"replica:{replica.name}")
+    replicas.export(writer)
+    entity_cache.export(writer)
+    readiness.export(writer)
+    admission.export(writer)
+    leaderboard_hub.export(writer)
+    return PlainTextResponse(writer.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/metrics/profile", response_class=PlainTextResponse)
+async def read_profile():
+    """Samples of the sampling profiler, in the collapsed format of flame graph tools."""
+    return profiler.collapsed()
+
+
+@router.put("/metrics/profile")
+async def switch_profiler(enabled: bool, reset: bool = False):
+    if reset:
+        profiler.reset()
+    if enabled:
+        profiler.start()
+    else:
+        profiler.stop()
+    return {
+        "running": profiler.running,
+        "stacks": len(profiler.samples),
+        "dropped": profiler.dropped,
+    }
+
+
+@router.get("/metrics/pool")
+async def read_pool_metrics():
+    return {
+        "async": async_pool_metrics.snapshot(),
+        "sync": pool_metrics.snapshot(),
+        **{
+            f"replica:{replica.name}": replica.pool_metrics.snapshot()
+            for replica in replicas.replicas
+        },
+    }
+
+
+@router.get("/metrics/cache")
+async def read_cache_metrics():
+    return entity_cache.snapshot()
+
+
+class RowsResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        # asyncpg returns its own UUID type, which orjson does not know.
+        return orjson.dumps(content, default=str)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
+def _rows_response(rows, columns: tuple, next_cursor: str = None, etag: str = None):
+    """
+    List of Core rows encoded by orjson, skipping the ORM, the response model
+    validation and jsonable_encoder. `columns` are the response model's, in
+    its field order, so the JSON is the same; columns selected after them
+    (versions) are left out.
+    """
+    keys = [column.key for column in columns]
+    headers = {}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    if etag is not None:
+        headers["ETag"] = etag
+    return RowsResponse([dict(zip(keys, row)) for row in rows], headers=headers)
+
+
+async def _get_user(db: AsyncSession, user_id: UUID):
+    user = await crud.get_user(db, user_id=user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+    return user
+
+
+def _user_response(db_user, matches=((), ())) -> schemas.User:
+    """`matches` is (matches_as_player_one, matches_as_player_two), see get_users_matches."""
+    return schemas.User(
+        id=db_user.id,
+        username=db_user.username,
+        phone_number=db_user.phone_number,
+        points=db_user.points,
+        matches_as_player_one=matches[0],
+        matches_as_player_two=matches[1]
+    )
 
-@app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)) -> schemas.User:
-    db_user = crud.get_user_by_username(db=db, username=user.username)
+
+async def _user_with_matches(db: AsyncSession, db_user, matches_limit: int) -> schemas.User:
+    matches = await crud.get_users_matches(db, [db_user.id], matches_limit)
+    return _user_response(db_user, matches[db_user.id])
+
+
+@router.post("/users/", response_model=schemas.User)
+async def create_user(
+    user: schemas.UserCreate,
+    db: AsyncSession = Depends(get_db)
+) -> schemas.User:
+    db_user = await crud.get_user_by_username(db=db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User already created."
         )
-    db_user = crud.get_user_by_phone_number(db=db, phone_number=user.phone_number)
+    db_user = await crud.get_user_by_phone_number(db=db, phone_number=user.phone_number)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="An user with this phone number already exists."
         )
-    return crud.create_user(db=db, user=user)
+    # A new user has not played yet.
+    return _user_response(await crud.create_user(db=db, user=user))
+
+
+@router.post("/users/import", response_model=schemas.ImportReport)
+async def import_users(
+    request: Request,
+    format: schemas.DataFormat = schemas.DataFormat.csv,
+    db: AsyncSession = Depends(get_db)
+) -> schemas.ImportReport:
+    """
+    Bulk create users from a streamed CSV (`username,phone_number` header) or
+    NDJSON body. Invalid rows and users already known by username or phone
+    number are skipped and reported; the others are imported.
+    """
+    return await bulk_import.import_users(db, request.stream(), format)
 
 
-@app.get("/users/", response_model=list[schemas.User])
-def read_users(
-    db: Session = Depends(get_db),
+@router.get(
+    "/users/",
+    response_model=list[schemas.UserSummary],
+    response_model_exclude_unset=True
+)
+async def read_users(
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
     skip: int = 0,
-    limit: int = 100,
-    filter: str = ""
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    filter: str = "",
+    mode: schemas.UserSearchMode = schemas.UserSearchMode.contains,
+    sort: schemas.UserSort = schemas.UserSort.id,
+    cursor: str = None,
+    expand: schemas.UserExpansion = None,
+    matches_limit: int = 20
+) -> list[schemas.UserSummary]:
+    """
+    Keyset paginated: pass the X-Next-Cursor response header back as `cursor`
+    to get the next page. `skip` is only kept for backwards compatibility.
+    Match history is only returned with `expand=matches`, capped to the
+    `matches_limit` most recent matches of each user.
+    """
+    if expand != schemas.UserExpansion.matches:
+        if skip or mode == schemas.UserSearchMode.ranked:
+            rows = await crud.get_users(db, skip, limit, filter, mode, USER_SUMMARY_COLUMNS)
+            return _rows_response(rows, USER_SUMMARY_COLUMNS)
+        rows, next_cursor = await crud.get_users_page(
+            db, limit, filter, mode, sort, cursor, USER_SUMMARY_COLUMNS
+        )
+        return _rows_response(rows, USER_SUMMARY_COLUMNS, next_cursor)
+
+    if skip or mode == schemas.UserSearchMode.ranked:
+        users = await crud.get_users(db, skip, limit, filter, mode)
+    else:
+        users, next_cursor = await crud.get_users_page(db, limit, filter, mode, sort, cursor)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+
+    summaries = [
+        schemas.UserSummary(
+            id=user.id, username=user.username, phone_number=user.phone_number, points=user.points
+        )
+        for user in users
+    ]
+    matches = await crud.get_users_matches(db, [user.id for user in users], matches_limit)
+    for summary in summaries:
+        (summary.matches_as_player_one, summary.matches_as_player_two) = matches[summary.id]
+    return summaries
+
+
+@router.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(
+    user_id: UUID,
+    db: AsyncSession = Depends(get_read_db),
+    matches_limit: int = Query(20, ge=0, le=MAX_EXPANDED_MATCHES)
 ) -> schemas.User:
-    users = crud.get_users(db, skip, limit, filter)
-    return users
+    """Match history capped to the `matches_limit` most recent matches, like `read_users`."""
+    return await _user_with_matches(db, await _get_user(db, user_id), matches_limit)
 
 
-@app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: UUID, db: Session = Depends(get_db)) -> schemas.User:
-    user = crud.get_user(db, user_id=user_id)
-    if user is None:
+@router.get("/users/{user_id}/stats", response_model=schemas.UserStats)
+async def read_user_stats(
+    user_id: UUID,
+    db: AsyncSession = Depends(get_read_db)
+) -> schemas.UserStats:
+    stats = await crud.get_user_stats(db, user_id)
+    if stats is None:
         raise HTTPException(status_code=404, detail="User not found.")
-    return user
+    return stats
 
 
-def create_or_get_user(user: schemas.UserCreate, db: Depends(get_db)) -> schemas.User:
-    user_db = crud.get_user_by_username(db, username=user.username)
-    if user_db:
-        return user_db
-
-    user_db = create_user(user, db)
-    return user_db
+@router.get("/users/{user_id}/vs/{opponent_id}", response_model=schemas.HeadToHead)
+async def read_head_to_head(
+    user_id: UUID,
+    opponent_id: UUID,
+    db: AsyncSession = Depends(get_read_db)
+) -> schemas.HeadToHead:
+    head_to_head = await crud.get_head_to_head(db, user_id, opponent_id)
+    if head_to_head is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+    return head_to_head
 
 
-@app.put("/users/update/{user_id}", response_model=schemas.User)
-def update_user(
+@router.put("/users/update/{user_id}", response_model=schemas.User)
+async def update_user(
     user_id: UUID,
     user: schemas.UserUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    matches_limit: int = Query(20, ge=0, le=MAX_EXPANDED_MATCHES)
 ) -> schemas.User:
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        raise HTTPException(status_code=404, detail="User not found.")
-    return crud.update_user(db, db_user, user)
+    db_user = await crud.update_user(db, await _get_user(db, user_id), user)
+    return await _user_with_matches(db, db_user, matches_limit)
 
 
-@app.delete("/users/delete/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(user_id: UUID, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        raise HTTPException(status_code=404, detail="User not found.")
-    return crud.delete_user(db, db_user)
+@router.delete("/users/delete/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_user(user_id: UUID, db: AsyncSession = Depends(get_db)):
+    return await crud.delete_user(db, await _get_user(db, user_id))
+
 
+@router.post("/matches/", response_model=schemas.Match)
+async def create_match(
+    match: schemas.MatchCreate,
+    db: AsyncSession = Depends(get_db)
+) -> schemas.Match:
+    return await crud.create_match(db=db, match=match)
+
+
+@router.get("/matches/export")
+async def export_matches(
+    request: Request,
+    format: schemas.DataFormat = schemas.DataFormat.ndjson,
+    player_id: UUID = None,
+    tournament_id: UUID = None,
+    since: D.datetime = None,
+    until: D.datetime = None
+):
+    """Stream the match history, oldest first, filtered on a player, a tournament or a period."""
+    query = export.matches_query(player_id, tournament_id, since, until)
+    return StreamingResponse(
+        export.stream_rows(query, format, replicas.engine(read_after(request.headers))),
+        media_type=export.MEDIA_TYPES[format]
+    )
 
-@app.post("/matches/", response_model=schemas.Match)
-def create_match(match: schemas.MatchCreate, db: Session = Depends(get_db)) -> schemas.Match:
-    return crud.create_match(db=db, match=match)
+
+@router.get("/standings/export")
+async def export_standings(
+    request: Request,
+    format: schemas.DataFormat = schemas.DataFormat.ndjson,
+    tournament_id: UUID = None,
+    since: D.datetime = None,
+    until: D.datetime = None
+):
+    """Stream the standings of a tournament, or of every tournament ending in [since, until)."""
+    query = export.standings_query(tournament_id, since, until)
+    return StreamingResponse(
+        export.stream_rows(query, format, replicas.engine(read_after(request.headers))),
+        media_type=export.MEDIA_TYPES[format]
+    )
 
 
-@app.get("/matches/{match_id}", response_model=schemas.Match)
-def read_match(match_id: UUID, db: Session = Depends(get_db)) -> schemas.Match:
-    match = crud.get_match(db, match_id=match_id)
+@router.get("/matches/{match_id}", response_model=schemas.Match)
+async def read_match(match_id: UUID, db: AsyncSession = Depends(get_read_db)) -> schemas.Match:
+    match = await crud.get_match(db, match_id=match_id)
     if match is None:
         raise HTTPException(status_code=404, detail="Match not found.")
     return match
 
 
-@app.put("/matches/update/{match_id}", response_model=schemas.Match)
-def update_match(
+@router.put("/matches/update/{match_id}", response_model=schemas.Match)
+async def update_match(
     match_id: UUID,
     match: schemas.MatchUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> schemas.Match:
-    db_match = crud.get_match(db, match_id=match_id)
+    db_match = await crud.get_match(db, match_id=match_id)
     if db_match is None:
         raise HTTPException(status_code=404, detail="Match not found.")
-    return crud.update_match(db, db_match, match)
+    return await crud.update_match(db, db_match, match)
 
 
-@app.delete("/matches/delete/{match_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_match(match_id: UUID, db: Session = Depends(get_db)):
-    db_match = crud.get_match(db, match_id=match_id)
+@router.delete("/matches/delete/{match_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_match(match_id: UUID, db: AsyncSession = Depends(get_db)):
+    db_match = await crud.get_match(db, match_id=match_id)
     if db_match is None:
         raise HTTPException(status_code=404, detail="Match not found.")
-    return crud.delete_match(db, db_match)
+    return await crud.delete_match(db, db_match)
 
 
-@app.post("/tournaments/", response_model=schemas.Tournament)
-def create_tournament(
+@router.post("/tournaments/", response_model=schemas.Tournament)
+async def create_tournament(
     tournament: schemas.TournamentCreateUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> schemas.Tournament:
-    return crud.create_tournament(db=db, tournament=tournament)
+    db_tournament = await crud.create_tournament(db=db, tournament=tournament)
+    scheduler.schedule(db_tournament.id, db_tournament.end)
+    return db_tournament
+
 
+async def _tournaments_page(db, skip, limit, sort, cursor, columns: tuple):
+    if skip:
+        return await crud.get_tournaments(db, skip, limit, columns), None
+    return await crud.get_tournaments_page(db, limit, sort, cursor, columns)
 
-@app.get("/tournaments/", response_model=list[schemas.Tournament])
-def read_tournaments(
-    db: Session = Depends(get_db),
+
+def _tournaments_etag(rows):
+    return conditional.make_etag("tournaments", *(f"{row.id}:{row.version}" for row in rows))
+
+
+@router.get("/tournaments/", response_model=list[schemas.Tournament])
+async def read_tournaments(
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
     skip: int = 0,
-    limit: int = 100
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    sort: schemas.TournamentSort = schemas.TournamentSort.id,
+    cursor: str = None
 ) -> schemas.Tournament:
-    return crud.get_tournaments(db, skip, limit)
+    """
+    Keyset paginated like `read_users`. Supports If-None-Match: the ETag
+    changes whenever a tournament of the page changes.
+    """
+    if request.headers.get("if-none-match"):
+        versions, _ = await _tournaments_page(
+            db, skip, limit, sort, cursor, TOURNAMENT_VERSION_COLUMNS
+        )
+        etag = _tournaments_etag(versions)
+        if conditional.is_fresh(request, etag):
+            return conditional.not_modified(request, etag)
+
+    rows, next_cursor = await _tournaments_page(
+        db, skip, limit, sort, cursor, VERSIONED_TOURNAMENT_COLUMNS
+    )
+    return _rows_response(rows, TOURNAMENT_COLUMNS, next_cursor, _tournaments_etag(rows))
 
 
-@app.get("/tournaments/{tournament_id}", response_model=schemas.Tournament)
-def read_tournament(tournament_id: UUID, db: Session = Depends(get_db)) -> schemas.Tournament:
-    tournament = crud.get_tournament(db, tournament_id=tournament_id)
+async def _get_tournament(db: AsyncSession, tournament_id: UUID):
+    tournament = await crud.get_tournament(db, tournament_id=tournament_id)
     if tournament is None:
         raise HTTPException(status_code=404, detail="Tournament not found.")
     return tournament
 
 
-@app.put("/tournaments/update/{tournament_id}", response_model=schemas.Tournament)
-def update_tournament(
+def _tournament_etag(tournament_id: UUID, version: int):
+    return conditional.make_etag("tournament", tournament_id, version)
+
+
+@router.get("/tournaments/{tournament_id}", response_model=schemas.Tournament)
+async def read_tournament(
+    tournament_id: UUID,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db)
+) -> schemas.Tournament:
+    """Supports If-None-Match: the ETag changes whenever the tournament changes."""
+    if request.headers.get("if-none-match"):
+        row = await crud.get_tournament_row(db, tournament_id, (models.Tournament.version,))
+        if row is not None:
+            etag = _tournament_etag(tournament_id, row.version)
+            if conditional.is_fresh(request, etag):
+                return conditional.not_modified(request, etag)
+
+    row = await crud.get_tournament_row(db, tournament_id, VERSIONED_TOURNAMENT_COLUMNS)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Tournament not found.")
+    keys = [column.key for column in TOURNAMENT_COLUMNS]
+    return RowsResponse(
+        dict(zip(keys, row)), headers={"ETag": _tournament_etag(tournament_id, row.version)}
+    )
+
+
+@router.put("/tournaments/update/{tournament_id}", response_model=schemas.Tournament)
+async def update_tournament(
     tournament_id: UUID,
     tournament: schemas.TournamentCreateUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> schemas.Tournament:
-    db_tournament = crud.get_tournament(db, tournament_id=tournament_id)
+    db_tournament = await crud.get_tournament(db, tournament_id=tournament_id)
     if db_tournament is None:
         raise HTTPException(status_code=404, detail="Tournament not found.")
 
@@ -161,24 +557,27 @@ def update_tournament(
     elif db_tournament.begin < D.datetime.now():
         raise HTTPException(status_code=406, detail="Tournament has already started.")
 
-    return crud.update_tournament(db, db_tournament, tournament)
+    db_tournament = await crud.update_tournament(db, db_tournament, tournament)
+    scheduler.schedule(db_tournament.id, db_tournament.end)
+    return db_tournament
 
 
-@app.delete("/tournaments/delete/{tournament_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_tournament(tournament_id: UUID, db: Session = Depends(get_db)):
-    db_tournament = crud.get_tournament(db, tournament_id=tournament_id)
+@router.delete("/tournaments/delete/{tournament_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_tournament(tournament_id: UUID, db: AsyncSession = Depends(get_db)):
+    db_tournament = await crud.get_tournament(db, tournament_id=tournament_id)
     if db_tournament is None:
         raise HTTPException(status_code=404, detail="Tournament not found.")
-    return crud.delete_tournament(db, db_tournament)
+    scheduler.cancel(tournament_id)
+    return await crud.delete_tournament(db, db_tournament)
 
 
-@app.post("/tournaments/{tournament_id}/register", response_model=schemas.Tournament)
-def register_to_tournament(
+@router.post("/tournaments/{tournament_id}/register", response_model=schemas.Tournament)
+async def register_to_tournament(
     tournament_id: UUID,
     user: schemas.UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> schemas.Tournament:
-    db_tournament = crud.get_tournament(db, tournament_id=tournament_id)
+    db_tournament = await crud.get_tournament(db, tournament_id=tournament_id, for_update=True)
     if db_tournament is None:
         raise HTTPException(status_code=404, detail="Tournament not found.")
     if db_tournament.end.replace(tzinfo=pytz.UTC) < D.datetime.now().replace(tzinfo=pytz.UTC):
@@ -186,121 +585,103 @@ def register_to_tournament(
     elif db_tournament.begin.replace(tzinfo=pytz.UTC) < D.datetime.now().replace(tzinfo=pytz.UTC):
         raise HTTPException(status_code=406, detail="Tournament has already started.")
 
-    users_registered = (
-        db.
-        query(models.tournament_user)
-        .filter(models.tournament_user.c.tournament_id == tournament_id)
-        .count()
-    )
-    if users_registered < db_tournament.max_player:
-        user_to_register = create_or_get_user(user, db)
-
-        is_user_already_registered = (
-            db.
-            query(models.tournament_user)
-            .filter(models.tournament_user.c.user_id == user_to_register.id)
-            .filter(models.tournament_user.c.tournament_id == tournament_id)
-            .first()
-        )
-        if is_user_already_registered:
-            raise HTTPException(
-                status_code=406,
-                detail="Already registered in this tournament."
-            )
-
-        db_tournament.player_list.append(user_to_register)
-
-        tournament_data = schemas.TournamentCreateUpdate(
-            players_score={
-                **db_tournament.players_score,
-                str(user_to_register.id): 0
-            }
-        )
-        db_tournament = crud.update_tournament(db, db_tournament, tournament_data)
-
-        db.add(db_tournament)
-        db.commit()
-        db.refresh(db_tournament)
-    else:
-        raise HTTPException(
-            status_code=406,
-            detail="Too many players registered in this tournament."
-        )
-    return db_tournament
+    return await crud.register_player(db, db_tournament, user)
 
 
-@app.post("/tournaments/{tournament_id}/match")
-def match(
+@router.post("/tournaments/{tournament_id}/match")
+async def match(
     tournament_id: UUID,
     player_1_id: UUID,
     player_2_id: UUID,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    match = initialize_match_between_users(tournament_id, player_1_id, player_2_id, db)
-    match = start_match(tournament_id, match.id, db)
-    match = result_match(tournament_id, match.id, db)
+    match = await initialize_match_between_users(tournament_id, player_1_id, player_2_id, db)
+    match = await start_match(tournament_id, match.id, db)
+    match = await result_match(tournament_id, match.id, db)
 
 
-@app.post("/tournaments/{tournament_id}/init_match", response_model=schemas.Match)
-def initialize_match_between_users(
+@router.post("/tournaments/{tournament_id}/rounds", response_model=schemas.Round)
+async def play_round(
+    tournament_id: UUID,
+    pairing: schemas.PairingSystem = schemas.PairingSystem.swiss,
+    round: int = 1,
+    db: AsyncSession = Depends(get_db)
+) -> schemas.Round:
+    """
+    Pair all registered players (Swiss pairing on the current standings, or
+    the `round`-th round of a round robin), then play every match of the round
+    in a single transaction.
+    """
+    db_tournament = await crud.get_tournament(db, tournament_id=tournament_id, for_update=True)
+    if db_tournament is None:
+        raise HTTPException(status_code=404, detail="Tournament not found.")
+    if db_tournament.end.replace(tzinfo=pytz.UTC) < D.datetime.now().replace(tzinfo=pytz.UTC):
+        raise HTTPException(status_code=406, detail="Tournament has already ended.")
+    elif D.datetime.now().replace(tzinfo=pytz.UTC) < db_tournament.begin.replace(tzinfo=pytz.UTC):
+        raise HTTPException(status_code=406, detail="Tournament has not started yet.")
+
+    return await crud.play_round(db, db_tournament, pairing, round)
+
+
+@router.post("/tournaments/{tournament_id}/init_match", response_model=schemas.Match)
+async def initialize_match_between_users(
     tournament_id: UUID,
     player_1_id: UUID,
     player_2_id: UUID,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> schemas.Match:
-    db_tournament = read_tournament(tournament_id=tournament_id, db=db)
+    db_tournament = await _get_tournament(db, tournament_id)
     if db_tournament.end.replace(tzinfo=pytz.UTC) < D.datetime.now().replace(tzinfo=pytz.UTC):
         raise HTTPException(status_code=406, detail="Tournament has already ended.")
     elif D.datetime.now().replace(tzinfo=pytz.UTC) < db_tournament.begin.replace(tzinfo=pytz.UTC):
         raise HTTPException(status_code=406, detail="Tournament has not started yet.")
 
-    read_user(user_id=player_1_id, db=db)
-    read_user(user_id=player_2_id, db=db)
+    await _get_user(db, player_1_id)
+    await _get_user(db, player_2_id)
 
-    is_player_1_registered = (
-        db.
-        query(models.tournament_user)
+    is_player_1_registered = (await db.execute(
+        select(models.tournament_user)
+        .filter(models.tournament_user.c.tournament_id == tournament_id)
         .filter(models.tournament_user.c.user_id == player_1_id)
-        .first()
-    )
+    )).first()
     if is_player_1_registered is None:
         raise HTTPException(
             status_code=404,
             detail="Player 1 is not registered to this tournament."
         )
-    is_player_2_registered = (
-        db.
-        query(models.tournament_user)
+    is_player_2_registered = (await db.execute(
+        select(models.tournament_user)
+        .filter(models.tournament_user.c.tournament_id == tournament_id)
         .filter(models.tournament_user.c.user_id == player_2_id)
-        .first()
-    )
+    )).first()
     if is_player_2_registered is None:
         raise HTTPException(
             status_code=404,
             detail="Player 2 is not registered to this tournament."
         )
-    return create_match(
-        match=schemas.MatchCreate(
+    return await crud.create_match(
+        db,
+        schemas.MatchCreate(
             player_one_id=player_1_id,
             player_two_id=player_2_id,
         ),
-        db=db
+        tournament_id
     )
 
 
-@app.post("/tournaments/{tournament_id}/match/{match_id}/start", response_model=schemas.Match)
-def start_match(
+@router.post("/tournaments/{tournament_id}/match/{match_id}/start", response_model=schemas.Match)
+async def start_match(
     tournament_id: UUID,
     match_id: UUID,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> schemas.Match:
-    db_tournament = read_tournament(tournament_id=tournament_id, db=db)
+    db_tournament = await _get_tournament(db, tournament_id)
     if db_tournament.end.replace(tzinfo=pytz.UTC) < D.datetime.now().replace(tzinfo=pytz.UTC):
         raise HTTPException(status_code=406, detail="Tournament has already ended.")
     elif D.datetime.now().replace(tzinfo=pytz.UTC) < db_tournament.begin.replace(tzinfo=pytz.UTC):
         raise HTTPException(status_code=406, detail="Tournament has not started yet.")
 
-    read_match(match_id, db)
+    await read_match(match_id, db)
     score_one, score_two = one_player_turn(), one_player_turn()
     result = schemas.MatchResult.draw
     if score_one < score_two:
@@ -314,7 +695,7 @@ def start_match(
         result=result
     )
 
-    return update_match(
+    return await update_match(
         match_id=match_id,
         match=match_data,
         db=db
@@ -330,74 +711,162 @@ def one_player_turn():
     return score
 
 
-@app.post("/tournaments/{tournament_id}/match/{match_id}/result", response_model=schemas.Match)
-def result_match(
+@router.post("/tournaments/{tournament_id}/match/{match_id}/result", response_model=schemas.Match)
+async def result_match(
     tournament_id: UUID,
     match_id: UUID,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> schemas.Match:
-    db_tournament = read_tournament(tournament_id=tournament_id, db=db)
+    db_tournament = await _get_tournament(db, tournament_id)
     if db_tournament.end.replace(tzinfo=pytz.UTC) < D.datetime.now().replace(tzinfo=pytz.UTC):
         raise HTTPException(status_code=406, detail="Tournament has already ended.")
     elif D.datetime.now().replace(tzinfo=pytz.UTC) < db_tournament.begin.replace(tzinfo=pytz.UTC):
         raise HTTPException(status_code=406, detail="Tournament has not started yet.")
 
-    db_match = read_match(match_id, db)
-    match_result = db_match.result
+    db_match = await read_match(match_id, db)
+    if db_match.tournament_id != tournament_id:
+        raise HTTPException(status_code=404, detail="Match not found in this tournament.")
+    player_ids = {db_match.player_one_id, db_match.player_two_id}
+    if None in player_ids:
+        raise HTTPException(status_code=406, detail="Match has no player to score.")
+    registered = (await db.execute(
+        select(func.count())
+        .select_from(models.tournament_user)
+        .filter(models.tournament_user.c.tournament_id == tournament_id)
+        .filter(models.tournament_user.c.user_id.in_(player_ids))
+    )).scalar()
+    if registered < len(player_ids):
+        raise HTTPException(
+            status_code=404,
+            detail="A player of this match is not registered to this tournament."
+        )
+    await crud.record_match_result(db, tournament_id, db_match)
+    return db_match
 
-    players_score = {}
-    for key, value in db_tournament.players_score.items():
-        players_score[key] = value
 
-    if match_result == schemas.MatchResult.player1:
-        players_score[str(db_match.player_one_id)] += 3
-    elif match_result == schemas.MatchResult.player2:
-        players_score[str(db_match.player_two_id)] += 3
-    else:
-        players_score[str(db_match.player_one_id)] += 1
-        players_score[str(db_match.player_two_id)] += 1
+@router.post("/tournaments/{tournament_id}/end", response_model=schemas.Payout)
+async def end_tournament(tournament_id: UUID, db: AsyncSession = Depends(get_db)) -> schemas.Payout:
+    db_tournament = await _get_tournament(db, tournament_id)
+    if D.datetime.now().replace(tzinfo=pytz.UTC) < db_tournament.end.replace(tzinfo=pytz.UTC):
+        raise HTTPException(status_code=406, detail="Tournament has not ended yet.")
+    return await crud.pay_out_rewards(db, db_tournament)
 
-    tournament_data = schemas.TournamentCreateUpdate(
-        players_score=players_score
+
+@router.get("/tournaments/{tournament_id}/matches", response_model=list[schemas.Match])
+async def read_tournament_matches(
+    tournament_id: UUID,
+    db: AsyncSession = Depends(get_read_db),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+    player_id: UUID = None
+) -> list[schemas.Match]:
+    """
+    Matches of the tournament, oldest first, keyset paginated like `read_users`.
+    With `player_id`, only the matches of that player.
+    """
+    db_tournament = await _get_tournament(db, tournament_id)
+    rows, next_cursor = await crud.get_tournament_matches_page(
+        db, db_tournament, limit, cursor, player_id, PAGED_MATCH_COLUMNS
     )
-    db_tournament = crud.update_tournament(db, db_tournament, tournament_data)
+    return _rows_response(rows, MATCH_COLUMNS, next_cursor)
 
 
-@app.post("/tournaments/{tournament_id}/end")
-def end_tournament(tournament_id: UUID, db: Session = Depends(get_db)):
-    tournament_leaderboard = leaderboard(tournament_id, db)
-    db_tournament = read_tournament(tournament_id=tournament_id, db=db)
+@router.get("/tournaments/{tournament_id}/leaderboard")
+async def leaderboard(
+    tournament_id: UUID,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    skip: int = 0,
+    limit: int = Query(None, ge=1)
+):
+    """Supports If-None-Match: the ETag changes whenever a score or a player name changes."""
+    row = await crud.get_tournament_row(db, tournament_id, (models.Tournament.version,))
+    if row is None:
+        raise HTTPException(status_code=404, detail="Tournament not found.")
+    etag = conditional.make_etag("leaderboard", tournament_id, row.version, skip, limit)
+    if conditional.is_fresh(request, etag):
+        return conditional.not_modified(request, etag)
 
-    rewards = db_tournament.rewards_range
-    reward_per_position = []
+    entries, _ = await crud.get_leaderboard_entries(db, tournament_id, limit, skip)
+    return ORJSONResponse(
+        [[entry.username, entry.score] for entry in entries], headers={"ETag": etag}
+    )
 
-    for rang, reward in rewards.items():
-        (inf, sup) = rang.split('-')
-        if inf == sup:
-            reward_per_position.append(reward)
-        else:
-            for _ in range(int(inf), int(sup) - int(inf) + 2):  # Stop is ommited
-                reward_per_position.append(reward)
 
-    for i in range(min(len(reward_per_position), len(tournament_leaderboard))):
-        give_award(tournament_leaderboard[i][0], reward_per_position[i], db)
+@router.get("/tournaments/{tournament_id}/leaderboard/stream")
+async def leaderboard_stream(tournament_id: UUID, request: Request):
+    """
+    Server-Sent Events: the leaderboard, then the positions changed by every
+    registration or result, see leaderboard_push.py. Declared before the route
+    of a player's window, which would take "stream" for a user id.
+    """
+    # Not a dependency: its session would hold a connection until the stream ends.
+    async with replicas.session(read_after(request.headers)) as db:
+        row = await crud.get_tournament_row(db, tournament_id, (models.Tournament.id,))
+    if row is None:
+        raise HTTPException(status_code=404, detail="Tournament not found.")
+    if leaderboard_hub.full():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many live leaderboards open, retry later.",
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER)}
+        )
+    return StreamingResponse(
+        leaderboard_hub.stream(tournament_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
-def give_award(username: str, reward: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username)
+@router.get("/tournaments/{tournament_id}/leaderboard/{user_id}")
+async def leaderboard_around_player(
+    tournament_id: UUID,
+    user_id: UUID,
+    neighbours: int = Query(5, ge=0, le=MAX_PAGE_SIZE // 2),
+    db: AsyncSession = Depends(get_read_db)
+):
+    entries = await crud.get_leaderboard_around(db, tournament_id, user_id, neighbours)
+    if not entries:
+        await _get_tournament(db, tournament_id)
+        raise HTTPException(
+            status_code=404,
+            detail="Player is not registered to this tournament."
+        )
+    return {
+        "rank": entries[0].rank,
+        "leaderboard": [[entry.username, entry.score] for entry in entries]
+    }
 
-    user_data = schemas.UserUpdate(
-        points=db_user.points + reward
-    )
-    crud.update_user(db, db_user, user_data)
-
-
-@app.get("/tournaments/{tournament_id}/leaderboard")
-def leaderboard(tournament_id: UUID, db: Session = Depends(get_db)):
-    db_tournament = read_tournament(tournament_id=tournament_id, db=db)
-    leaderboard = db_tournament.leaderboard()
-    for i in range(len(leaderboard)):
-        user_id = leaderboard[i][0]
-        db_user = crud.get_user(db, user_id)
-        leaderboard[i][0] = db_user.username
-    return leaderboard
+
+@router.get("/tournaments/{tournament_id}/standings", response_model=schemas.LeaderboardPage)
+async def standings(
+    tournament_id: UUID,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+    around: UUID = None,
+    neighbours: int = Query(5, ge=0, le=MAX_PAGE_SIZE // 2),
+    db: AsyncSession = Depends(get_read_db)
+) -> schemas.LeaderboardPage:
+    """
+    Compact, paginated standings. Either pages with `limit`/`cursor` or,
+    when `around` is given, returns the window centred on that player.
+    """
+    if around is not None:
+        entries = await crud.get_leaderboard_around(db, tournament_id, around, neighbours)
+        next_cursor = None
+        if not entries:
+            await _get_tournament(db, tournament_id)
+            raise HTTPException(
+                status_code=404,
+                detail="Player is not registered to this tournament."
+            )
+    else:
+        entries, next_cursor = await crud.get_leaderboard_entries(
+            db, tournament_id, limit, cursor=cursor
+        )
+        if not entries and cursor is None:
+            await _get_tournament(db, tournament_id)
+    return schemas.LeaderboardPage(entries=entries, next_cursor=next_cursor)
+
+
+app = create_app()
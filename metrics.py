@@ -0,0 +1,308 @@
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event, exc
+import logging
+import threading
+import time
+
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+# Statements kept for the slow request log, and characters kept of each.
+MAX_LOGGED_QUERIES = 50
+MAX_QUERY_LENGTH = 500
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), -1)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """Cumulative bucket counts, keyed by upper bound."""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative, buckets = 0, {}
+        for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+
+class PoolMetrics:
+    """
+    Live health of an engine's connection pool: checkout wait times,
+    overflow connections, checkout timeouts and invalidated connections.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.wait_time = Histogram(POOL_WAIT_BUCKETS)
+        self.checkouts = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.invalidations = 0
+
+    def listen(self, engine):
+        self.pool = engine.pool
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "invalidate", self._on_invalidate)
+        event.listen(engine, "soft_invalidate", self._on_invalidate)
+
+    def _on_checkout(self, _dbapi_connection, _record, _proxy):
+        self.checkouts += 1
+
+    def _on_connect(self, _dbapi_connection, _record):
+        if self.pool is not None and self.pool.overflow() > 0:
+            self.overflows += 1
+
+    def _on_invalidate(self, _dbapi_connection, _record, _exception):
+        self.invalidations += 1
+
+    def snapshot(self):
+        pool = self.pool
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": self.checkouts,
+            "overflow_events": self.overflows,
+            "timeouts": self.timeouts,
+            "invalidations": self.invalidations,
+            "wait_time": self.wait_time.snapshot(),
+        }
+
+    def export(self, writer, **labels):
+        pool = self.pool
+        for name, help, value in (
+            ("db_pool_size", "Connections kept open by the pool.", pool.size()),
+            ("db_pool_checked_out", "Connections in use.", pool.checkedout()),
+            ("db_pool_overflow", "Connections opened over the pool size.", pool.overflow()),
+        ):
+            writer.add(name, "gauge", help, value, **labels)
+        for name, help, value in (
+            ("db_pool_checkouts_total", "Connection checkouts.", self.checkouts),
+            ("db_pool_overflow_events_total", "Overflow connections opened.", self.overflows),
+            ("db_pool_timeouts_total", "Checkouts given up after DB_POOL_TIMEOUT.", self.timeouts),
+            ("db_pool_invalidations_total", "Connections invalidated.", self.invalidations),
+        ):
+            writer.add(name, "counter", help, value, **labels)
+        writer.add_histogram(
+            "db_pool_wait_seconds", "Time waited for a connection.", self.wait_time, **labels
+        )
+
+
+def instrumented_pool(pool_class, metrics: PoolMetrics):
+    """Return a subclass of `pool_class` recording how long checkouts wait."""
+
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                metrics.timeouts += 1
+                raise
+            finally:
+                waited = time.perf_counter() - started
+                metrics.wait_time.observe(waited)
+                stats = _request_stats.get()
+                if stats is not None:
+                    stats.pool_wait += waited
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+
+class RequestStats:
+    """Database work of the current request, gathered by the engine events."""
+
+    def __init__(self, record_queries: bool = False):
+        self.statements = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        # (statement, seconds), only kept for the slow request log.
+        self.queries = [] if record_queries else None
+
+
+# Set by MetricsMiddleware. SQLAlchemy runs the async engine's events in
+# greenlets sharing the caller's context, so they see it too.
+_request_stats = ContextVar("request_stats", default=None)
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_time = Histogram(LATENCY_BUCKETS)
+        self.statuses = Counter()
+
+
+class RequestMetrics:
+    """
+    Per-route latency, SQL statements and database time of each request.
+    Requests slower than `slow_request_threshold` seconds (0 disables) are
+    logged with the statements they ran.
+    """
+
+    def __init__(self, slow_request_threshold: float = 0):
+        self.slow_request_threshold = slow_request_threshold
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def listen(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, _cursor, _statement, _parameters, _context, _executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, _cursor, statement, _parameters, _context, _executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = _request_stats.get()
+        if stats is None:
+            return
+        stats.statements += 1
+        stats.db_time += elapsed
+        if stats.queries is not None and len(stats.queries) < MAX_LOGGED_QUERIES:
+            stats.queries.append((statement[:MAX_QUERY_LENGTH], elapsed))
+
+    def _route(self, method: str, route: str):
+        key = (method, route)
+        if key not in self.routes:
+            with self._lock:
+                self.routes.setdefault(key, RouteMetrics())
+        return self.routes[key]
+
+    def observe(self, method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+        metrics = self._route(method, route)
+        metrics.latency.observe(elapsed)
+        metrics.statements.observe(stats.statements)
+        metrics.db_time.observe(stats.db_time)
+        metrics.statuses[status] += 1
+        if self.slow_request_threshold and elapsed >= self.slow_request_threshold:
+            self._log_slow_request(method, route, status, elapsed, stats)
+
+    def _log_slow_request(self, method, route, status, elapsed, stats: RequestStats):
+        queries = "".join(
+            f"\n  {seconds * 1000:8.1f} ms  {' '.join(statement.split())}"
+            for statement, seconds in stats.queries or ()
+        )
+        if stats.statements > len(stats.queries or ()):
+            queries += f"\n  ... {stats.statements - len(stats.queries or ())} more"
+        logger.warning(
+            "Slow request %s %s (%s): %.0f ms, %d statements, %.0f ms in the database, "
+            "%.0f ms waiting for a connection%s",
+            method, route, status, elapsed * 1000, stats.statements, stats.db_time * 1000,
+            stats.pool_wait * 1000, queries
+        )
+
+    def export(self, writer):
+        for (method, route), metrics in list(self.routes.items()):
+            labels = {"method": method, "route": route}
+            for status, count in list(metrics.statuses.items()):
+                writer.add(
+                    "http_requests_total", "counter", "Requests answered.", count,
+                    **labels, status=status
+                )
+            writer.add_histogram(
+                "http_request_duration_seconds", "Request latency.", metrics.latency, **labels
+            )
+            writer.add_histogram(
+                "http_request_db_statements", "SQL statements run per request.",
+                metrics.statements, **labels
+            )
+            writer.add_histogram(
+                "http_request_db_seconds", "Time spent in SQL statements per request.",
+                metrics.db_time, **labels
+            )
+
+
+class MetricsMiddleware:
+    """ASGI middleware feeding RequestMetrics, streamed bodies included."""
+
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+        self._route_paths = None
+
+    def _route(self, scope):
+        # The router stores the matched endpoint in the scope: label by path template.
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path for route in scope["app"].routes
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(record_queries=bool(self.metrics.slow_request_threshold))
+        token = _request_stats.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_stats.reset(token)
+            self.metrics.observe(
+                scope["method"], self._route(scope), status, time.perf_counter() - started, stats
+            )
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class PrometheusWriter:
+    """Prometheus text exposition format, samples grouped by metric family."""
+
+    def __init__(self):
+        self._families = {}
+
+    def _family(self, name: str, type: str, help: str):
+        if name not in self._families:
+            self._families[name] = [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+        return self._families[name]
+
+    @staticmethod
+    def _labels(labels: dict):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+    def add(self, name: str, type: str, help: str, value, **labels):
+        self._family(name, type, help).append(f"{name}{self._labels(labels)} {value}")
+
+    def add_histogram(self, name: str, help: str, histogram: Histogram, **labels):
+        snapshot = histogram.snapshot()
+        samples = self._family(name, "histogram", help)
+        for bound, count in snapshot["buckets"].items():
+            samples.append(f"{name}_bucket{self._labels({**labels, 'le': bound})} {count}")
+        samples.append(f"{name}_sum{self._labels(labels)} {snapshot['sum']}")
+        samples.append(f"{name}_count{self._labels(labels)} {snapshot['count']}")
+
+    def render(self):
+        return "".join(line + "\n" for samples in self._families.values() for line in samples)
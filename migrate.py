@@ -0,0 +1,67 @@
+"""
+Schema migrations, applied with yoyo as a deployment step before the workers start.
+
+    python -m migrate            apply the pending migrations, then create the partitions
+    python -m migrate partitions create the monthly partitions of matches due in the next months
+    python -m migrate rollback   roll back the last applied migration
+    python -m migrate reset      roll back every migration, then apply them again
+    python -m migrate list       show the migrations and their state
+
+The database settings come from config.py (environment and .env), like the app.
+`partitions` is also meant to run periodically (cron) where no worker runs the
+scheduler, which otherwise creates them on every resync.
+"""
+from pathlib import Path
+from yoyo import get_backend, read_migrations
+import argparse
+
+from db import DATABASE_URL, SessionLocal
+import crud
+
+MIGRATIONS_PATH = Path(__file__).with_name("migrations")
+
+
+def _backend_and_migrations():
+    return get_backend(DATABASE_URL), read_migrations(str(MIGRATIONS_PATH))
+
+
+def apply():
+    backend, migrations = _backend_and_migrations()
+    with backend.lock():
+        backend.apply_migrations(backend.to_apply(migrations))
+    create_partitions()
+
+
+def create_partitions():
+    with SessionLocal() as db:
+        crud.create_match_partitions(db)
+
+
+def rollback(count: int = 1):
+    backend, migrations = _backend_and_migrations()
+    with backend.lock():
+        backend.rollback_migrations(backend.to_rollback(migrations)[:count])
+
+
+def reset():
+    backend, migrations = _backend_and_migrations()
+    with backend.lock():
+        backend.rollback_migrations(backend.to_rollback(migrations))
+        backend.apply_migrations(backend.to_apply(migrations))
+
+
+def show():
+    backend, migrations = _backend_and_migrations()
+    applied = {migration.id for migration in backend.to_rollback(migrations)}
+    for migration in migrations:
+        print(f"{'A' if migration.id in applied else 'U'} {migration.id}")
+
+
+if __name__ == "__main__":
+    commands = {
+        "apply": apply, "partitions": create_partitions, "rollback": rollback, "reset": reset,
+        "list": show
+    }
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", nargs="?", choices=list(commands), default="apply")
+    commands[parser.parse_args().command]()
@@ -0,0 +1,5 @@
+-- user_stats_add depends on the row type of matches: dropped first.
+DROP FUNCTION IF EXISTS user_stats_add(matches[], integer);
+DROP TABLE IF EXISTS user_stats, matches, tournament_user, tournament_rewards, tournaments, users;
+DROP FUNCTION IF EXISTS matches_user_stats();
+DROP TYPE IF EXISTS result;
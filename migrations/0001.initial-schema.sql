@@ -0,0 +1,191 @@
+-- Schema declared in models.py as of this migration.
+-- Idempotent, so databases created by the former create_all at startup adopt it: create_all
+-- skipped the existing tables, the columns and constraints added since are added below.
+
+DO $$ BEGIN
+    CREATE TYPE result AS ENUM ('PLAYER1', 'DRAW', 'PLAYER2');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+CREATE TABLE IF NOT EXISTS users (
+    id uuid PRIMARY KEY,
+    username varchar NOT NULL,
+    phone_number varchar,
+    points integer
+);
+CREATE INDEX IF NOT EXISTS ix_users_username ON users (username);
+CREATE INDEX IF NOT EXISTS ix_users_phone_number ON users (phone_number);
+-- Prefix search on lower(username) (`LIKE 'x%'`).
+CREATE INDEX IF NOT EXISTS ix_users_username_lower_prefix
+    ON users (lower(username) text_pattern_ops);
+-- Keyset pagination by points.
+CREATE INDEX IF NOT EXISTS ix_users_points_id ON users (points, id);
+
+-- Substring search on lower(username) (`LIKE '%x%'`), where pg_trgm is installed.
+DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS ix_users_username_trgm
+            ON users USING gin (lower(username) gin_trgm_ops);
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS tournaments (
+    id uuid PRIMARY KEY,
+    max_player integer,
+    players_score jsonb,
+    begin timestamp with time zone NOT NULL,
+    "end" timestamp with time zone NOT NULL,
+    rewards_sum integer,
+    rewards_range jsonb,
+    paid_out_at timestamp with time zone
+);
+ALTER TABLE tournaments ADD COLUMN IF NOT EXISTS paid_out_at timestamp with time zone;
+-- Keyset pagination by start date.
+CREATE INDEX IF NOT EXISTS ix_tournaments_begin_id ON tournaments (begin, id);
+-- Upcoming ends still to be paid out, read by the lifecycle scheduler.
+CREATE INDEX IF NOT EXISTS ix_tournaments_unpaid_end ON tournaments ("end")
+    WHERE paid_out_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS tournament_rewards (
+    tournament_id uuid REFERENCES tournaments (id) ON DELETE CASCADE,
+    position integer,
+    reward integer NOT NULL,
+    PRIMARY KEY (tournament_id, position)
+);
+-- Rewards of the tournaments created before this table, compiled from their rewards_range
+-- ({"X-Y": reward}, bounds included) like crud._rewards_table: without them a payout
+-- would credit nobody.
+INSERT INTO tournament_rewards (tournament_id, position, reward)
+SELECT t.id, position, ranges.reward::integer
+FROM tournaments AS t
+CROSS JOIN LATERAL jsonb_each_text(t.rewards_range) AS ranges (bounds, reward)
+CROSS JOIN LATERAL generate_series(
+    split_part(ranges.bounds, '-', 1)::integer, split_part(ranges.bounds, '-', 2)::integer
+) AS position
+WHERE jsonb_typeof(t.rewards_range) = 'object'
+    AND NOT EXISTS (SELECT 1 FROM tournament_rewards AS r WHERE r.tournament_id = t.id)
+ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS tournament_user (
+    tournament_id uuid REFERENCES tournaments (id),
+    user_id uuid REFERENCES users (id),
+    score integer NOT NULL DEFAULT 0,
+    CONSTRAINT uq_tournament_user UNIQUE (tournament_id, user_id)
+);
+ALTER TABLE tournament_user ADD COLUMN IF NOT EXISTS score integer NOT NULL DEFAULT 0;
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_tournament_user') THEN
+        -- Registrations were not unique before: keep one row per player.
+        DELETE FROM tournament_user AS duplicate
+        USING tournament_user AS kept
+        WHERE duplicate.tournament_id = kept.tournament_id
+            AND duplicate.user_id = kept.user_id
+            AND duplicate.ctid > kept.ctid;
+        ALTER TABLE tournament_user
+            ADD CONSTRAINT uq_tournament_user UNIQUE (tournament_id, user_id);
+    END IF;
+END $$;
+-- Standings kept in players_score before the score column: copied over, else every
+-- leaderboard would read zeros (and the next players_score sync would write them back).
+UPDATE tournament_user AS registration
+SET score = (t.players_score ->> registration.user_id::text)::integer
+FROM tournaments AS t
+WHERE t.id = registration.tournament_id
+    AND registration.score = 0
+    AND coalesce((t.players_score ->> registration.user_id::text)::integer, 0) <> 0;
+-- Ranked index over the standings.
+CREATE INDEX IF NOT EXISTS ix_tournament_user_ranking
+    ON tournament_user (tournament_id, score DESC, user_id);
+CREATE INDEX IF NOT EXISTS ix_tournament_user_user_id ON tournament_user (user_id);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id uuid PRIMARY KEY,
+    player_one_id uuid REFERENCES users (id),
+    player_two_id uuid REFERENCES users (id),
+    result result NOT NULL,
+    score_one integer,
+    score_two integer,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+-- The existing matches are dated by the migration.
+ALTER TABLE matches ADD COLUMN IF NOT EXISTS created_at timestamp with time zone NOT NULL
+    DEFAULT now();
+CREATE INDEX IF NOT EXISTS ix_matches_player_one_id ON matches (player_one_id);
+CREATE INDEX IF NOT EXISTS ix_matches_player_two_id ON matches (player_two_id);
+-- Exports stream the match history in (created_at, id) order.
+CREATE INDEX IF NOT EXISTS ix_matches_created_at_id ON matches (created_at, id);
+-- Head-to-head records, read in both player orders.
+CREATE INDEX IF NOT EXISTS ix_matches_player_one_id_player_two_id
+    ON matches (player_one_id, player_two_id);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id uuid PRIMARY KEY REFERENCES users (id),
+    played integer NOT NULL DEFAULT 0,
+    wins integer NOT NULL DEFAULT 0,
+    draws integer NOT NULL DEFAULT 0,
+    losses integer NOT NULL DEFAULT 0,
+    points_scored integer NOT NULL DEFAULT 0,
+    points_conceded integer NOT NULL DEFAULT 0
+);
+
+-- Every statement on matches applies the net change of its rows to
+-- user_stats in one upsert, ordered by user.
+CREATE OR REPLACE FUNCTION user_stats_add(rows matches[], sign integer) RETURNS void AS $$
+    INSERT INTO user_stats AS stats
+        (user_id, played, wins, draws, losses, points_scored, points_conceded)
+    SELECT
+        side.user_id,
+        sign * count(*),
+        sign * count(*) FILTER (WHERE side.outcome = 1),
+        sign * count(*) FILTER (WHERE side.outcome = 0),
+        sign * count(*) FILTER (WHERE side.outcome = -1),
+        sign * coalesce(sum(side.scored), 0),
+        sign * coalesce(sum(side.conceded), 0)
+    FROM unnest(rows) AS m
+    CROSS JOIN LATERAL (VALUES
+        (m.player_one_id, CASE m.result WHEN 'PLAYER1' THEN 1 WHEN 'PLAYER2' THEN -1 ELSE 0 END,
+         m.score_one, m.score_two),
+        (m.player_two_id, CASE m.result WHEN 'PLAYER2' THEN 1 WHEN 'PLAYER1' THEN -1 ELSE 0 END,
+         m.score_two, m.score_one)
+    ) AS side (user_id, outcome, scored, conceded)
+    WHERE side.user_id IS NOT NULL
+    GROUP BY side.user_id
+    ORDER BY side.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        played = stats.played + excluded.played,
+        wins = stats.wins + excluded.wins,
+        draws = stats.draws + excluded.draws,
+        losses = stats.losses + excluded.losses,
+        points_scored = stats.points_scored + excluded.points_scored,
+        points_conceded = stats.points_conceded + excluded.points_conceded
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION matches_user_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM user_stats_add(ARRAY(SELECT ROW(m.*)::matches FROM old_rows m), -1);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM user_stats_add(ARRAY(SELECT ROW(m.*)::matches FROM new_rows m), 1);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Backfill, unless the triggers below already maintain user_stats.
+SELECT user_stats_add(ARRAY(SELECT m FROM matches m), 1)
+WHERE NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'matches_user_stats_insert');
+
+DROP TRIGGER IF EXISTS matches_user_stats_insert ON matches;
+CREATE TRIGGER matches_user_stats_insert AFTER INSERT ON matches
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
+DROP TRIGGER IF EXISTS matches_user_stats_update ON matches;
+CREATE TRIGGER matches_user_stats_update AFTER UPDATE ON matches
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
+DROP TRIGGER IF EXISTS matches_user_stats_delete ON matches;
+CREATE TRIGGER matches_user_stats_delete AFTER DELETE ON matches
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
@@ -0,0 +1,3 @@
+DROP TRIGGER IF EXISTS tournaments_bump_version ON tournaments;
+DROP FUNCTION IF EXISTS tournaments_bump_version();
+ALTER TABLE tournaments DROP COLUMN IF EXISTS version;
@@ -0,0 +1,16 @@
+-- depends: 0001.initial-schema
+-- Version of a tournament, bumped by every UPDATE of its row: settings, registrations,
+-- match results and rounds (which also update players_score) and the payout.
+-- Drives the ETags of the tournament reads.
+
+ALTER TABLE tournaments ADD COLUMN version bigint NOT NULL DEFAULT 1;
+
+CREATE FUNCTION tournaments_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournaments_bump_version BEFORE UPDATE ON tournaments
+    FOR EACH ROW EXECUTE FUNCTION tournaments_bump_version();
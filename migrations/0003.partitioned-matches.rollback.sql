@@ -0,0 +1,68 @@
+DROP FUNCTION user_stats_add(matches[], integer);
+
+ALTER TABLE matches RENAME TO matches_partitioned;
+ALTER TABLE matches_partitioned RENAME CONSTRAINT matches_pkey TO matches_partitioned_pkey;
+DROP INDEX ix_matches_player_one_id, ix_matches_player_two_id, ix_matches_created_at_id,
+    ix_matches_player_one_id_player_two_id, ix_matches_tournament_id_created_at_id,
+    ix_matches_tournament_id_player_one_id, ix_matches_tournament_id_player_two_id;
+
+CREATE TABLE matches (
+    id uuid PRIMARY KEY,
+    player_one_id uuid REFERENCES users (id),
+    player_two_id uuid REFERENCES users (id),
+    result result NOT NULL,
+    score_one integer,
+    score_two integer,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+INSERT INTO matches (id, player_one_id, player_two_id, result, score_one, score_two, created_at)
+SELECT id, player_one_id, player_two_id, result, score_one, score_two, created_at
+FROM matches_partitioned;
+
+DROP TABLE matches_partitioned;
+DROP FUNCTION matches_create_partitions(timestamptz, interval);
+
+CREATE INDEX ix_matches_player_one_id ON matches (player_one_id);
+CREATE INDEX ix_matches_player_two_id ON matches (player_two_id);
+CREATE INDEX ix_matches_created_at_id ON matches (created_at, id);
+CREATE INDEX ix_matches_player_one_id_player_two_id ON matches (player_one_id, player_two_id);
+
+CREATE FUNCTION user_stats_add(rows matches[], sign integer) RETURNS void AS $$
+    INSERT INTO user_stats AS stats
+        (user_id, played, wins, draws, losses, points_scored, points_conceded)
+    SELECT
+        side.user_id,
+        sign * count(*),
+        sign * count(*) FILTER (WHERE side.outcome = 1),
+        sign * count(*) FILTER (WHERE side.outcome = 0),
+        sign * count(*) FILTER (WHERE side.outcome = -1),
+        sign * coalesce(sum(side.scored), 0),
+        sign * coalesce(sum(side.conceded), 0)
+    FROM unnest(rows) AS m
+    CROSS JOIN LATERAL (VALUES
+        (m.player_one_id, CASE m.result WHEN 'PLAYER1' THEN 1 WHEN 'PLAYER2' THEN -1 ELSE 0 END,
+         m.score_one, m.score_two),
+        (m.player_two_id, CASE m.result WHEN 'PLAYER2' THEN 1 WHEN 'PLAYER1' THEN -1 ELSE 0 END,
+         m.score_two, m.score_one)
+    ) AS side (user_id, outcome, scored, conceded)
+    WHERE side.user_id IS NOT NULL
+    GROUP BY side.user_id
+    ORDER BY side.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        played = stats.played + excluded.played,
+        wins = stats.wins + excluded.wins,
+        draws = stats.draws + excluded.draws,
+        losses = stats.losses + excluded.losses,
+        points_scored = stats.points_scored + excluded.points_scored,
+        points_conceded = stats.points_conceded + excluded.points_conceded
+$$ LANGUAGE sql;
+
+CREATE TRIGGER matches_user_stats_insert AFTER INSERT ON matches
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
+CREATE TRIGGER matches_user_stats_update AFTER UPDATE ON matches
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
+CREATE TRIGGER matches_user_stats_delete AFTER DELETE ON matches
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
@@ -0,0 +1,141 @@
+-- depends: 0002.tournament-version
+-- Matches carry their tournament (NULL for the friendly matches of POST /matches/), and
+-- the table is partitioned by month of created_at: the recent partitions and their indexes
+-- stay small however long the history grows. Reads of a tournament's matches are bounded
+-- to its period, so only the partitions it spans are scanned. The primary key of a
+-- partitioned table has to include the partition key: (id, created_at).
+
+-- The stats functions take the row type of matches, which is replaced.
+DROP FUNCTION user_stats_add(matches[], integer);
+
+ALTER TABLE matches RENAME TO matches_unpartitioned;
+ALTER TABLE matches_unpartitioned RENAME CONSTRAINT matches_pkey TO matches_unpartitioned_pkey;
+DROP INDEX ix_matches_player_one_id, ix_matches_player_two_id, ix_matches_created_at_id,
+    ix_matches_player_one_id_player_two_id;
+
+CREATE TABLE matches (
+    id uuid NOT NULL,
+    player_one_id uuid REFERENCES users (id),
+    player_two_id uuid REFERENCES users (id),
+    result result NOT NULL,
+    score_one integer,
+    score_two integer,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    tournament_id uuid REFERENCES tournaments (id) ON DELETE SET NULL,
+    CONSTRAINT matches_pkey PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+-- Rows past the last monthly partition, moved out when their partition is created.
+CREATE TABLE matches_default PARTITION OF matches DEFAULT;
+
+-- Monthly partitions (UTC months) from the month of `since` to `ahead` from now, created
+-- ahead of time by the lifecycle scheduler. A no-op for the partitions which exist.
+CREATE FUNCTION matches_create_partitions(since timestamptz, ahead interval DEFAULT '3 months')
+RETURNS void AS $$
+DECLARE
+    month timestamp := date_trunc('month', since AT TIME ZONE 'UTC');
+    partition text;
+BEGIN
+    -- Workers run it concurrently.
+    PERFORM pg_advisory_xact_lock(hashtext('matches_create_partitions'));
+    WHILE month AT TIME ZONE 'UTC' <= now() + ahead LOOP
+        partition := 'matches_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(partition) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I (LIKE matches INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                partition
+            );
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM matches_default WHERE created_at >= %L '
+                'AND created_at < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+                month AT TIME ZONE 'UTC', (month + interval '1 month') AT TIME ZONE 'UTC',
+                partition
+            );
+            EXECUTE format(
+                'ALTER TABLE matches ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition, month AT TIME ZONE 'UTC',
+                (month + interval '1 month') AT TIME ZONE 'UTC'
+            );
+        END IF;
+        month := month + interval '1 month';
+    END LOOP;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$ BEGIN
+    PERFORM matches_create_partitions(coalesce(min(created_at), now())) FROM matches_unpartitioned;
+END $$;
+
+-- Existing matches are linked to the tournament they were played in: during its period,
+-- between two of its players. Those matching several tournaments are left unlinked.
+INSERT INTO matches
+    (id, player_one_id, player_two_id, result, score_one, score_two, created_at, tournament_id)
+SELECT m.id, m.player_one_id, m.player_two_id, m.result, m.score_one, m.score_two,
+       m.created_at, linked.tournament_id
+FROM matches_unpartitioned AS m
+LEFT JOIN (
+    SELECT m.id, (array_agg(t.id))[1] AS tournament_id
+    FROM matches_unpartitioned AS m
+    JOIN tournament_user AS one ON one.user_id = m.player_one_id
+    JOIN tournament_user AS two
+        ON two.user_id = m.player_two_id AND two.tournament_id = one.tournament_id
+    JOIN tournaments AS t
+        ON t.id = one.tournament_id AND m.created_at BETWEEN t.begin AND t."end"
+    GROUP BY m.id
+    HAVING count(*) = 1
+) AS linked ON linked.id = m.id;
+
+DROP TABLE matches_unpartitioned;
+
+-- Indexes of the parent table, created on every partition.
+CREATE INDEX ix_matches_player_one_id ON matches (player_one_id);
+CREATE INDEX ix_matches_player_two_id ON matches (player_two_id);
+-- Exports stream the match history in (created_at, id) order.
+CREATE INDEX ix_matches_created_at_id ON matches (created_at, id);
+-- Head-to-head records, read in both player orders.
+CREATE INDEX ix_matches_player_one_id_player_two_id ON matches (player_one_id, player_two_id);
+-- Matches of a tournament in (created_at, id) order, and of a player in a tournament.
+CREATE INDEX ix_matches_tournament_id_created_at_id ON matches (tournament_id, created_at, id);
+CREATE INDEX ix_matches_tournament_id_player_one_id ON matches (tournament_id, player_one_id);
+CREATE INDEX ix_matches_tournament_id_player_two_id ON matches (tournament_id, player_two_id);
+
+-- Same as in 0001, on the new row type. user_stats is unchanged by the copy above.
+CREATE FUNCTION user_stats_add(rows matches[], sign integer) RETURNS void AS $$
+    INSERT INTO user_stats AS stats
+        (user_id, played, wins, draws, losses, points_scored, points_conceded)
+    SELECT
+        side.user_id,
+        sign * count(*),
+        sign * count(*) FILTER (WHERE side.outcome = 1),
+        sign * count(*) FILTER (WHERE side.outcome = 0),
+        sign * count(*) FILTER (WHERE side.outcome = -1),
+        sign * coalesce(sum(side.scored), 0),
+        sign * coalesce(sum(side.conceded), 0)
+    FROM unnest(rows) AS m
+    CROSS JOIN LATERAL (VALUES
+        (m.player_one_id, CASE m.result WHEN 'PLAYER1' THEN 1 WHEN 'PLAYER2' THEN -1 ELSE 0 END,
+         m.score_one, m.score_two),
+        (m.player_two_id, CASE m.result WHEN 'PLAYER2' THEN 1 WHEN 'PLAYER1' THEN -1 ELSE 0 END,
+         m.score_two, m.score_one)
+    ) AS side (user_id, outcome, scored, conceded)
+    WHERE side.user_id IS NOT NULL
+    GROUP BY side.user_id
+    ORDER BY side.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        played = stats.played + excluded.played,
+        wins = stats.wins + excluded.wins,
+        draws = stats.draws + excluded.draws,
+        losses = stats.losses + excluded.losses,
+        points_scored = stats.points_scored + excluded.points_scored,
+        points_conceded = stats.points_conceded + excluded.points_conceded
+$$ LANGUAGE sql;
+
+-- Statement triggers of a partitioned table see the rows of every partition.
+CREATE TRIGGER matches_user_stats_insert AFTER INSERT ON matches
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
+CREATE TRIGGER matches_user_stats_update AFTER UPDATE ON matches
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
+CREATE TRIGGER matches_user_stats_delete AFTER DELETE ON matches
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION matches_user_stats();
@@ -0,0 +1,2 @@
+DROP TRIGGER IF EXISTS tournaments_notify_leaderboard ON tournaments;
+DROP FUNCTION IF EXISTS tournaments_notify_leaderboard();
@@ -0,0 +1,15 @@
+-- depends: 0003.partitioned-matches
+-- Notifies the workers pushing the live leaderboard of a tournament (leaderboard_push.py)
+-- after every update of its row: registrations, match results, rounds, renamed players
+-- (see 0002), whichever worker committed them, and after its deletion. The payload is the
+-- tournament id alone, so the notifications of one transaction are folded into one.
+
+CREATE FUNCTION tournaments_notify_leaderboard() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('leaderboard', OLD.id::text);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournaments_notify_leaderboard AFTER UPDATE OR DELETE ON tournaments
+    FOR EACH ROW EXECUTE FUNCTION tournaments_notify_leaderboard();
@@ -0,0 +1 @@
+ALTER TABLE matches DROP COLUMN IF EXISTS scored_at;
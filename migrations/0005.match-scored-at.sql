@@ -0,0 +1,7 @@
+-- depends: 0004.leaderboard-notify
+-- When the result of a match was credited to its players: POST .../match/{id}/result
+-- sets it in the transaction adding the points and refuses a match already scored.
+-- Matches played by rounds are scored on insert. Matches recorded before this
+-- migration are left unscored: nothing tells whether their result was posted.
+
+ALTER TABLE matches ADD COLUMN IF NOT EXISTS scored_at timestamp with time zone;
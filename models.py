@@ -1,6 +1,7 @@
 from sqlalchemy.orm import validates, relationship
 from sqlalchemy import (
-    Column, String, Integer, ForeignKey, Enum, DateTime, Table
+    Column, String, Integer, BigInteger, ForeignKey, Enum, DateTime, Table, Index,
+    UniqueConstraint, func, text
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.ext.declarative import declarative_base
@@ -8,22 +9,41 @@ import datetime as D
 import uuid
 import re
 
+# The schema (tables, indexes, triggers) is created by the migrations only.
 Base = declarative_base()
 
 tournament_user = Table(
     "tournament_user",
     Base.metadata,
     Column("tournament_id", ForeignKey("tournaments.id")),
-    Column("user_id", ForeignKey("users.id"))
+    Column("user_id", ForeignKey("users.id")),
+    Column("score", Integer, nullable=False, default=0, server_default="0"),
+    UniqueConstraint("tournament_id", "user_id", name="uq_tournament_user")
 )
 
+# Ranked index over the standings: every leaderboard read (full, top-N, page,
+# rank of a player and its neighbours) is an ordered scan of this index.
+Index(
+    "ix_tournament_user_ranking",
+    tournament_user.c.tournament_id,
+    tournament_user.c.score.desc(),
+    tournament_user.c.user_id,
+)
+Index("ix_tournament_user_user_id", tournament_user.c.user_id)
+
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Prefix search on lower(username) (`LIKE 'x%'`).
+        Index("ix_users_username_lower_prefix", text("lower(username) text_pattern_ops")),
+        # Keyset pagination by points.
+        Index("ix_users_points_id", "points", "id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    username = Column(String, nullable=False)
-    phone_number = Column(String)
+    username = Column(String, nullable=False, index=True)
+    phone_number = Column(String, index=True)
     points = Column(Integer, default=0)
 
     matches_as_player_one = relationship(
@@ -39,29 +59,53 @@ class User(Base):
 
     @validates('username')
     def validate_username(self, _key, value):
-        value_stripped = value.strip()
-        assert len(value_stripped) >= 3 and len(value_stripped) <= 38, \
-            "Username must be between 3 and 38 characters"
-
-        return value_stripped
+        return clean_username(value)
 
     @validates('phone_number')
     def validate_phone(self, _key, value):
-        value_stripped = value.strip()
-        assert re.match("(^[0-9]{10}$)", value_stripped), "Incorrect phone number."
-        return value_stripped
+        return clean_phone_number(value)
+
+
+PHONE_NUMBER_PATTERN = re.compile("(^[0-9]{10}$)")
+
+
+# Also applied to bulk imports, which skip the ORM.
+def clean_username(value: str):
+    value_stripped = value.strip()
+    assert len(value_stripped) >= 3 and len(value_stripped) <= 38, \
+        "Username must be between 3 and 38 characters"
+
+    return value_stripped
+
+
+def clean_phone_number(value: str):
+    value_stripped = value.strip()
+    assert PHONE_NUMBER_PATTERN.match(value_stripped), "Incorrect phone number."
+    return value_stripped
 
 
 class Match(Base):
     __tablename__ = "matches"
+    __table_args__ = (
+        # Exports stream the match history in (created_at, id) order.
+        Index("ix_matches_created_at_id", "created_at", "id"),
+        # Head-to-head records, read in both player orders.
+        Index("ix_matches_player_one_id_player_two_id", "player_one_id", "player_two_id"),
+        # Matches of a tournament in (created_at, id) order, and of a player in a tournament.
+        Index("ix_matches_tournament_id_created_at_id", "tournament_id", "created_at", "id"),
+        Index("ix_matches_tournament_id_player_one_id", "tournament_id", "player_one_id"),
+        Index("ix_matches_tournament_id_player_two_id", "tournament_id", "player_two_id"),
+        # Monthly partitions, created by matches_create_partitions() (migrations/0003).
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
 
-    player_one_id = Column(UUID(as_uuid=True), ForeignKey(User.id), default=None)
+    player_one_id = Column(UUID(as_uuid=True), ForeignKey(User.id), default=None, index=True)
     player_one = relationship(
         "User", foreign_keys=[player_one_id], back_populates="matches_as_player_one"
     )
-    player_two_id = Column(UUID(as_uuid=True), ForeignKey(User.id), default=None)
+    player_two_id = Column(UUID(as_uuid=True), ForeignKey(User.id), default=None, index=True)
     player_two = relationship(
         "User", foreign_keys=[player_two_id], back_populates="matches_as_player_two"
     )
@@ -72,10 +116,26 @@ class Match(Base):
     )
     score_one = Column(Integer, default=0)
     score_two = Column(Integer, default=0)
+    # In the primary key, as the partition key: updates and deletes only read one partition.
+    created_at = Column(
+        DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now()
+    )
+    # None for the matches played outside of a tournament.
+    tournament_id = Column(
+        UUID(as_uuid=True), ForeignKey("tournaments.id", ondelete="SET NULL"), nullable=True
+    )
+    # When the result was credited to the players (migrations/0005), at most once.
+    scored_at = Column(DateTime(timezone=True), nullable=True)
 
 
 class Tournament(Base):
     __tablename__ = "tournaments"
+    __table_args__ = (
+        # Keyset pagination by start date.
+        Index("ix_tournaments_begin_id", "begin", "id"),
+        # Upcoming ends still to be paid out, read by the lifecycle scheduler.
+        Index("ix_tournaments_unpaid_end", "end", postgresql_where=text("paid_out_at IS NULL")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     max_player = Column(Integer, default=20)
@@ -97,22 +157,10 @@ class Tournament(Base):
 
     rewards_sum = Column(Integer, default=0)
     rewards_range = Column(JSONB, default={})
-
-    def leaderboard(self):
-        leaderboard = []
-        for key, value in self.players_score.items():
-            leaderboard.append([key, value])
-
-        # Bubble Sort
-        length = len(leaderboard)
-        for i in range(0, length):
-            for j in range(0, length - i - 1):
-                if (leaderboard[j][1] > leaderboard[j + 1][1]):
-                    temp = leaderboard[j]
-                    leaderboard[j] = leaderboard[j + 1]
-                    leaderboard[j + 1] = temp
-        leaderboard.reverse()  # Descending order
-        return leaderboard
+    # Set in the payout transaction: a tournament is never paid out twice.
+    paid_out_at = Column(DateTime(timezone=True), nullable=True, default=None)
+    # Bumped by a trigger on every update of the row (migrations/0002), read for the ETags.
+    version = Column(BigInteger, nullable=False, server_default="1")
 
     @validates('rewards_range')
     def validate_rewards_range(self, _key, value):
@@ -120,3 +168,27 @@ class Tournament(Base):
             assert re.match("(^[0-9]{1,2}-[0-9]{1,2}$)", key), \
                 f"The key {key} doesn't have the correct format (should be X-Y)"
         return value
+
+
+class TournamentReward(Base):
+    """rewards_range compiled to one row per rewarded position."""
+    __tablename__ = "tournament_rewards"
+
+    tournament_id = Column(
+        UUID(as_uuid=True), ForeignKey(Tournament.id, ondelete="CASCADE"), primary_key=True
+    )
+    position = Column(Integer, primary_key=True)
+    reward = Column(Integer, nullable=False)
+
+
+class UserStats(Base):
+    """Running match record of a player, maintained by the triggers on matches (migrations/0003)."""
+    __tablename__ = "user_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(User.id), primary_key=True)
+    played = Column(Integer, nullable=False, server_default="0")
+    wins = Column(Integer, nullable=False, server_default="0")
+    draws = Column(Integer, nullable=False, server_default="0")
+    losses = Column(Integer, nullable=False, server_default="0")
+    points_scored = Column(Integer, nullable=False, server_default="0")
+    points_conceded = Column(Integer, nullable=False, server_default="0")
@@ -0,0 +1,93 @@
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_, tuple_
+import base64
+import datetime as D
+import json
+
+# Bound of the `limit` of the keyset paginated lists.
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(values: list) -> str:
+    payload = json.dumps(values, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        assert isinstance(values, list) and len(values) == length
+    except (ValueError, AssertionError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor."
+        )
+    return values
+
+
+def _nullable(column) -> bool:
+    return getattr(column.expression, "nullable", True)
+
+
+def _parse_cursor_value(column, value):
+    if value is None and _nullable(column):
+        return None
+    python_type = column.type.python_type
+    try:
+        if python_type is D.datetime:
+            return D.datetime.fromisoformat(value)
+        return python_type(value)
+    except (TypeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor."
+        )
+
+
+def keyset_page(query, columns: tuple, sort: str, cursor: str = None, limit: int = 100,
+                descending: bool = False):
+    """
+    Order `query` by `columns` (unique together, backed by an index) and return
+    the `limit` rows following `cursor`. Works on ORM queries and selects alike.
+    """
+    if cursor is not None:
+        (cursor_sort, *values) = decode_cursor(cursor, len(columns) + 1)
+        if cursor_sort != sort:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cursor was issued for another sort order."
+            )
+        values = [_parse_cursor_value(c, v) for c, v in zip(columns, values)]
+        query = query.filter(_after(columns, values, descending))
+    return (
+        query
+        .order_by(*(column.desc() if descending else column for column in columns))
+        .limit(limit)
+    )
+
+
+def _past(columns, values, descending: bool):
+    (key, bound) = (tuple_(*columns), tuple_(*values))
+    return key < bound if descending else key > bound
+
+
+def _after(columns: tuple, values: list, descending: bool):
+    """
+    Rows past `values` in the order of `columns`, where only the leading column
+    may be NULL: Postgres sorts NULLs last ascending, first descending.
+    """
+    (first, *rest) = columns
+    if not _nullable(first):
+        return _past(columns, values, descending)
+    if values[0] is None:
+        among_nulls = and_(first.is_(None), _past(rest, values[1:], descending))
+        return or_(among_nulls, first.isnot(None)) if descending else among_nulls
+    past = _past(columns, values, descending)
+    return past if descending else or_(past, first.is_(None))
+
+
+def next_cursor(rows: list, columns: tuple, sort: str, limit: int):
+    if not rows or len(rows) < limit:
+        return None
+    return encode_cursor([sort, *(getattr(rows[-1], column.key) for column in columns)])
@@ -0,0 +1,70 @@
+"""
+Sampling profiler that can be switched on in production.
+
+A daemon thread reads the stack of the event loop thread every `interval`
+seconds. Sampling costs the loop nothing but the GIL for a few microseconds,
+so it can stay on for minutes under real traffic. Samples are served in the
+collapsed format read by flame graph tools: one `frame;frame;frame count`
+line per distinct stack, outermost frame first.
+"""
+from collections import Counter
+import os
+import sys
+import threading
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01, max_stacks: int = 10000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = Counter()
+        self.dropped = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Sample the calling thread, the one running the event loop."""
+        if self.running:
+            return
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        self.samples = Counter()
+        self.dropped = 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self._record(frame)
+
+    def _record(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        # Bounded: new stacks past max_stacks are only counted as dropped.
+        if key in self.samples or len(self.samples) < self.max_stacks:
+            self.samples[key] += 1
+        else:
+            self.dropped += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
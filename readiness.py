@@ -0,0 +1,126 @@
+"""
+Worker warm-up and readiness.
+
+Workers boot without touching the database. Once started, they warm up in
+the background: open the pool's connections and run the hot read paths once
+on each of them, so SQLAlchemy caches their compiled SQL and asyncpg prepares
+the statements on every connection. While Postgres is unreachable the
+warm-up is retried with a backoff and the worker reports itself not ready,
+instead of failing to start.
+"""
+from sqlalchemy import text
+from uuid import UUID
+import asyncio
+import logging
+import time
+
+from statements import VERSIONED_TOURNAMENT_COLUMNS
+import async_crud as crud
+
+logger = logging.getLogger(__name__)
+
+NIL_ID = UUID(int=0)
+PING = text("SELECT 1")
+
+
+async def _warm_up_connection(db):
+    """Run the hot read paths once, matching nothing."""
+    await crud.get_user(db, NIL_ID)
+    await crud.get_tournament(db, NIL_ID)
+    await crud.get_tournament_row(db, NIL_ID, VERSIONED_TOURNAMENT_COLUMNS)
+    await crud.get_users_page(db)
+    await crud.get_leaderboard_entries(db, NIL_ID, 100)
+    await crud.get_leaderboard_around(db, NIL_ID, NIL_ID)
+    await crud.get_user_stats(db, NIL_ID)
+
+
+class Readiness:
+    def __init__(
+        self,
+        session_factory,
+        connections: int,
+        check_timeout: float = 2,
+        max_backoff: float = 10
+    ):
+        self.session_factory = session_factory
+        self.connections = connections
+        self.check_timeout = check_timeout
+        self.max_backoff = max_backoff
+        self.warmed_up = False
+        self.attempts = 0
+        self.warm_up_seconds = None
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._warm_up())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _warm_up_once(self):
+        async def warm_up_session():
+            async with self.session_factory() as db:
+                try:
+                    await _warm_up_connection(db)
+                finally:
+                    # Held until every session has run: each one gets its own connection.
+                    await barrier.wait()
+
+        barrier = _Barrier(self.connections)
+        await asyncio.gather(*(warm_up_session() for _ in range(self.connections)))
+
+    async def _warm_up(self):
+        started, backoff = time.perf_counter(), 0.5
+        while True:
+            self.attempts += 1
+            try:
+                await self._warm_up_once()
+                break
+            except Exception as e:
+                logger.warning("Warm-up failed (attempt %d), retrying in %.1fs: %s",
+                               self.attempts, backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self.warm_up_seconds = time.perf_counter() - started
+        self.warmed_up = True
+        logger.info("Warmed up %d connections in %.3fs", self.connections, self.warm_up_seconds)
+
+    async def check(self):
+        """(ready, detail): warmed up and the database answers within check_timeout."""
+        if not self.warmed_up:
+            return False, "warming up"
+        try:
+            async with self.session_factory() as db:
+                await asyncio.wait_for(db.execute(PING), self.check_timeout)
+        except Exception as e:
+            return False, f"database unavailable: {e.__class__.__name__}"
+        return True, "ready"
+
+    def export(self, writer):
+        writer.add("app_ready", "gauge", "1 once the worker is warmed up.", int(self.warmed_up))
+        writer.add("app_warm_up_attempts", "gauge", "Warm-up attempts of this worker.",
+                   self.attempts)
+        if self.warm_up_seconds is not None:
+            writer.add("app_warm_up_seconds", "gauge", "Time from startup to warmed up.",
+                       self.warm_up_seconds)
+
+
+class _Barrier:
+    """asyncio.Barrier, which only exists from Python 3.11."""
+
+    def __init__(self, parties: int):
+        self.parties = parties
+        self.arrived = 0
+        self._event = asyncio.Event()
+
+    async def wait(self):
+        self.arrived += 1
+        if self.arrived >= self.parties:
+            self._event.set()
+        await self._event.wait()
@@ -0,0 +1,206 @@
+"""
+Routing of the reads to streaming replicas of the database.
+
+The GET routes which only read take their session from `ReplicaRouter.session`:
+one of the replicas, in turn, whose replay lags at most `max_lag` seconds
+behind the primary, else the primary. Writes, and the routes reading back
+what they just wrote, keep the primary's session.
+
+Every `check_interval`, the WAL position of the primary is sampled, then the
+position replayed by each replica. A replica is up to date as of the latest
+sample it has replayed, so its lag is exact even when it stopped receiving
+WAL. A replica which does not answer, or is not in recovery any more (it was
+promoted), is left out until its next successful check.
+
+Reading your writes across requests: successful writes are answered with an
+X-Read-After header, the time they were committed by. A client sending it
+back is only served by a replica up to date as of that time.
+"""
+from collections import Counter, deque
+from itertools import count
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+READ_AFTER_HEADER = "x-read-after"
+PRIMARY_POSITION = text("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')")
+# NULL on a server which is not in recovery.
+REPLAY_POSITION = text("SELECT pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0')")
+# Samples of the primary's position kept to date the replicas' lag.
+SAMPLES = 300
+
+
+class Replica:
+    def __init__(self, engine, pool_metrics=None):
+        self.engine = engine
+        self.pool_metrics = pool_metrics
+        self.name = f"{engine.url.host}:{engine.url.port or 5432}"
+        # Sessions of a replica are flagged for cache.EntityCache.set.
+        self.session_factory = sessionmaker(
+            engine, class_=AsyncSession, autoflush=False, expire_on_commit=False,
+            info={"replica": True}
+        )
+        self.available = False
+        # Time by which every commit on the primary has been replayed.
+        self.fresh_as_of = None
+        self.lag = None
+        self.check_failures = 0
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        primary_engine,
+        primary_factory,
+        replicas: list,
+        max_lag: float = 1,
+        check_interval: float = 1,
+        check_timeout: float = 2,
+        clock=time.time
+    ):
+        self.primary_engine = primary_engine
+        self.primary_factory = primary_factory
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.clock = clock
+        self.reads = Counter()
+        self._samples = deque(maxlen=SAMPLES)
+        self._turn = count()
+        self._task = None
+
+    async def start(self):
+        if self.replicas:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.warning("Replica lag check failed: %s", e)
+            await asyncio.sleep(self.check_interval)
+
+    async def check(self):
+        """Sample the primary's WAL position, then measure the lag of every replica."""
+        sampled_at = self.clock()
+        try:
+            async with self.primary_engine.connect() as connection:
+                position = await asyncio.wait_for(
+                    connection.scalar(PRIMARY_POSITION), self.check_timeout
+                )
+        except Exception:
+            # Without a sample no lag can be measured: every read goes to the primary.
+            for replica in self.replicas:
+                replica.available = False
+            raise
+        self._samples.append((sampled_at, position))
+        await asyncio.gather(*(self._check(replica, sampled_at) for replica in self.replicas))
+
+    async def _check(self, replica: Replica, sampled_at: float):
+        try:
+            async with replica.engine.connect() as connection:
+                replayed = await asyncio.wait_for(
+                    connection.scalar(REPLAY_POSITION), self.check_timeout
+                )
+        except Exception as e:
+            if replica.available or not replica.check_failures:
+                logger.warning("Replica %s unreachable: %s", replica.name, e)
+            replica.check_failures += 1
+            replica.available = False
+            return
+        if replayed is None:
+            if replica.available or not replica.check_failures:
+                logger.warning("Replica %s is not in recovery, reads skip it.", replica.name)
+            replica.check_failures += 1
+            replica.available = False
+            return
+        replica.fresh_as_of = next(
+            (taken_at for taken_at, position in reversed(self._samples) if position <= replayed),
+            None
+        )
+        # Behind every sample kept: at least as old as the oldest one.
+        oldest = self._samples[0][0]
+        replica.lag = sampled_at - (replica.fresh_as_of or oldest)
+        replica.available = replica.fresh_as_of is not None and replica.lag <= self.max_lag
+
+    def choose(self, read_after: float = None):
+        """A replica up to date enough (and as of `read_after`), or None for the primary."""
+        candidates = [
+            replica for replica in self.replicas
+            if replica.available
+            and (read_after is None or replica.fresh_as_of >= read_after)
+        ]
+        if not candidates:
+            return None
+        return candidates[next(self._turn) % len(candidates)]
+
+    def session(self, read_after: float = None) -> AsyncSession:
+        replica = self.choose(read_after)
+        self.reads["primary" if replica is None else replica.name] += 1
+        return (self.primary_factory if replica is None else replica.session_factory)()
+
+    def engine(self, read_after: float = None):
+        replica = self.choose(read_after)
+        self.reads["primary" if replica is None else replica.name] += 1
+        return self.primary_engine if replica is None else replica.engine
+
+    def export(self, writer):
+        for replica in self.replicas:
+            labels = {"replica": replica.name}
+            writer.add("replica_available", "gauge", "1 while the replica serves reads.",
+                       int(replica.available), **labels)
+            if replica.lag is not None:
+                writer.add("replica_lag_seconds", "gauge", "Replay lag at the last check.",
+                           replica.lag, **labels)
+            writer.add("replica_check_failures_total", "counter",
+                       "Lag checks the replica failed.", replica.check_failures, **labels)
+        for target, reads in self.reads.items():
+            writer.add("replica_routed_reads_total", "counter",
+                       "Read sessions and exports by database served.", reads, target=target)
+
+
+def read_after(headers) -> float:
+    """The X-Read-After of a request, None when absent or invalid."""
+    try:
+        return float(headers[READ_AFTER_HEADER])
+    except (KeyError, ValueError):
+        return None
+
+
+class ReadAfterMiddleware:
+    """Stamps the successful writes with X-Read-After, the time they were answered."""
+
+    def __init__(self, app, clock=time.time):
+        self.app = app
+        self.clock = clock
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            return await self.app(scope, receive, send)
+
+        async def send_stamped(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                stamp = f"{self.clock():.6f}".encode()
+                message = {
+                    **message,
+                    "headers": [*message["headers"], (READ_AFTER_HEADER.encode(), stamp)]
+                }
+            await send(message)
+
+        await self.app(scope, receive, send_stamped)
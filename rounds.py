@@ -0,0 +1,100 @@
+"""
+Pairing and batch simulation of a whole tournament round.
+Pure functions: persistence is done by async_crud.play_round.
+"""
+import random
+import uuid
+
+import schemas
+
+MATCH_POINTS = {
+    schemas.MatchResult.player1: (3, 0),
+    schemas.MatchResult.draw: (1, 1),
+    schemas.MatchResult.player2: (0, 3),
+}
+# A bye scores as a win, so the player who sat out is not left at the bottom
+# of the standings and handed the bye again next round.
+BYE_POINTS = 3
+
+
+def round_robin_pairings(players: list, round_number: int):
+    """
+    Circle method: over `len(players) - 1` rounds (one more when odd) every
+    player meets every other once. Return (pairs, byes) for `round_number` (1-based).
+    """
+    players = list(players)
+    if len(players) % 2:
+        players.append(None)
+    if len(players) < 2:
+        return [], [player for player in players if player is not None]
+
+    rounds = len(players) - 1
+    shift = (round_number - 1) % rounds
+    rotating = players[1:]
+    rotating = rotating[-shift:] + rotating[:-shift] if shift else rotating
+    circle = [players[0], *rotating]
+
+    pairs, byes = [], []
+    half = len(circle) // 2
+    for one, two in zip(circle[:half], reversed(circle[half:])):
+        if one is None or two is None:
+            byes.append(one if two is None else two)
+        else:
+            pairs.append((one, two))
+    return pairs, byes
+
+
+def swiss_pairings(standings: list, played: set):
+    """
+    Pair players of close standings (best first), avoiding rematches when possible.
+    `standings` is a list of player ids ordered by rank, `played` a set of
+    frozensets of already met pairs. The lowest ranked unpaired player gets the bye.
+    """
+    unpaired = list(standings)
+    pairs, byes = [], []
+    if len(unpaired) % 2:
+        byes.append(unpaired.pop())
+    while unpaired:
+        player = unpaired.pop(0)
+        opponent = next(
+            (other for other in unpaired if frozenset((player, other)) not in played),
+            unpaired[0]
+        )
+        unpaired.remove(opponent)
+        pairs.append((player, opponent))
+    return pairs, byes
+
+
+def play_matches(pairs: list, rng: random.Random = random):
+    """
+    Simulate every match of a round at once, drawing all turns in a single call.
+    Same placeholder game logic as main.one_player_turn.
+    """
+    turns = rng.choices(range(5, 101), k=2 * len(pairs))
+    matches = []
+    for i, (player_one_id, player_two_id) in enumerate(pairs):
+        score_one, score_two = turns[2 * i], turns[2 * i + 1]
+        result = schemas.MatchResult.draw
+        if score_one < score_two:
+            result = schemas.MatchResult.player2
+        elif score_one > score_two:
+            result = schemas.MatchResult.player1
+        matches.append(dict(
+            id=uuid.uuid4(),
+            player_one_id=player_one_id,
+            player_two_id=player_two_id,
+            score_one=score_one,
+            score_two=score_two,
+            result=result.value,
+        ))
+    return matches
+
+
+def score_deltas(matches: list, byes: list = ()):
+    """Return {user_id: points} earned by each player over the given matches and byes."""
+    deltas = {player: BYE_POINTS for player in byes}
+    for match in matches:
+        (points_one, points_two) = MATCH_POINTS[schemas.MatchResult(match["result"])]
+        deltas[match["player_one_id"]] = deltas.get(match["player_one_id"], 0) + points_one
+        deltas[match["player_two_id"]] = deltas.get(match["player_two_id"], 0) + points_two
+    return deltas
@@ -0,0 +1,147 @@
+"""
+Tournament lifecycle scheduler: ends tournaments (pays out their rewards) at their `end` time.
+
+Each worker keeps the upcoming deadlines in a heap and sleeps until the earliest
+one, so it is idle between deadlines. Only the tournaments ending within the next
+`horizon` are kept in memory: the window is reloaded every `resync_interval` from
+the partial index on unpaid tournaments, which also picks up tournaments created
+or moved by other workers. When several workers reach the same deadline, a
+transaction-level advisory lock lets a single one process it, and the
+paid_out_at marker of pay_out_rewards makes any late rerun a no-op.
+
+Each resync also creates the monthly partitions of matches due in the next
+months (a no-op once they exist), see migrations/0003.
+"""
+from sqlalchemy import select, func
+from uuid import UUID
+import asyncio
+import datetime as D
+import heapq
+import logging
+import time
+
+import async_crud as crud
+import models
+
+logger = logging.getLogger(__name__)
+
+
+def _pending_query(until: D.datetime):
+    return (
+        select(models.Tournament.id, models.Tournament.end)
+        .where(models.Tournament.paid_out_at.is_(None))
+        .where(models.Tournament.end <= until)
+    )
+
+
+def _try_lock_statement(tournament_id: UUID):
+    """Advisory lock held until the end of the transaction, false if taken by another worker."""
+    return select(func.pg_try_advisory_xact_lock(func.hashtext(str(tournament_id))))
+
+
+class LifecycleScheduler:
+    def __init__(self, session_factory, resync_interval: float = 300):
+        self.session_factory = session_factory
+        self.resync_interval = resync_interval
+        # Deadlines within the horizon are always loaded, even if a resync is late.
+        self.horizon = 2 * resync_interval
+        self._heap = []
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, tournament_id: UUID, end: D.datetime):
+        """(Re)schedule the end of a tournament. Outdated heap entries are skipped when popped."""
+        deadline = end.timestamp()
+        if deadline > time.time() + self.horizon:
+            # Loaded by a later resync, keeps the heap to the tournaments ending soon.
+            self._deadlines.pop(tournament_id, None)
+            return
+        if self._deadlines.get(tournament_id) == deadline:
+            return
+        self._deadlines[tournament_id] = deadline
+        heapq.heappush(self._heap, (deadline, tournament_id))
+        if self._heap[0] == (deadline, tournament_id):
+            self._wakeup.set()
+
+    def cancel(self, tournament_id: UUID):
+        self._deadlines.pop(tournament_id, None)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def resync(self):
+        until = D.datetime.fromtimestamp(time.time() + self.horizon, D.timezone.utc)
+        async with self.session_factory() as db:
+            for tournament_id, end in await db.execute(_pending_query(until)):
+                self.schedule(tournament_id, end)
+
+    async def create_partitions(self):
+        async with self.session_factory() as db:
+            await crud.create_match_partitions(db)
+
+    def _pop_due(self, now: float):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            (deadline, tournament_id) = heapq.heappop(self._heap)
+            if self._deadlines.get(tournament_id) == deadline:
+                del self._deadlines[tournament_id]
+                due.append(tournament_id)
+        return due
+
+    async def _run(self):
+        next_resync = 0
+        while True:
+            now = time.time()
+            if now >= next_resync:
+                try:
+                    await self.resync()
+                except Exception:
+                    logger.exception("Could not load the scheduled tournaments")
+                try:
+                    await self.create_partitions()
+                except Exception:
+                    logger.exception("Could not create the partitions of matches")
+                next_resync = now + self.resync_interval
+
+            for tournament_id in self._pop_due(now):
+                await self.end_tournament(tournament_id)
+
+            wake_at = min(self._heap[0][0], next_resync) if self._heap else next_resync
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(wake_at - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def end_tournament(self, tournament_id: UUID):
+        """Pay out a due tournament, unless another worker does or its end was moved."""
+        async with self.session_factory() as db:
+            try:
+                if not (await db.execute(_try_lock_statement(tournament_id))).scalar():
+                    return None
+                # Locked and read past the entity cache, whose `end` and paid_out_at may be
+                # stale after another worker's update.
+                db_tournament = await crud.get_tournament(db, tournament_id, for_update=True)
+                if db_tournament is None or db_tournament.paid_out_at is not None:
+                    return None
+                if db_tournament.end.timestamp() > time.time():
+                    self.schedule(tournament_id, db_tournament.end)
+                    return None
+                return await crud.pay_out_rewards(db, db_tournament)
+            except Exception:
+                # Still unpaid, so retried by the next resync.
+                logger.exception("Could not end tournament %s", tournament_id)
+                return None
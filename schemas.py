@@ -21,6 +21,7 @@ class Match(MatchCreate):
     result: MatchResult
     score_one: int = 0
     score_two: int = 0
+    tournament_id: Optional[UUID] = None
 
     class Config:
         orm_mode = True
@@ -32,6 +33,17 @@ class MatchUpdate(MatchCreate):
     score_two: Optional[int] = None
 
 
+class UserSearchMode(str, Enum):
+    contains = "contains"
+    prefix = "prefix"
+    ranked = "ranked"
+
+
+class UserSort(str, Enum):
+    id = "id"
+    points = "points"
+
+
 class UserCreate(BaseModel):
     username: str = None
     phone_number: str = None
@@ -51,6 +63,60 @@ class User(UserCreate):
         orm_mode = True
 
 
+class DataFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+class ImportRowError(BaseModel):
+    row: int
+    username: Optional[str] = None
+    detail: str
+
+
+class ImportReport(BaseModel):
+    """`row` is a line number of the imported file. Past the first errors, rows are only counted."""
+    imported: int = 0
+    rejected: int = 0
+    errors: list[ImportRowError] = []
+    errors_truncated: bool = False
+
+
+class UserStats(BaseModel):
+    user_id: UUID
+    played: int = 0
+    wins: int = 0
+    draws: int = 0
+    losses: int = 0
+    points_scored: int = 0
+    points_conceded: int = 0
+
+
+class HeadToHead(UserStats):
+    """Record of `user_id` in its matches against `opponent_id`."""
+    opponent_id: UUID
+
+
+class UserExpansion(str, Enum):
+    matches = "matches"
+
+
+class UserSummary(UserCreate):
+    """
+    Lightweight user returned by list endpoints. Match history is only
+    present when explicitly expanded, capped to the most recent matches.
+    """
+    id: UUID
+    points: int = 0
+    matches_as_player_one: Optional[list[Match]] = None
+    matches_as_player_two: Optional[list[Match]] = None
+
+
+class TournamentSort(str, Enum):
+    id = "id"
+    begin = "begin"
+
+
 class TournamentCreateUpdate(BaseModel):
     max_player: Optional[int] = None
     begin: Optional[datetime] = None
@@ -62,6 +128,39 @@ class TournamentCreateUpdate(BaseModel):
 class Tournament(TournamentCreateUpdate):
     id: UUID
     rewards_sum: int
+    paid_out_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
+
+
+class Payout(BaseModel):
+    tournament_id: UUID
+    paid_out_at: datetime
+    players_paid: int
+    already_paid: bool = False
+
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: UUID
+    username: str
+    score: int
+
+
+class LeaderboardPage(BaseModel):
+    entries: list[LeaderboardEntry]
+    next_cursor: Optional[str] = None
+
+
+class PairingSystem(str, Enum):
+    swiss = "swiss"
+    round_robin = "round_robin"
+
+
+class Round(BaseModel):
+    tournament_id: UUID
+    pairing: PairingSystem
+    round: int
+    matches: list[Match]
+    byes: list[UUID]
@@ -0,0 +1,667 @@
+"""
+SQL statements and row helpers of the CRUD functions, shared by async_crud.py
+(the API) and the scripts (crud.py, benchmarks): every path issues the same SQL.
+"""
+from fastapi import HTTPException, status
+from sqlalchemy import (
+    func, and_, or_, update, select, union_all, case, literal, values, column, cast,
+    String, Integer, delete
+)
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.dialects.postgresql import insert
+from uuid import UUID
+from pagination import encode_cursor, decode_cursor
+import datetime as D
+import models
+import rounds
+import schemas
+
+USER_SORTS = {
+    schemas.UserSort.id: ((models.User.id,), False),
+    schemas.UserSort.points: ((models.User.points, models.User.id), True),
+}
+MAX_EXPANDED_MATCHES = 100
+# Rows per multi-values INSERT, well below the 32767 bind parameters limit.
+INSERT_BATCH_SIZE = 1000
+TOURNAMENT_SORTS = {
+    schemas.TournamentSort.id: ((models.Tournament.id,), False),
+    schemas.TournamentSort.begin: ((models.Tournament.begin, models.Tournament.id), False),
+}
+MATCH_SORT_COLUMNS = (models.Match.created_at, models.Match.id)
+# Slack around the period of a tournament when reading its matches, for the clock skew
+# between the API and the database.
+MATCH_PERIOD_MARGIN = D.timedelta(hours=1)
+
+
+def _schema_columns(model, schema):
+    """Columns of `model` in the field order of `schema`, so rows serialize like the schema."""
+    return tuple(getattr(model, name) for name in schema.__fields__ if name in model.__table__.c)
+
+
+# Selected by the list endpoints that encode rows directly instead of going through the ORM.
+USER_SUMMARY_COLUMNS = _schema_columns(models.User, schemas.UserSummary)
+TOURNAMENT_COLUMNS = _schema_columns(models.Tournament, schemas.Tournament)
+# With the version the ETag is computed from, last so the encoded body leaves it out.
+VERSIONED_TOURNAMENT_COLUMNS = (*TOURNAMENT_COLUMNS, models.Tournament.version)
+# Read to answer conditional requests, with the keyset columns of TOURNAMENT_SORTS.
+TOURNAMENT_VERSION_COLUMNS = (
+    models.Tournament.id, models.Tournament.begin, models.Tournament.version
+)
+MATCH_COLUMNS = _schema_columns(models.Match, schemas.Match)
+# With the keyset of the listing, created_at last so the encoded body leaves it out.
+PAGED_MATCH_COLUMNS = (*MATCH_COLUMNS, models.Match.created_at)
+
+
+def new_user(user: schemas.UserCreate):
+    try:
+        return models.User(username=user.username, phone_number=user.phone_number)
+    except AssertionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+def users_search_query(
+    query,
+    filter: str = "",
+    mode: schemas.UserSearchMode = schemas.UserSearchMode.contains
+):
+    """
+    Filter on lower(username): `contains` and `ranked` use the trigram index,
+    `prefix` the text_pattern_ops one. `ranked` returns prefix matches first,
+    then by position of the match and shorter usernames.
+    """
+    username = func.lower(models.User.username)
+    filter = filter.lower()
+    if mode == schemas.UserSearchMode.prefix:
+        return query.filter(username.startswith(filter, autoescape=True))
+
+    query = query.filter(username.contains(filter, autoescape=True))
+    if mode == schemas.UserSearchMode.ranked and filter:
+        query = query.order_by(
+            case((username.startswith(filter, autoescape=True), 0), else_=1),
+            func.strpos(username, filter),
+            func.length(models.User.username),
+            models.User.username
+        )
+    return query
+
+
+def users_matches_query(user_ids: list, limit: int):
+    """
+    Batched load of the `limit` most recent matches of each user in `user_ids`,
+    as (Match, user_id, side) rows where side is 1 or 2 for player one or two.
+    """
+    sides = union_all(
+        select(
+            models.Match.id.label("match_id"),
+            models.Match.created_at,
+            models.Match.player_one_id.label("user_id"),
+            literal(1).label("side")
+        ).where(models.Match.player_one_id.in_(user_ids)),
+        select(
+            models.Match.id,
+            models.Match.created_at,
+            models.Match.player_two_id,
+            literal(2)
+        ).where(models.Match.player_two_id.in_(user_ids))
+    ).subquery()
+    ranked = select(
+        sides,
+        func.row_number().over(
+            partition_by=sides.c.user_id,
+            order_by=(sides.c.created_at.desc(), sides.c.match_id.desc())
+        ).label("position")
+    ).subquery()
+    return (
+        select(models.Match, ranked.c.user_id, ranked.c.side)
+        .join(ranked, and_(
+            ranked.c.match_id == models.Match.id,
+            ranked.c.created_at == models.Match.created_at
+        ))
+        .where(ranked.c.position <= min(limit, MAX_EXPANDED_MATCHES))
+        .order_by(ranked.c.user_id, ranked.c.position)
+    )
+
+
+def users_matches(rows, user_ids: list):
+    matches = {user_id: ([], []) for user_id in user_ids}
+    for match, user_id, side in rows:
+        matches[user_id][side - 1].append(match)
+    return matches
+
+
+STATS_COLUMNS = ("played", "wins", "draws", "losses", "points_scored", "points_conceded")
+
+
+def user_stats_query(user_id: UUID):
+    """One primary key lookup in the trigger maintained user_stats, whatever the match count."""
+    return (
+        select(
+            models.User.id.label("user_id"),
+            *(func.coalesce(getattr(models.UserStats, key), 0).label(key) for key in STATS_COLUMNS)
+        )
+        .outerjoin(models.UserStats, models.UserStats.user_id == models.User.id)
+        .where(models.User.id == user_id)
+    )
+
+
+def users_count_query(user_ids: set):
+    return select(func.count()).where(models.User.id.in_(user_ids))
+
+
+def head_to_head_query(user_id: UUID, opponent_id: UUID):
+    """Record of `user_id` against `opponent_id`, over the (player_one_id, player_two_id) index."""
+    match = models.Match
+    as_one = match.player_one_id == user_id
+    won = or_(and_(as_one, match.result == "PLAYER1"), and_(~as_one, match.result == "PLAYER2"))
+    lost = or_(and_(as_one, match.result == "PLAYER2"), and_(~as_one, match.result == "PLAYER1"))
+    return (
+        select(
+            func.count().label("played"),
+            func.count().filter(won).label("wins"),
+            func.count().filter(match.result == "DRAW").label("draws"),
+            func.count().filter(lost).label("losses"),
+            func.coalesce(func.sum(case((as_one, match.score_one), else_=match.score_two)), 0)
+            .label("points_scored"),
+            func.coalesce(func.sum(case((as_one, match.score_two), else_=match.score_one)), 0)
+            .label("points_conceded"),
+        )
+        .where(or_(
+            and_(match.player_one_id == user_id, match.player_two_id == opponent_id),
+            and_(match.player_one_id == opponent_id, match.player_two_id == user_id),
+        ))
+    )
+
+
+def registered_tournaments_touch_statement(user_id: UUID):
+    """Bump the version of the tournaments whose leaderboards show the user's name."""
+    registered = (
+        select(models.tournament_user.c.tournament_id)
+        .where(models.tournament_user.c.user_id == user_id)
+    )
+    return (
+        update(models.Tournament)
+        .where(models.Tournament.id.in_(registered))
+        .values(version=models.Tournament.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def tournament_matches_filter(tournament_id: UUID, begin, end):
+    """
+    Matches of a tournament, played between its begin and end: bounding created_at
+    to that period lets Postgres skip the partitions outside of it. `begin` and
+    `end` are values or SQL expressions.
+    """
+    return (
+        models.Match.tournament_id == tournament_id,
+        models.Match.created_at >= begin - MATCH_PERIOD_MARGIN,
+        models.Match.created_at <= end + MATCH_PERIOD_MARGIN,
+    )
+
+
+def tournament_matches_query(query, db_tournament: schemas.Tournament, player_id: UUID = None):
+    query = query.filter(*tournament_matches_filter(
+        db_tournament.id, db_tournament.begin, db_tournament.end
+    ))
+    if player_id is not None:
+        query = query.filter(or_(
+            models.Match.player_one_id == player_id, models.Match.player_two_id == player_id
+        ))
+    return query
+
+
+def match_partitions_statement():
+    return select(func.matches_create_partitions(func.now()))
+
+
+def rewards_table(rewards_range: dict):
+    """Compile {"X-Y": reward} ranges (bounds included) to {position: reward}."""
+    rewards = {}
+    for key, value in rewards_range.items():
+        (inf, sup) = (int(bound) for bound in key.split('-'))
+        if not 1 <= inf <= sup:
+            raise ValueError(f"The range {key} is empty or does not start at 1 or more")
+        for position in range(inf, sup + 1):
+            if position in rewards:
+                raise ValueError(f"The position {position} is rewarded by several ranges")
+            rewards[position] = value
+    return rewards
+
+
+def _invalid_rewards_range(e: ValueError):
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=str(e) + ". Check the range has the correct format."
+    )
+
+
+def new_tournament(tournament: schemas.TournamentCreateUpdate):
+    try:
+        return models.Tournament(
+            max_player=tournament.max_player,
+            begin=tournament.begin,
+            end=tournament.end,
+            rewards_sum=sum(rewards_table(tournament.rewards_range).values()),
+            rewards_range=tournament.rewards_range
+        )
+    except AssertionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise _invalid_rewards_range(e)
+
+
+def rewards_statements(tournament_id: UUID, rewards_range: dict):
+    """Replace the compiled rewards table of a tournament."""
+    yield delete(models.TournamentReward).where(
+        models.TournamentReward.tournament_id == tournament_id
+    )
+    rewards = rewards_table(rewards_range)
+    if rewards:
+        yield insert(models.TournamentReward).values([
+            dict(tournament_id=tournament_id, position=position, reward=reward)
+            for position, reward in rewards.items()
+        ])
+
+
+def tournament_update(db_tournament: schemas.Tournament, tournament_data: dict):
+    """Apply `tournament_data` and return the statements refreshing its rewards table."""
+    for key, value in tournament_data.items():
+        setattr(db_tournament, key, value)
+    if "rewards_range" not in tournament_data:
+        return []
+    try:
+        db_tournament.rewards_sum = sum(rewards_table(db_tournament.rewards_range).values())
+    except ValueError as e:
+        raise _invalid_rewards_range(e)
+    return list(rewards_statements(db_tournament.id, db_tournament.rewards_range))
+
+
+def tournament_row_query(tournament_id: UUID, columns: tuple):
+    return select(*columns).where(models.Tournament.id == tournament_id)
+
+
+def registered_count_query(tournament_id: UUID):
+    return (
+        select(func.count())
+        .select_from(models.tournament_user)
+        .where(models.tournament_user.c.tournament_id == tournament_id)
+    )
+
+
+def check_capacity(db_tournament: schemas.Tournament, users_registered: int):
+    if users_registered >= db_tournament.max_player:
+        raise HTTPException(
+            status_code=406,
+            detail="Too many players registered in this tournament."
+        )
+
+
+def registration_statement(tournament_id: UUID, user_id: UUID):
+    return (
+        insert(models.tournament_user)
+        .values(tournament_id=tournament_id, user_id=user_id)
+        .on_conflict_do_nothing(constraint="uq_tournament_user")
+    )
+
+
+def players_score_append_statement(tournament_id: UUID, user_id: UUID):
+    return (
+        update(models.Tournament)
+        .where(models.Tournament.id == tournament_id)
+        .values(
+            players_score=models.Tournament.players_score.op("||")(
+                func.jsonb_build_object(str(user_id), 0)
+            )
+        )
+    )
+
+
+def _ranking_query(tournament_id: UUID):
+    return (
+        select(models.tournament_user.c.user_id, models.tournament_user.c.score)
+        .where(models.tournament_user.c.tournament_id == tournament_id)
+    )
+
+
+def _ranked_before(user_id: UUID, score: int):
+    # Rows ranked ahead of (score, user_id) in the (score DESC, user_id) order.
+    return or_(
+        models.tournament_user.c.score > score,
+        and_(
+            models.tournament_user.c.score == score,
+            models.tournament_user.c.user_id < user_id
+        )
+    )
+
+
+def _ranked_after(user_id: UUID, score: int):
+    return or_(
+        models.tournament_user.c.score < score,
+        and_(
+            models.tournament_user.c.score == score,
+            models.tournament_user.c.user_id > user_id
+        )
+    )
+
+
+def leaderboard_query(tournament_id: UUID, skip: int = 0, limit: int = None):
+    query = (
+        _ranking_query(tournament_id)
+        .order_by(models.tournament_user.c.score.desc(), models.tournament_user.c.user_id)
+        .offset(skip)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def _leaderboard_entries_query(rows=models.tournament_user):
+    return (
+        select(rows.c.user_id, models.User.username, rows.c.score)
+        .join(models.User, models.User.id == rows.c.user_id)
+        .order_by(rows.c.score.desc(), rows.c.user_id)
+    )
+
+
+def _decode_leaderboard_cursor(cursor: str):
+    """(rank, score, user_id) of the last row of a page, 400 on a tampered cursor."""
+    (last_rank, last_score, last_user_id) = decode_cursor(cursor, 3)
+    try:
+        assert type(last_rank) is int and type(last_score) is int
+        return last_rank, last_score, UUID(last_user_id)
+    except (AssertionError, AttributeError, TypeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor."
+        )
+
+
+def leaderboard_page_query(
+    tournament_id: UUID,
+    limit: int = None,
+    skip: int = 0,
+    cursor: str = None
+):
+    """Return (query, first_rank) for a page of the standings."""
+    query = (
+        _leaderboard_entries_query()
+        .where(models.tournament_user.c.tournament_id == tournament_id)
+    )
+    first_rank = skip + 1
+    if cursor is not None:
+        (last_rank, last_score, last_user_id) = _decode_leaderboard_cursor(cursor)
+        query = query.where(_ranked_after(last_user_id, last_score))
+        first_rank = last_rank + 1
+    query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return query, first_rank
+
+
+def leaderboard_page(rows, first_rank: int, limit: int = None):
+    entries = [
+        schemas.LeaderboardEntry(
+            rank=first_rank + i, user_id=user_id, username=username, score=score
+        )
+        for i, (user_id, username, score) in enumerate(rows)
+    ]
+    next_cursor = None
+    if entries and limit is not None and len(entries) == limit:
+        last = entries[-1]
+        next_cursor = encode_cursor([last.rank, last.score, last.user_id])
+    return entries, next_cursor
+
+
+def leaderboard_around_query(tournament_id: UUID, user_id: UUID, neighbours: int):
+    tournament_rows = models.tournament_user
+    player_score = (
+        select(tournament_rows.c.score)
+        .where(tournament_rows.c.tournament_id == tournament_id)
+        .where(tournament_rows.c.user_id == user_id)
+        .scalar_subquery()
+    )
+    player_rank = (
+        select(func.count() + 1)
+        .where(tournament_rows.c.tournament_id == tournament_id)
+        .where(_ranked_before(user_id, player_score))
+        .scalar_subquery()
+    )
+    above = (
+        select(tournament_rows.c.user_id, tournament_rows.c.score)
+        .where(tournament_rows.c.tournament_id == tournament_id)
+        .where(_ranked_before(user_id, player_score))
+        .order_by(tournament_rows.c.score, tournament_rows.c.user_id.desc())
+        .limit(neighbours)
+        .subquery()
+    )
+    player = (
+        select(tournament_rows.c.user_id, tournament_rows.c.score)
+        .where(tournament_rows.c.tournament_id == tournament_id)
+        .where(tournament_rows.c.user_id == user_id)
+    )
+    below = (
+        select(tournament_rows.c.user_id, tournament_rows.c.score)
+        .where(tournament_rows.c.tournament_id == tournament_id)
+        .where(_ranked_after(user_id, player_score))
+        .order_by(tournament_rows.c.score.desc(), tournament_rows.c.user_id)
+        .limit(neighbours)
+        .subquery()
+    )
+    window = union_all(select(above), player, select(below)).subquery()
+    return _leaderboard_entries_query(window).add_columns(player_rank)
+
+
+def leaderboard_around(rows, user_id: UUID):
+    position = next((i for i, row in enumerate(rows) if row.user_id == user_id), None)
+    if position is None:
+        return []
+    first_rank = rows[position][3] - position
+    return [
+        schemas.LeaderboardEntry(
+            rank=first_rank + i, user_id=row_user_id, username=username, score=score
+        )
+        for i, (row_user_id, username, score, _rank) in enumerate(rows)
+    ]
+
+
+def players_score_increment_statement(tournament_id: UUID, deltas: dict):
+    """
+    Add {user_id: points} to the matching players_score keys in place. The
+    UPDATE reads the current document under its row lock, so concurrent
+    increments queue instead of overwriting each other.
+    """
+    players_score = models.Tournament.players_score
+    increments = []
+    for user_id, points in deltas.items():
+        key = str(user_id)
+        increments += [key, func.coalesce(players_score[key].astext.cast(Integer), 0) + points]
+    return (
+        update(models.Tournament)
+        .where(models.Tournament.id == tournament_id)
+        .values(players_score=players_score.op("||")(func.jsonb_build_object(*increments)))
+    )
+
+
+def match_deltas(db_match: schemas.Match):
+    return rounds.score_deltas([dict(
+        player_one_id=db_match.player_one_id,
+        player_two_id=db_match.player_two_id,
+        result=db_match.result,
+    )])
+
+
+def match_scored_statement(db_match: schemas.Match):
+    """Mark the match scored, returning nothing when it already was."""
+    return (
+        update(models.Match)
+        .where(models.Match.id == db_match.id)
+        .where(models.Match.created_at == db_match.created_at)
+        .where(models.Match.scored_at.is_(None))
+        .values(scored_at=func.now())
+        .returning(models.Match.scored_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def already_scored():
+    return HTTPException(status_code=409, detail="Match result already recorded.")
+
+
+def played_pairs_query(db_tournament: schemas.Tournament):
+    return (
+        select(models.Match.player_one_id, models.Match.player_two_id)
+        .where(*tournament_matches_filter(
+            db_tournament.id, db_tournament.begin, db_tournament.end
+        ))
+    )
+
+
+def round_pairings(standings: list, played_rows, pairing: schemas.PairingSystem, round: int):
+    player_ids = [UUID(user_id) for user_id, _score in standings]
+    if pairing == schemas.PairingSystem.round_robin:
+        return rounds.round_robin_pairings(sorted(player_ids), round)
+    played = {frozenset(row) for row in played_rows}
+    return rounds.swiss_pairings(player_ids, played)
+
+
+def insert_matches_statements(matches: list):
+    """Matches of a round are scored in the transaction inserting them."""
+    for start in range(0, len(matches), INSERT_BATCH_SIZE):
+        yield insert(models.Match).values([
+            {**match, "scored_at": func.now()} for match in matches[start:start + INSERT_BATCH_SIZE]
+        ])
+
+
+def score_deltas_statements(tournament_id: UUID, deltas: dict):
+    """
+    Apply the {user_id: points} deltas of a tournament with UPDATE ... FROM (VALUES),
+    INSERT_BATCH_SIZE players per statement to stay below the bind parameters limit.
+    """
+    items = list(deltas.items())
+    for start in range(0, len(items), INSERT_BATCH_SIZE):
+        delta_rows = (
+            values(
+                column("user_id", PG_UUID(as_uuid=True)), column("points", Integer), name="deltas"
+            )
+            .data(items[start:start + INSERT_BATCH_SIZE])
+        )
+        yield (
+            update(models.tournament_user)
+            .where(models.tournament_user.c.tournament_id == tournament_id)
+            .where(models.tournament_user.c.user_id == delta_rows.c.user_id)
+            .values(score=models.tournament_user.c.score + delta_rows.c.points)
+        )
+
+
+def players_score_sync_statement(tournament_id: UUID):
+    """Rebuild the players_score JSONB from the ranked scores."""
+    scores = (
+        select(
+            func.coalesce(
+                func.jsonb_object_agg(
+                    cast(models.tournament_user.c.user_id, String),
+                    models.tournament_user.c.score
+                ),
+                cast("{}", models.Tournament.players_score.type)
+            )
+        )
+        .where(models.tournament_user.c.tournament_id == tournament_id)
+        .scalar_subquery()
+    )
+    return (
+        update(models.Tournament)
+        .where(models.Tournament.id == tournament_id)
+        .values(players_score=scores)
+    )
+
+
+def played_round(db_tournament: schemas.Tournament, pairing, round: int, matches: list, byes: list):
+    return schemas.Round(
+        tournament_id=db_tournament.id,
+        pairing=pairing,
+        round=round,
+        matches=[schemas.Match(**match) for match in matches],
+        byes=byes
+    )
+
+
+def payout_marker_statement(tournament_id: UUID):
+    return (
+        update(models.Tournament)
+        .where(models.Tournament.id == tournament_id)
+        .where(models.Tournament.paid_out_at.is_(None))
+        .where(models.Tournament.end <= func.now())
+        .values(paid_out_at=func.now())
+        .returning(models.Tournament.paid_out_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _payouts(tournament_id: UUID):
+    """(user_id, reward) of every rewarded position of the final standings."""
+    rewarded_positions = (
+        select(func.max(models.TournamentReward.position))
+        .where(models.TournamentReward.tournament_id == tournament_id)
+        .scalar_subquery()
+    )
+    standings = (
+        select(
+            models.tournament_user.c.user_id,
+            func.row_number().over(
+                order_by=(models.tournament_user.c.score.desc(), models.tournament_user.c.user_id)
+            ).label("position")
+        )
+        .where(models.tournament_user.c.tournament_id == tournament_id)
+        .order_by(models.tournament_user.c.score.desc(), models.tournament_user.c.user_id)
+        .limit(rewarded_positions)
+        .subquery()
+    )
+    return (
+        select(standings.c.user_id, models.TournamentReward.reward)
+        .join(models.TournamentReward, models.TournamentReward.position == standings.c.position)
+        .where(models.TournamentReward.tournament_id == tournament_id)
+        .subquery()
+    )
+
+
+def payout_lock_statement(tournament_id: UUID):
+    """
+    Lock the rewarded users in id order: an UPDATE ... FROM locks them in
+    join order, which deadlocks concurrent payouts sharing players.
+    """
+    return (
+        select(models.User.id)
+        .where(models.User.id.in_(select(_payouts(tournament_id).c.user_id)))
+        .order_by(models.User.id)
+        .with_for_update()
+    )
+
+
+def payout_statement(tournament_id: UUID):
+    """Credit every rewarded position of the final standings in one UPDATE ... FROM."""
+    payouts = _payouts(tournament_id)
+    return (
+        update(models.User)
+        .where(models.User.id == payouts.c.user_id)
+        .values(points=func.coalesce(models.User.points, 0) + payouts.c.reward)
+        .returning(models.User.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def already_paid(db_tournament: schemas.Tournament):
+    if db_tournament.paid_out_at is None:
+        # Left unmarked by the statement above: the tournament has not ended.
+        raise HTTPException(status_code=406, detail="Tournament has not ended yet.")
+    return schemas.Payout(
+        tournament_id=db_tournament.id,
+        paid_out_at=db_tournament.paid_out_at,
+        players_paid=0,
+        already_paid=True
+    )
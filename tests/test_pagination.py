@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, MetaData, Table
+from sqlalchemy.dialects import postgresql
+import pytest
+
+from pagination import _after
+
+rows = Table(
+    "t", MetaData(),
+    Column("points", Integer, nullable=True),
+    Column("id", Integer, primary_key=True)
+)
+
+
+def _sql(expression):
+    return str(expression.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    ))
+
+
+@pytest.mark.parametrize("columns, values, descending, sql", [
+    ((rows.c.id,), [5], False, "(t.id) > (5)"),
+    ((rows.c.id,), [5], True, "(t.id) < (5)"),
+    # NULLs sort last ascending: they follow every value.
+    ((rows.c.points, rows.c.id), [3, 7], False, "(t.points, t.id) > (3, 7) OR t.points IS NULL"),
+    ((rows.c.points, rows.c.id), [None, 7], False, "t.points IS NULL AND (t.id) > (7)"),
+    # And first descending: they precede every value.
+    ((rows.c.points, rows.c.id), [3, 7], True, "(t.points, t.id) < (3, 7)"),
+    (
+        (rows.c.points, rows.c.id), [None, 7], True,
+        "t.points IS NULL AND (t.id) < (7) OR t.points IS NOT NULL"
+    ),
+])
+def test_after(columns, values, descending, sql):
+    assert _sql(_after(columns, values, descending)) == sql
@@ -0,0 +1,78 @@
+import itertools
+import random
+
+import pytest
+
+import rounds
+
+
+@pytest.mark.parametrize("players", [0, 1, 2, 3, 4, 5, 6, 7, 10])
+def test_round_robin_meets_every_opponent_once(players):
+    ids = list(range(players))
+    round_count = max(players - 1 + players % 2, 1)
+    met, byes = [], []
+    for round_number in range(1, round_count + 1):
+        pairs, round_byes = rounds.round_robin_pairings(ids, round_number)
+        seated = [player for pair in pairs for player in pair] + round_byes
+        assert sorted(seated) == ids
+        assert len(round_byes) == (players % 2 if players > 1 else players)
+        met += [frozenset(pair) for pair in pairs]
+        byes += round_byes
+    assert sorted(met, key=sorted) == sorted(
+        (frozenset(pair) for pair in itertools.combinations(ids, 2)), key=sorted
+    )
+    if players > 1 and players % 2:
+        assert sorted(byes) == ids
+
+
+def test_round_robin_wraps_around():
+    assert rounds.round_robin_pairings([1, 2, 3, 4], 4) == rounds.round_robin_pairings(
+        [1, 2, 3, 4], 1
+    )
+
+
+@pytest.mark.parametrize("standings, played, pairs, byes", [
+    ([], set(), [], []),
+    ([1], set(), [], [1]),
+    ([1, 2, 3, 4], set(), [(1, 2), (3, 4)], []),
+    # The lowest ranked player sits out.
+    ([1, 2, 3, 4, 5], set(), [(1, 2), (3, 4)], [5]),
+    # Rematches are avoided...
+    ([1, 2, 3, 4], {frozenset((1, 2))}, [(1, 3), (2, 4)], []),
+    ([1, 2, 3, 4, 5], {frozenset((1, 2)), frozenset((1, 3))}, [(1, 4), (2, 3)], [5]),
+    # ...unless every opponent left was already met.
+    ([1, 2], {frozenset((1, 2))}, [(1, 2)], []),
+    ([1, 2, 3, 4], {frozenset((1, other)) for other in (2, 3, 4)}, [(1, 2), (3, 4)], []),
+])
+def test_swiss_pairings(standings, played, pairs, byes):
+    assert rounds.swiss_pairings(standings, played) == (pairs, byes)
+
+
+def test_play_matches_results_follow_scores():
+    pairs = [(i, i + 1) for i in range(0, 200, 2)]
+    matches = rounds.play_matches(pairs, random.Random(0))
+    assert [(m["player_one_id"], m["player_two_id"]) for m in matches] == pairs
+    for match in matches:
+        assert 5 <= match["score_one"] <= 100 and 5 <= match["score_two"] <= 100
+        expected = "DRAW"
+        if match["score_one"] > match["score_two"]:
+            expected = "PLAYER1"
+        elif match["score_one"] < match["score_two"]:
+            expected = "PLAYER2"
+        assert match["result"] == expected
+
+
+def _match(one, two, result):
+    return {"player_one_id": one, "player_two_id": two, "result": result}
+
+
+@pytest.mark.parametrize("matches, byes, deltas", [
+    ([], [], {}),
+    ([], ["a"], {"a": rounds.BYE_POINTS}),
+    ([_match("a", "b", "PLAYER1")], [], {"a": 3, "b": 0}),
+    ([_match("a", "b", "PLAYER2")], [], {"a": 0, "b": 3}),
+    ([_match("a", "b", "DRAW")], ["c"], {"a": 1, "b": 1, "c": 3}),
+    ([_match("a", "b", "PLAYER1"), _match("a", "c", "DRAW")], [], {"a": 4, "b": 0, "c": 1}),
+])
+def test_score_deltas(matches, byes, deltas):
+    assert rounds.score_deltas(matches, byes) == deltas
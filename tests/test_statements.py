@@ -0,0 +1,25 @@
+import pytest
+
+import statements
+
+
+@pytest.mark.parametrize("rewards_range, table", [
+    ({}, {}),
+    ({"1-1": 100}, {1: 100}),
+    ({"1-1": 100, "2-3": 50}, {1: 100, 2: 50, 3: 50}),
+    ({"4-5": 10, "1-2": 30}, {4: 10, 5: 10, 1: 30, 2: 30}),
+])
+def test_rewards_table(rewards_range, table):
+    assert statements.rewards_table(rewards_range) == table
+
+
+@pytest.mark.parametrize("rewards_range, message", [
+    ({"0-2": 10}, "empty or does not start at 1"),
+    ({"3-2": 10}, "empty or does not start at 1"),
+    ({"1-2": 10, "2-3": 5}, "rewarded by several ranges"),
+    ({"a-b": 10}, "invalid literal"),
+    ({"5": 10}, "not enough values"),
+])
+def test_rewards_table_rejects(rewards_range, message):
+    with pytest.raises(ValueError, match=message):
+        statements.rewards_table(rewards_range)